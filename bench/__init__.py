@@ -0,0 +1,3 @@
+"""
+Benchmarks offline: servidor stub compativel com Chat Completions e runner.
+"""
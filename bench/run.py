@@ -0,0 +1,337 @@
+"""
+Benchmark offline dos padroes de request de main.py.
+
+Sobe o servidor stub local e executa cada padrao contra ele via `base_url`:
+
+- single_request:        uma chamada simples (base_request)
+- classifier_loop:       um texto por request, em serie (classificador classico)
+- classifier_concurrent: os mesmos textos pelo motor assincrono (llm.engine)
+- structured_output:     json_schema + json.loads
+- tool_round_trip:       chamada com tools -> executa a tool -> segunda chamada
+- streaming:             stream=True, com TTFT
+
+Resultados (throughput e p50/p95/p99 de latencia) vao para um JSON com o
+commit atual, para comparar entre versoes:
+
+    python -m bench.run --output bench_results.json
+    python -m bench.run --compare bench_results.json --max-regression 0.2
+"""
+import argparse
+import json
+import math
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from bench.stub_server import StubConfig, StubServer
+from llm.engine import AsyncEngine
+from llm.streaming import stream_completion
+
+MODEL = "gpt-4o-mini"
+TEXTS = [
+    "O sistema travou e perdi meu trabalho",
+    "Gostaria de poder exportar em PDF",
+    "Voces sao os melhores, parabens!",
+    "O sistema esta cobrando imposto errado no boleto.",
+]
+WEATHER_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "get_weather",
+        "description": "Obtem o clima atual de uma cidade",
+        "parameters": {
+            "type": "object",
+            "properties": {"city": {"type": "string"}},
+            "required": ["city"],
+        },
+    },
+}
+PERSON_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "person",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "nome": {"type": "string"},
+                "idade": {"type": "number"},
+                "cidade": {"type": "string"},
+            },
+            "required": ["nome", "idade", "cidade"],
+        },
+    },
+}
+
+
+def percentile(values, q: float) -> float:
+    """Percentil com interpolacao linear (q entre 0 e 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies, elapsed: float, errors: int, ttfts=None) -> dict:
+    def stats(values):
+        return {
+            "mean": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+            "p50": round(percentile(values, 50) * 1000, 3),
+            "p95": round(percentile(values, 95) * 1000, 3),
+            "p99": round(percentile(values, 99) * 1000, 3),
+        }
+
+    result = {
+        "ops": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_ops_s": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_ms": stats(latencies),
+    }
+    if ttfts is not None:
+        result["ttft_ms"] = stats(ttfts)
+    return result
+
+
+# =========================
+# CENARIOS
+# =========================
+
+def _timed_loop(iterations: int, op):
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        try:
+            op(i)
+        except openai.APIError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start, errors
+
+
+def bench_single_request(client, iterations):
+    def op(_):
+        client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Você é um engenheiro de software sênior."},
+                {"role": "user", "content": "Explique o que é Docker em uma frase."},
+            ],
+        )
+    return summarize(*_timed_loop(iterations, op))
+
+
+def _classifier_call(text):
+    return dict(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": "Classifique: BUG, FEATURE, ELOGIO ou OUTRO. Responda so a categoria."},
+            {"role": "user", "content": text},
+        ],
+        temperature=0,
+        max_tokens=5,
+        stop=["\n"],
+    )
+
+
+def bench_classifier_loop(client, iterations):
+    def op(i):
+        client.chat.completions.create(**_classifier_call(TEXTS[i % len(TEXTS)]))
+    return summarize(*_timed_loop(iterations, op))
+
+
+def bench_classifier_concurrent(base_url, iterations, concurrency):
+    latencies = []
+    errors = 0
+
+    def client_factory():
+        return AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+
+    async def timed_create(**kwargs):
+        t0 = time.perf_counter()
+        response = await engine.client.chat.completions.create(**kwargs)
+        latencies.append(time.perf_counter() - t0)
+        return response
+
+    engine = AsyncEngine(concurrency=concurrency, client_factory=client_factory, create=timed_create)
+    try:
+        start = time.perf_counter()
+        futures = [engine.submit(**_classifier_call(TEXTS[i % len(TEXTS)])) for i in range(iterations)]
+        for future in futures:
+            try:
+                future.result()
+            except openai.APIError:
+                errors += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.close()
+    return summarize(latencies, elapsed, errors)
+
+
+def bench_structured_output(client, iterations):
+    def op(_):
+        resp = client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Extraia dados do texto."},
+                {"role": "user", "content": "João tem 32 anos e mora em Recife."},
+            ],
+            response_format=PERSON_SCHEMA,
+            temperature=0,
+        )
+        json.loads(resp.choices[0].message.content)
+    return summarize(*_timed_loop(iterations, op))
+
+
+def bench_tool_round_trip(client, iterations):
+    def op(_):
+        messages = [
+            {"role": "system", "content": "Você é um assistente que informa o clima usando ferramentas quando necessário."},
+            {"role": "user", "content": "Como esta o clima em Recife?"},
+        ]
+        msg = client.chat.completions.create(
+            model=MODEL, messages=messages, tools=[WEATHER_TOOL], tool_choice="auto", temperature=0
+        ).choices[0].message
+        messages.append(msg)
+        for tool_call in msg.tool_calls or []:
+            args = json.loads(tool_call.function.arguments)
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": json.dumps({"city": args["city"], "weather": "28°C, ensolarado"}),
+            })
+        client.chat.completions.create(model=MODEL, messages=messages, temperature=0)
+    return summarize(*_timed_loop(iterations, op))
+
+
+def bench_streaming(client, iterations):
+    ttfts = []
+
+    def op(_):
+        result = stream_completion(
+            create=client.chat.completions.create,
+            model=MODEL,
+            messages=[{"role": "user", "content": "Explique o que e machine learning de forma completa."}],
+            temperature=0.3,
+        )
+        ttfts.append(result.metrics.ttft)
+    latencies, elapsed, errors = _timed_loop(iterations, op)
+    return summarize(latencies, elapsed, errors, ttfts=ttfts)
+
+
+# =========================
+# EXECUCAO
+# =========================
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(config: StubConfig, iterations: int, concurrency: int) -> dict:
+    with StubServer(config) as server:
+        client = OpenAI(base_url=server.base_url, api_key="stub", max_retries=0)
+        # Aquece a conexao para nao medir o primeiro connect
+        client.chat.completions.create(model=MODEL, messages=[{"role": "user", "content": "ping"}], max_tokens=1)
+
+        scenarios = {
+            "single_request": lambda: bench_single_request(client, iterations),
+            "classifier_loop": lambda: bench_classifier_loop(client, iterations),
+            "classifier_concurrent": lambda: bench_classifier_concurrent(server.base_url, iterations, concurrency),
+            "structured_output": lambda: bench_structured_output(client, iterations),
+            "tool_round_trip": lambda: bench_tool_round_trip(client, iterations),
+            "streaming": lambda: bench_streaming(client, iterations),
+        }
+        results = {}
+        for name, scenario in scenarios.items():
+            results[name] = scenario()
+            print(
+                f"{name:<24} {results[name]['throughput_ops_s']:>9.1f} ops/s   "
+                f"p50={results[name]['latency_ms']['p50']:.1f}ms   "
+                f"p95={results[name]['latency_ms']['p95']:.1f}ms   "
+                f"p99={results[name]['latency_ms']['p99']:.1f}ms   "
+                f"errors={results[name]['errors']}"
+            )
+        client.close()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "openai": openai.__version__,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "stub": asdict(config),
+        "scenarios": results,
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> bool:
+    """Imprime a variacao de p50/p95 contra um resultado anterior. Retorna False se houver regressao."""
+    ok = True
+    print(f"\nComparacao com {baseline.get('commit', '?')}:")
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric in ("p50", "p95"):
+            before, after = previous["latency_ms"][metric], result["latency_ms"][metric]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > max_regression:
+                flag = "  <-- REGRESSAO"
+                ok = False
+            print(f"  {name:<24} {metric}: {before:.1f}ms -> {after:.1f}ms ({change:+.1%}){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline dos padroes de Chat Completions")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--ttft", type=float, default=StubConfig.ttft)
+    parser.add_argument("--token-delay", type=float, default=StubConfig.token_delay)
+    parser.add_argument("--completion-tokens", type=int, default=StubConfig.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON de uma execucao anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Aumento relativo maximo de p50/p95 aceito no --compare (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    results = run(config, args.iterations, args.concurrency)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados em {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+"""
+Servidor local compativel com a API de Chat Completions (apenas para testes
+e benchmarks - nenhuma chamada sai para a rede).
+
+Simula:
+- TTFT e atraso por token configuraveis
+- taxa de erro (HTTP 500)
+- respostas com streaming (SSE), incluindo o chunk final de usage
+- tool calls (quando a request tem `tools` e a ultima mensagem nao e de tool)
+- json_schema (gera um objeto valido a partir do schema)
+- cache de prefixo do prompt: a partir de 1024 tokens, um prefixo (tools,
+  response_format e todas as mensagens menos a ultima) ja visto volta em
+  `usage.prompt_tokens_details.cached_tokens`, em blocos de 128 tokens
+- Batch API: upload de arquivos (/files), criacao e consulta de batches
+  (/batches) e download dos resultados (/files/{id}/content). O batch passa
+  por validating -> in_progress -> completed em `batch_delay` segundos e
+  cada linha e respondida como uma chamada normal (falhas de `error_rate`
+  vao para o arquivo de erros)
+- embeddings (/embeddings): n-gramas de caracteres com hashing, entao
+  parafrases com palavras em comum ficam proximas (sem semantica real)
+
+Uso:
+    with StubServer(StubConfig(ttft=0.05, token_delay=0.005)) as server:
+        client = OpenAI(base_url=server.base_url, api_key="stub")
+
+Ou como processo separado:
+    python -m bench.stub_server --port 8000 --ttft 0.05
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "o modelo gera uma resposta curta para o benchmark local sem rede".split()
+
+
+@dataclass
+class StubConfig:
+    ttft: float = 0.02             # segundos ate o primeiro token
+    token_delay: float = 0.002     # segundos por token gerado
+    completion_tokens: int = 32    # tamanho padrao da resposta (limitado por max_tokens)
+    error_rate: float = 0.0        # fracao de requests que retornam 500
+    batch_delay: float = 0.2       # segundos ate um batch ficar pronto
+    seed: int = None
+
+
+def schema_instance(schema: dict):
+    """Gera um valor minimo que satisfaz o schema (object/array/string/number/...)."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: schema_instance(sub) for name, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [schema_instance(schema.get("items", {}))]
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return "x"
+
+
+def _count_tokens(body: dict) -> int:
+    chars = sum(len(json.dumps(m, default=str)) for m in body.get("messages", []))
+    return max(1, chars // 4)
+
+
+EMBEDDING_DIM = 256
+
+
+def _embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """Vetor normalizado de trigramas de caracteres (sem acentos, minusculo) com hashing."""
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode()
+    vector = [0.0] * dim
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode()) % dim] += 1.0
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return [x / norm for x in vector]
+
+
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK = 128
+
+
+def _prefix(body: dict) -> tuple:
+    """(texto do prefixo, tokens) - tudo que vem antes da ultima mensagem."""
+    head = {k: body.get(k) for k in ("tools", "response_format")}
+    messages = body.get("messages", [])[:-1]
+    text = json.dumps(head, sort_keys=True) + "".join(json.dumps(m, default=str) for m in messages)
+    return text, sum(len(json.dumps(m, default=str)) for m in messages) // 4
+
+
+def _plan(body: dict, config: StubConfig):
+    """Decide o que responder: (content, tool_calls, n_tokens, finish_reason)."""
+    limit = body.get("max_completion_tokens") or body.get("max_tokens")
+
+    messages = body.get("messages", [])
+    wants_tool = (
+        body.get("tools")
+        and body.get("tool_choice") != "none"
+        and messages and messages[-1].get("role") != "tool"
+    )
+    if wants_tool:
+        function = body["tools"][0]["function"]
+        arguments = json.dumps(schema_instance(function.get("parameters", {})))
+        tool_calls = [{
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": arguments},
+        }]
+        return None, tool_calls, max(1, len(arguments) // 4), "tool_calls"
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps(schema_instance(response_format["json_schema"].get("schema", {})))
+        return content, None, max(1, len(content) // 4), "stop"
+
+    n_tokens = config.completion_tokens
+    finish_reason = "stop"
+    if limit is not None and limit < n_tokens:
+        n_tokens, finish_reason = limit, "length"
+    content = " ".join(WORDS[i % len(WORDS)] for i in range(n_tokens))
+    return content, None, n_tokens, finish_reason
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como a API real
+    server_version = "ChatCompletionsStub/1.0"
+    # Headers e body saem em writes separados; sem TCP_NODELAY o Nagle +
+    # delayed ACK somam ~40ms a cada resposta e distorcem o benchmark.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    # ---- helpers ----
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, payload):
+        data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _not_found(self, message=None):
+        self._send_json(404, {"error": {"message": message or f"Rota desconhecida: {self.path}", "type": "not_found"}})
+
+    # ---- endpoints ----
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.rstrip("/")
+        stub = self.server.stub
+
+        if path.endswith("/files"):
+            self._upload(raw, stub)
+            return
+        if path.endswith("/batches"):
+            batch = stub.create_batch(json.loads(raw or b"{}"))
+            if batch is None:
+                self._not_found("input_file_id desconhecido")
+            else:
+                self._send_json(200, batch)
+            return
+        if path.endswith("/embeddings"):
+            self._send_json(200, stub.embeddings(json.loads(raw or b"{}")))
+            return
+        if not path.endswith("/chat/completions"):
+            self._not_found()
+            return
+
+        body = json.loads(raw or b"{}")
+        if stub.random() < stub.config.error_rate:
+            self._send_json(500, {"error": {"message": "Erro simulado", "type": "server_error"}})
+            return
+
+        if body.get("stream"):
+            self._stream(body, stub)
+        else:
+            self._complete(body, stub)
+
+    def do_GET(self):
+        stub = self.server.stub
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "batches":
+            batch = stub.batches.get(parts[-1])
+            self._send_json(200, batch) if batch else self._not_found("batch desconhecido")
+        elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+            entry = stub.files.get(parts[-2])
+            if entry is None:
+                self._not_found("arquivo desconhecido")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(entry["content"])))
+            self.end_headers()
+            self.wfile.write(entry["content"])
+        elif len(parts) >= 2 and parts[-2] == "files":
+            entry = stub.files.get(parts[-1])
+            self._send_json(200, entry["meta"]) if entry else self._not_found("arquivo desconhecido")
+        else:
+            self._not_found()
+
+    def _upload(self, raw: bytes, stub):
+        # multipart/form-data com os campos `purpose` e `file`
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("latin-1") + raw
+        )
+        fields, content, filename = {}, b"", "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True) or b""
+                filename = part.get_filename() or filename
+            else:
+                fields[name] = part.get_content().strip()
+        self._send_json(200, stub.add_file(content, filename, fields.get("purpose", "batch")))
+
+    def _complete(self, body, stub):
+        _, _, n_tokens, _ = plan = _plan(body, stub.config)
+        time.sleep(stub.config.ttft + n_tokens * stub.config.token_delay)
+        self._send_json(200, stub.completion(body, plan))
+
+    def _stream(self, body, stub):
+        content, tool_calls, n_tokens, finish_reason = _plan(body, stub.config)
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+        }
+
+        def chunk(delta, finish=None):
+            return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(stub.config.ttft)
+        self._send_chunk(chunk({"role": "assistant", "content": ""}))
+
+        if tool_calls:
+            for index, call in enumerate(tool_calls):
+                arguments = call["function"]["arguments"]
+                half = len(arguments) // 2
+                self._send_chunk(chunk({"tool_calls": [{
+                    "index": index, "id": call["id"], "type": "function",
+                    "function": {"name": call["function"]["name"], "arguments": arguments[:half]},
+                }]}))
+                time.sleep(stub.config.token_delay)
+                self._send_chunk(chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[half:]}}]}))
+        else:
+            pieces = content.split(" ")
+            # Quando o conteudo nao e texto corrido (json_schema), manda em pedacos de ~4 caracteres
+            if len(pieces) < n_tokens:
+                pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+            else:
+                pieces = [p if i == 0 else " " + p for i, p in enumerate(pieces)]
+            for piece in pieces:
+                time.sleep(stub.config.token_delay)
+                self._send_chunk(chunk({"content": piece}))
+
+        self._send_chunk(chunk({}, finish_reason))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_chunk({**base, "choices": [], "usage": stub.usage(body, n_tokens)})
+        self._send_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # O backlog padrao (5) descarta SYNs quando muitos clientes conectam juntos
+    request_queue_size = 128
+
+
+BATCH_TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+
+class StubServer:
+    """Sobe o servidor numa thread de fundo. `base_url` aponta para /v1."""
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        self._random = random.Random(self.config.seed)
+        self._random_lock = threading.Lock()
+        self._prefixes = set()
+        self.files = {}      # id -> {"meta": objeto file, "content": bytes}
+        self.batches = {}    # id -> objeto batch
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def random(self) -> float:
+        with self._random_lock:
+            return self._random.random()
+
+    def cached_tokens(self, body: dict, prompt_tokens: int) -> int:
+        if prompt_tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        text, tokens = _prefix(body)
+        with self._random_lock:
+            seen = text in self._prefixes
+            self._prefixes.add(text)
+        return tokens // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK if seen else 0
+
+    def usage(self, body: dict, n_tokens: int) -> dict:
+        prompt_tokens = _count_tokens(body)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": n_tokens,
+            "total_tokens": prompt_tokens + n_tokens,
+            "prompt_tokens_details": {"cached_tokens": self.cached_tokens(body, prompt_tokens)},
+        }
+
+    def embeddings(self, body: dict) -> dict:
+        texts = body.get("input")
+        texts = [texts] if isinstance(texts, str) else texts
+        dim = body.get("dimensions") or EMBEDDING_DIM
+        tokens = sum(max(1, len(text) // 4) for text in texts)
+        return {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(text, dim)} for i, text in enumerate(texts)],
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def completion(self, body: dict, plan=None) -> dict:
+        """Objeto chat.completion (sem atraso) para a request."""
+        content, tool_calls, n_tokens, finish_reason = plan or _plan(body, self.config)
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        choices = [
+            {"index": i, "message": message, "finish_reason": finish_reason, "logprobs": None}
+            for i in range(body.get("n", 1))
+        ]
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": choices,
+            "usage": self.usage(body, n_tokens * len(choices)),
+        }
+
+    # ---- Batch API ----
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        meta = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[meta["id"]] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, request: dict):
+        if request.get("input_file_id") not in self.files:
+            return None
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": request.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "expires_at": now + 24 * 3600,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch,), name="stub-batch", daemon=True).start()
+        return batch
+
+    def _run_batch(self, batch: dict):
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        time.sleep(self.config.batch_delay / 2)
+        batch.update(status="in_progress", in_progress_at=int(time.time()))
+        batch["request_counts"]["total"] = len(lines)
+
+        output, errors = [], []
+        for line in filter(None, lines):
+            item = json.loads(line)
+            result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": item["custom_id"]}
+            if self.random() < self.config.error_rate:
+                result.update(response={"status_code": 500, "request_id": uuid.uuid4().hex,
+                                        "body": {"error": {"message": "Erro simulado", "type": "server_error"}}},
+                              error=None)
+                errors.append(result)
+                batch["request_counts"]["failed"] += 1
+            else:
+                result.update(response={"status_code": 200, "request_id": uuid.uuid4().hex,
+                                        "body": self.completion(item["body"])},
+                              error=None)
+                output.append(result)
+                batch["request_counts"]["completed"] += 1
+
+        time.sleep(self.config.batch_delay / 2)
+        for field, results in (("output_file_id", output), ("error_file_id", errors)):
+            if results:
+                content = "".join(json.dumps(r) + "\n" for r in results).encode("utf-8")
+                batch[field] = self.add_file(content, f"{batch['id']}_{field}.jsonl", "batch_output")["id"]
+        batch.update(status="completed", completed_at=int(time.time()))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local compativel com Chat Completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=StubConfig.ttft)
+    parser.add_argument("--token-delay", type=float, default=StubConfig.token_delay)
+    parser.add_argument("--completion-tokens", type=int, default=StubConfig.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--batch-delay", type=float, default=StubConfig.batch_delay)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        batch_delay=args.batch_delay,
+        seed=args.seed,
+    )
+    server = StubServer(config, host=args.host, port=args.port)
+    print(f"Stub em {server.base_url} ({asdict(config)})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Linha de comando dos demos de main.py.
+
+    python -m cli list                          # demos disponiveis
+    python -m cli run demo_temperature          # um demo
+    python -m cli run "demo_temp*" demo_top_p   # varios (aceita curingas) no mesmo processo
+    python -m cli run all --concurrency 8 --model gpt-4.1-mini --metrics metrics.prom
+    python -m cli run all --record cassettes/demos.jsonl     # grava
+    python -m cli run all --replay cassettes/demos.jsonl     # reproduz sem rede
+
+Os demos sao descobertos lendo main.py (ast) sem importa-lo: `list` e
+`--help` nao carregam o SDK nem montam o pipeline. So `run` importa main.py,
+e o cliente OpenAI ainda assim so e criado na primeira chamada que chega a
+API (hits de cache nao criam).
+
+As opcoes viram as variaveis de ambiente que main.py e llm/ ja leem
+(CHAT_MODEL, CHAT_CONCURRENCY, CHAT_CACHE_PATH, CHAT_BUDGET_USD,
+CHAT_METRICS_PATH, CHAT_CASSETTE, CHAT_SEMANTIC_CACHE...). Elas e o .env sao
+aplicados antes de main.setup(), que monta o pipeline: importar main.py nao le
+o ambiente.
+"""
+import argparse
+import ast
+import difflib
+import fnmatch
+import importlib
+import os
+import time
+
+from dotenv import load_dotenv
+
+DEMOS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+# Funcoes de main.py que nao sao demos
+HELPERS = {"setup", "run_demo", "report", "get_weather"}
+
+
+def discover(path: str = DEMOS_FILE) -> dict:
+    """{nome: primeira linha da docstring} dos demos, na ordem do arquivo."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    demos = {}
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef) or node.name.startswith("_") or node.name in HELPERS:
+            continue
+        # Demo = funcao publica que roda sem argumentos
+        args = node.args
+        if len(args.args) - len(args.defaults) > 0 or any(d is None for d in args.kw_defaults):
+            continue
+        doc = ast.get_docstring(node) or ""
+        demos[node.name] = doc.split("\n")[0].split(". ")[0] if doc else ""
+    return demos
+
+
+def select(patterns, demos: dict) -> list:
+    """Nomes que casam com os padroes (na ordem pedida, sem repetir)."""
+    selected = []
+    for pattern in patterns:
+        matches = list(demos) if pattern == "all" else fnmatch.filter(demos, pattern)
+        if not matches:
+            hint = difflib.get_close_matches(pattern, demos, n=3)
+            raise SystemExit(f"Demo desconhecido: {pattern}" + (f" (quis dizer {', '.join(hint)}?)" if hint else ""))
+        selected.extend(name for name in matches if name not in selected)
+    return selected
+
+
+def _options(args) -> dict:
+    options = {
+        "CHAT_MODEL": args.model,
+        "CHAT_CONCURRENCY": args.concurrency,
+        "CHAT_CACHE_PATH": args.cache_path,
+        "CHAT_BUDGET_USD": args.budget,
+        "CHAT_METRICS_PATH": args.metrics,
+        "CHAT_CASSETTE": args.record or args.replay,
+        "CHAT_CASSETTE_MODE": "record" if args.record else "replay" if args.replay else None,
+        "CHAT_CASSETTE_TIMING": args.timing,
+        "CHAT_SEMANTIC_CACHE": args.semantic_cache,
+        "CHAT_ROUTER": args.router,
+    }
+    return {name: str(value) for name, value in options.items() if value is not None}
+
+
+def run(names, module=None):
+    """Importa main.py (uma vez) e executa os demos em sequencia no mesmo processo."""
+    if module is None:
+        module = importlib.import_module("main")
+    # Monta o pipeline agora, com o .env e as opcoes ja no ambiente
+    module.setup()
+    for name in names:
+        start = time.perf_counter()
+        module.run_demo(getattr(module, name))
+        print(f"\n[{name}: {time.perf_counter() - start:.2f}s]")
+    module.report()
+
+
+def main(argv=None, module=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Demos de Chat Completions.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="lista os demos de main.py")
+
+    run_parser = commands.add_parser("run", help="executa um ou mais demos")
+    run_parser.add_argument("demos", nargs="+", help="nomes, curingas (demo_temp*) ou 'all'")
+    run_parser.add_argument("--model", help="modelo de todos os demos (CHAT_MODEL)")
+    run_parser.add_argument("--concurrency", type=int, help="requests em voo no motor (CHAT_CONCURRENCY)")
+    run_parser.add_argument("--cache-path", help="SQLite do cache de respostas (CHAT_CACHE_PATH)")
+    run_parser.add_argument("--budget", type=float, help="orcamento em USD da execucao (CHAT_BUDGET_USD)")
+    run_parser.add_argument("--metrics", help="grava as metricas ao final (.prom ou .json)")
+    cassette = run_parser.add_mutually_exclusive_group()
+    cassette.add_argument("--record", metavar="CASSETE", help="grava as chamadas neste .jsonl")
+    cassette.add_argument("--replay", metavar="CASSETE", help="reproduz as chamadas deste .jsonl, sem rede")
+    run_parser.add_argument("--semantic-cache", metavar="PATH",
+                            help="cache semantico em PATH.npy/.sqlite ou 'memory' (CHAT_SEMANTIC_CACHE)")
+    run_parser.add_argument("--router", metavar="JSON", help="pool de modelos/endpoints do roteador (CHAT_ROUTER)")
+    run_parser.add_argument("--timing", choices=["instant", "original"], help="ritmo do replay (CHAT_CASSETTE_TIMING)")
+
+    args = parser.parse_args(argv)
+    demos = discover()
+
+    if args.command == "list":
+        width = max(map(len, demos), default=0)
+        for name, doc in demos.items():
+            print(f"{name:<{width}}  {doc}".rstrip())
+        return
+
+    names = select(args.demos, demos)
+    # Opcoes do CLI valem sobre o .env (load_dotenv nao sobrescreve o que ja esta definido)
+    os.environ.update(_options(args))
+    load_dotenv()
+    run(names, module)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+"""
+Blocos de producao para a API de Chat Completions usados pelos demos de main.py.
+"""
@@ -0,0 +1,261 @@
+"""
+Loop de agente com tool calling.
+
+A cada turno:
+1. uma chamada com `tools`
+2. se o modelo pediu ferramentas, TODAS as tool calls do turno rodam em
+   paralelo (thread pool para funcoes sincronas, asyncio para coroutines)
+3. a mensagem do assistente entra UMA vez no historico, seguida de todos os
+   resultados, e o loop faz UMA nova chamada
+4. repete ate o modelo responder sem tools ou atingir `max_steps`
+
+Ferramentas ficam num ToolRegistry (nada de `if name == "get_weather"`):
+
+    registry = ToolRegistry()
+
+    @registry.tool(description="Obtem o clima atual de uma cidade",
+                   parameters={"type": "object", "properties": {"city": {"type": "string"}}, "required": ["city"]})
+    def get_weather(city: str):
+        ...
+
+    result = run_agent(messages, registry)
+
+`messages` tambem pode ser um llm.memory.ConversationMemory: o historico
+completo fica nela e cada chamada envia so a janela que cabe no orcamento.
+
+Dentro de um event loop (codigo async) use `await arun_agent(...)`: as
+chamadas vao pelo motor assincrono (llm.engine) e as tools rodam no loop de
+quem chamou. O `run_agent` sincrono executa as tools no loop do motor, entao
+tambem funciona com outro loop rodando na thread.
+"""
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from llm.client import create_completion
+from llm.engine import get_engine
+from llm.memory import ConversationMemory
+from llm.streaming import stream_completion
+
+
+@dataclass
+class Tool:
+    name: str
+    func: object
+    description: str = ""
+    parameters: dict = field(default_factory=lambda: {"type": "object", "properties": {}})
+
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.func)
+
+    def definition(self) -> dict:
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools = {}
+
+    def register(self, func, name: str = None, description: str = None, parameters: dict = None) -> Tool:
+        tool = Tool(
+            name=name or func.__name__,
+            func=func,
+            description=description if description is not None else (inspect.getdoc(func) or ""),
+        )
+        if parameters is not None:
+            tool.parameters = parameters
+        self._tools[tool.name] = tool
+        return tool
+
+    def tool(self, name: str = None, description: str = None, parameters: dict = None):
+        """Decorator equivalente a register()."""
+        def decorator(func):
+            self.register(func, name=name, description=description, parameters=parameters)
+            return func
+        return decorator
+
+    def get(self, name: str) -> Tool:
+        return self._tools.get(name)
+
+    def definitions(self) -> list:
+        return [tool.definition() for tool in self._tools.values()]
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def __len__(self):
+        return len(self._tools)
+
+
+@dataclass
+class ToolExecution:
+    name: str
+    call_id: str
+    arguments: dict
+    result: object = None
+    error: str = None
+    elapsed: float = 0.0
+
+    def content(self) -> str:
+        payload = {"error": self.error} if self.error is not None else self.result
+        return payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+
+
+@dataclass
+class AgentResult:
+    content: str
+    messages: list
+    steps: int
+    finish_reason: str
+    executions: list = field(default_factory=list)
+
+
+# =========================
+# EXECUCAO DAS TOOLS
+# =========================
+
+async def _execute_one(registry, tool_call, pool) -> ToolExecution:
+    function = tool_call["function"]
+    execution = ToolExecution(name=function["name"], call_id=tool_call["id"], arguments={})
+    start = time.perf_counter()
+    try:
+        execution.arguments = json.loads(function["arguments"] or "{}")
+        tool = registry.get(execution.name)
+        if tool is None:
+            raise LookupError(f"Ferramenta desconhecida: {execution.name}")
+        if tool.is_async:
+            execution.result = await tool.func(**execution.arguments)
+        else:
+            loop = asyncio.get_running_loop()
+            execution.result = await loop.run_in_executor(pool, lambda: tool.func(**execution.arguments))
+    except Exception as exc:
+        # O erro volta para o modelo como resultado da tool, em vez de derrubar o agente
+        execution.error = f"{type(exc).__name__}: {exc}"
+    execution.elapsed = time.perf_counter() - start
+    return execution
+
+
+async def aexecute_tool_calls(registry: ToolRegistry, tool_calls, max_workers: int = 8) -> list:
+    """Executa as tool calls de um turno em paralelo no loop atual. Retorna ToolExecution na ordem das calls."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return await asyncio.gather(*(_execute_one(registry, call, pool) for call in tool_calls))
+
+
+def execute_tool_calls(registry: ToolRegistry, tool_calls, max_workers: int = 8) -> list:
+    """Versao sincrona: roda no loop do motor (llm.engine), mesmo que a thread ja tenha um loop rodando."""
+    engine = get_engine()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is not None and running is engine.loop:
+        raise RuntimeError("execute_tool_calls bloquearia o loop do motor; use aexecute_tool_calls/arun_agent")
+    return engine.run(aexecute_tool_calls(registry, tool_calls, max_workers)).result()
+
+
+# =========================
+# LOOP DO AGENTE
+# =========================
+
+def run_agent(
+    messages,
+    registry: ToolRegistry,
+    model: str = "gpt-4o-mini",
+    max_steps: int = 5,
+    stream: bool = False,
+    on_token=None,
+    create=None,
+    **params,
+) -> AgentResult:
+    """
+    Executa o loop de tool calling sobre `messages` (lista atualizada in-place,
+    ou ConversationMemory - nesse caso cada chamada usa memory.window()).
+
+    stream=True usa llm.streaming em cada chamada (on_token recebe o texto).
+    """
+    create = create or create_completion
+    executions = []
+    memory = messages if isinstance(messages, ConversationMemory) else None
+
+    for step in range(1, max_steps + 1):
+        request = _request(memory.window() if memory else messages, registry, model, params)
+        if stream:
+            streamed = stream_completion(on_token=on_token, create=create, **request)
+            message, finish_reason = streamed.to_message(), streamed.finish_reason
+        else:
+            message, finish_reason = _read_choice(create(**request))
+
+        tool_calls = message.get("tool_calls")
+        messages.append(message)
+        if not tool_calls:
+            return AgentResult(message.get("content"), memory.messages if memory else messages, step, finish_reason, executions)
+        _append_results(messages, executions, execute_tool_calls(registry, tool_calls))
+
+    return AgentResult(None, memory.messages if memory else messages, max_steps, "max_steps", executions)
+
+
+async def arun_agent(
+    messages,
+    registry: ToolRegistry,
+    model: str = "gpt-4o-mini",
+    max_steps: int = 5,
+    stream: bool = False,
+    on_token=None,
+    acreate=None,
+    **params,
+) -> AgentResult:
+    """
+    Versao async de run_agent, para quem ja esta num event loop.
+
+    Sem `acreate`, as chamadas vao pelo motor compartilhado (llm.engine, com as
+    camadas registradas) e sao aguardadas daqui; as tools rodam neste loop.
+    stream=True consome o stream sincrono numa thread, sem travar o loop.
+    """
+    if acreate is None:
+        def acreate(**kwargs):
+            return asyncio.wrap_future(get_engine().submit(**kwargs))
+    executions = []
+    memory = messages if isinstance(messages, ConversationMemory) else None
+
+    for step in range(1, max_steps + 1):
+        # A janela pode resumir o historico (uma chamada sincrona a API): fora do loop
+        request = _request(await memory.awindow() if memory else messages, registry, model, params)
+        if stream:
+            streamed = await asyncio.to_thread(stream_completion, on_token=on_token, **request)
+            message, finish_reason = streamed.to_message(), streamed.finish_reason
+        else:
+            message, finish_reason = _read_choice(await acreate(**request))
+
+        tool_calls = message.get("tool_calls")
+        messages.append(message)
+        if not tool_calls:
+            return AgentResult(message.get("content"), memory.messages if memory else messages, step, finish_reason, executions)
+        _append_results(messages, executions, await aexecute_tool_calls(registry, tool_calls))
+
+    return AgentResult(None, memory.messages if memory else messages, max_steps, "max_steps", executions)
+
+
+def _request(messages, registry, model, params) -> dict:
+    request = dict(model=model, messages=messages, **params)
+    if len(registry):
+        request.update(tools=registry.definitions(), tool_choice=params.get("tool_choice", "auto"))
+    return request
+
+
+def _read_choice(response):
+    choice = response.choices[0]
+    return choice.message.model_dump(exclude_none=True), choice.finish_reason
+
+
+def _append_results(messages, executions, turn):
+    # Uma mensagem do assistente por turno (ja no historico), seguida de todos os resultados
+    executions.extend(turn)
+    for execution in turn:
+        messages.append({"role": "tool", "tool_call_id": execution.call_id, "content": execution.content()})
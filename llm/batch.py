@@ -0,0 +1,362 @@
+"""
+Pipeline para a Batch API (processamento offline, metade do preco).
+
+Para trabalho em massa que nao precisa de resposta imediata (classificar
+milhares de textos, gerar descricoes...), o endpoint sincrono cobra o preco
+cheio e disputa o rate limit com o trafego interativo. A Batch API recebe um
+arquivo JSONL com as requests, processa em ate 24h pela metade do preco e
+devolve outro JSONL com os resultados.
+
+Etapas (cada uma grava o progresso em `state.json` no diretorio de
+trabalho - uma execucao interrompida continua de onde parou):
+
+1. prepare:   prompts (iterador) -> input.jsonl no formato da Batch API
+              ({custom_id, method, url, body}), escrito em streaming
+2. submit:    upload do arquivo (purpose="batch") e criacao do batch
+3. wait:      polling ate um estado final
+4. download:  resultados (e erros) baixados em streaming para o disco
+5. join:      results.jsonl com {custom_id, input, output, error}, juntando
+              pelo custom_id (os resultados chegam fora de ordem)
+
+O diretorio fica preso aos itens da primeira execucao: `state.json` guarda
+o hash do input.jsonl e rodar de novo com itens diferentes levanta
+ValueError (sem itens, so retoma). Resultados com um custom_id que nao
+esta no input viram linhas de erro no results.jsonl.
+
+Memoria limitada: nenhum arquivo e carregado inteiro. O join indexa so o
+offset de cada custom_id no arquivo de entrada e le as linhas sob demanda.
+
+Uso:
+    pipeline = BatchPipeline(".batch/tickets")
+    path = pipeline.run(
+        {"custom_id": f"t{i}", "messages": [...], "max_tokens": 5} for i, text in enumerate(texts)
+    )
+    for row in read_jsonl(path):
+        print(row["custom_id"], row["output"])
+
+Ou por linha de comando, a partir de um JSONL com um prompt por linha
+({"custom_id"?, "prompt" ou "messages", parametros...}):
+    python -m llm.batch prompts.jsonl --workdir .batch/run1 --model gpt-4o-mini
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+
+from llm.client import get_client
+
+ENDPOINT = "/v1/chat/completions"
+# A Batch API cobra metade do preco do endpoint sincrono
+BATCH_DISCOUNT = 0.5
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def read_jsonl(path: str):
+    """Itera as linhas de um JSONL sem carregar o arquivo (ignora uma ultima linha cortada)."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
+
+
+def _drop_partial_line(path: str):
+    """Corta uma ultima linha sem \\n (escrita interrompida) antes de voltar a anexar."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+def batch_line(custom_id: str, body: dict, url: str = ENDPOINT) -> dict:
+    return {"custom_id": custom_id, "method": "POST", "url": url, "body": body}
+
+
+def to_body(item: dict, defaults: dict = None) -> tuple:
+    """(custom_id, body) de um item {"custom_id"?, "prompt" ou "messages", parametros...}."""
+    item = dict(item)
+    custom_id = item.pop("custom_id", None)
+    prompt = item.pop("prompt", None)
+    if prompt is not None:
+        item["messages"] = [{"role": "user", "content": prompt}]
+    return custom_id, {**(defaults or {}), **item}
+
+
+def results_cost(path: str, pricing: dict = None) -> float:
+    """
+    Custo (com o desconto da Batch API) das linhas de um results.jsonl.
+
+    Linhas de modelos sem preco na tabela ficam de fora do total (custo
+    desconhecido), com um aviso listando os modelos.
+    """
+    from types import SimpleNamespace
+    from llm.cost import find_price
+
+    total = 0.0
+    unpriced = set()
+    for row in read_jsonl(path):
+        if row["usage"]:
+            price = find_price(row["input"]["model"], pricing)
+            if price is None:
+                unpriced.add(row["input"]["model"])
+                continue
+            usage = SimpleNamespace(prompt_tokens=row["usage"]["prompt_tokens"],
+                                    completion_tokens=row["usage"]["completion_tokens"])
+            total += price.usage_cost(usage)
+    if unpriced:
+        warnings.warn(f"Modelos sem preco na tabela (custo desconhecido, fora do total): {sorted(map(str, unpriced))}")
+    return total * BATCH_DISCOUNT
+
+
+class BatchPipeline:
+    """
+    Prepara, envia, acompanha e junta os resultados de um batch.
+
+    workdir:        diretorio com input.jsonl, output.jsonl, errors.jsonl,
+                    results.jsonl e state.json
+    poll_interval:  segundos entre consultas (cresce ate max_poll_interval)
+    defaults:       parametros aplicados a todos os bodies (ex: model)
+    """
+
+    def __init__(self, workdir: str, client=None, poll_interval: float = 30.0,
+                 max_poll_interval: float = 300.0, completion_window: str = "24h", defaults: dict = None):
+        self.workdir = workdir
+        self._client = client
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.completion_window = completion_window
+        self.defaults = defaults or {"model": "gpt-4o-mini"}
+        os.makedirs(workdir, exist_ok=True)
+        self.state = self._load_state()
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.workdir, name)
+
+    # ---- estado ----
+
+    def _load_state(self) -> dict:
+        if os.path.exists(self.path("state.json")):
+            with open(self.path("state.json"), encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self, **changes):
+        self.state.update(changes)
+        tmp = self.path("state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path("state.json"))
+
+    # ---- 1. prepare ----
+
+    def _input_hash(self) -> str:
+        # Workdirs anteriores ao hash no state.json: calcula a partir do arquivo
+        if "input_sha256" not in self.state:
+            digest = hashlib.sha256()
+            with open(self.path("input.jsonl"), "rb") as f:
+                for line in f:
+                    digest.update(line)
+            self._save_state(input_sha256=digest.hexdigest())
+        return self.state["input_sha256"]
+
+    def prepare(self, items) -> int:
+        """
+        Escreve input.jsonl a partir de um iterador de itens (so na primeira execucao).
+
+        Numa execucao retomada os itens sao conferidos pelo hash: diferentes
+        dos originais levantam ValueError; nenhum item so retoma.
+        """
+        count = 0
+        digest = hashlib.sha256()
+        tmp = self.path("input.jsonl.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for index, item in enumerate(items):
+                custom_id, body = to_body(item, self.defaults)
+                line = json.dumps(batch_line(custom_id or f"request-{index}", body), ensure_ascii=False) + "\n"
+                f.write(line)
+                digest.update(line.encode("utf-8"))
+                count += 1
+        if self.state.get("prepared"):
+            os.remove(tmp)
+            if count and digest.hexdigest() != self._input_hash():
+                raise ValueError(
+                    f"Itens diferentes dos do batch ja preparado em {self.workdir!r}; "
+                    "use outro diretorio de trabalho (ou apague este)"
+                )
+            return self.state["requests"]
+        os.replace(tmp, self.path("input.jsonl"))
+        self._save_state(prepared=True, requests=count, input_sha256=digest.hexdigest())
+        return count
+
+    # ---- 2. submit ----
+
+    def submit(self) -> str:
+        if not self.state.get("input_file_id"):
+            with open(self.path("input.jsonl"), "rb") as f:
+                uploaded = self.client.files.create(file=f, purpose="batch")
+            self._save_state(input_file_id=uploaded.id)
+        if not self.state.get("batch_id"):
+            batch = self.client.batches.create(
+                input_file_id=self.state["input_file_id"],
+                endpoint=ENDPOINT,
+                completion_window=self.completion_window,
+            )
+            self._save_state(batch_id=batch.id, status=batch.status)
+        return self.state["batch_id"]
+
+    # ---- 3. wait ----
+
+    def wait(self, on_poll=None):
+        """Consulta o batch ate um estado final. `on_poll(batch)` recebe cada consulta."""
+        interval = self.poll_interval
+        while True:
+            batch = self.client.batches.retrieve(self.state["batch_id"])
+            self._save_state(
+                status=batch.status,
+                output_file_id=batch.output_file_id,
+                error_file_id=batch.error_file_id,
+                request_counts=batch.request_counts.model_dump() if batch.request_counts else None,
+            )
+            if on_poll is not None:
+                on_poll(batch)
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            time.sleep(interval)
+            interval = min(interval * 1.5, self.max_poll_interval)
+
+    # ---- 4. download ----
+
+    def download(self):
+        """Baixa os arquivos de saida e de erros em streaming (cada um uma unica vez)."""
+        for field, name in (("output_file_id", "output.jsonl"), ("error_file_id", "errors.jsonl")):
+            file_id = self.state.get(field)
+            if not file_id or os.path.exists(self.path(name)):
+                continue
+            tmp = self.path(name + ".tmp")
+            with self.client.files.with_streaming_response.content(file_id) as response:
+                with open(tmp, "wb") as f:
+                    for chunk in response.iter_bytes():
+                        f.write(chunk)
+            os.replace(tmp, self.path(name))
+
+    # ---- 5. join ----
+
+    def _input_offsets(self) -> dict:
+        """custom_id -> offset da linha em input.jsonl (so ids e inteiros na memoria)."""
+        offsets = {}
+        with open(self.path("input.jsonl"), "rb") as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    return offsets
+                offsets[json.loads(line)["custom_id"]] = offset
+
+    def join(self) -> str:
+        """Grava results.jsonl; retomado do ponto em que parou (custom_ids ja escritos sao pulados)."""
+        out_path = self.path("results.jsonl")
+        done = set()
+        if os.path.exists(out_path):
+            _drop_partial_line(out_path)
+            done = {row["custom_id"] for row in read_jsonl(out_path)}
+        offsets = self._input_offsets()
+        sources = [self.path(name) for name in ("output.jsonl", "errors.jsonl") if os.path.exists(self.path(name))]
+
+        with open(self.path("input.jsonl"), "rb") as inputs, open(out_path, "a", encoding="utf-8") as out:
+            for source in sources:
+                for result in read_jsonl(source):
+                    custom_id = result["custom_id"]
+                    if custom_id in done:
+                        continue
+                    if custom_id in offsets:
+                        inputs.seek(offsets[custom_id])
+                        row = self._row(json.loads(inputs.readline()), result)
+                    else:
+                        row = {"custom_id": custom_id, "input": None, "output": None, "usage": None,
+                               "error": "custom_id desconhecido (nao esta no input.jsonl)"}
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    done.add(custom_id)
+            # Requests sem resultado (batch expirado ou cancelado)
+            if self.state.get("status") in TERMINAL_STATUSES and not offsets.keys() <= done:
+                for custom_id, offset in offsets.items():
+                    if custom_id not in done:
+                        inputs.seek(offset)
+                        row = {"custom_id": custom_id, "input": json.loads(inputs.readline())["body"],
+                               "output": None, "usage": None, "error": f"sem resultado ({self.state['status']})"}
+                        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._save_state(joined=True)
+        return out_path
+
+    @staticmethod
+    def _row(request: dict, result: dict) -> dict:
+        response = result.get("response") or {}
+        body = response.get("body") or {}
+        error = result.get("error")
+        if response.get("status_code", 200) >= 400:
+            error = error or (body.get("error") or {}).get("message") or f"HTTP {response['status_code']}"
+        choices = body.get("choices") or []
+        return {
+            "custom_id": result["custom_id"],
+            "input": request["body"],
+            "output": choices[0]["message"].get("content") if choices and not error else None,
+            "usage": body.get("usage") if not error else None,
+            "error": error,
+        }
+
+    # ---- tudo ----
+
+    def run(self, items=(), on_poll=None) -> str:
+        """prepare -> submit -> wait -> download -> join, pulando o que ja foi feito."""
+        self.prepare(items)
+        self.submit()
+        if self.state.get("status") not in TERMINAL_STATUSES:
+            self.wait(on_poll)
+        self.download()
+        return self.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Envia prompts pela Batch API e junta os resultados.")
+    parser.add_argument("prompts", help='JSONL com {"custom_id"?, "prompt" ou "messages", parametros...} por linha')
+    parser.add_argument("--workdir", default=".batch/run", help="diretorio de trabalho (retomavel)")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    pipeline = BatchPipeline(args.workdir, poll_interval=args.poll_interval, defaults={"model": args.model})
+    path = pipeline.run(
+        read_jsonl(args.prompts),
+        on_poll=lambda batch: print(f"{batch.id}: {batch.status} {batch.request_counts}"),
+    )
+    print(f"{pipeline.state['requests']} requests -> {path}")
+
+
+if __name__ == "__main__":
+    main()
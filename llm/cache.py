@@ -0,0 +1,307 @@
+"""
+Cache de respostas deterministicas.
+
+Chamadas com `temperature=0` (classificadores, gerador de codigo, tool
+calling...) retornam a mesma coisa a cada execucao, mas pagamos latencia e
+tokens toda vez. Este modulo guarda essas respostas em dois niveis:
+
+- memoria: LRU limitado por numero de entradas
+- disco:   SQLite com TTL e limite de tamanho (remove as menos acessadas)
+
+A chave e um hash canonico de model, messages, tools, response_format e
+parametros de amostragem. Chamadas nao deterministicas (temperature > 0,
+n > 1, stream) passam direto, sem cache.
+
+No caminho async as leituras e escritas do SQLite rodam numa thread
+(asyncio.to_thread), sem travar o event loop; o LRU em memoria fica no loop.
+
+Uso:
+    from llm.client import use
+    cache = use(ResponseCache(path=".cache/completions.sqlite"))
+    ...
+    print(cache.stats())
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Parametros que nao mudam a resposta do modelo
+NON_KEY_PARAMS = {"timeout", "extra_headers", "extra_query", "user", "metadata", "store", "priority", "deadline", "hedge", "label",
+                  "route", "client", "semantic_cache"}
+
+
+def _jsonable(value):
+    # Mensagens do SDK (ex: o `msg` do assistente reenviado no tool calling)
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    raise TypeError(f"Tipo nao serializavel na chave de cache: {type(value).__name__}")
+
+
+def cache_key(kwargs: dict) -> str:
+    payload = {k: v for k, v in kwargs.items() if k not in NON_KEY_PARAMS}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_jsonable)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(kwargs: dict) -> bool:
+    if kwargs.get("stream") or kwargs.get("n", 1) != 1:
+        return False
+    # Sem temperature explicita a API usa 1.0
+    return kwargs.get("temperature", 1) == 0
+
+
+class LRUCache:
+    """Nivel em memoria: dict ordenado por uso, limitado a `max_entries`."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """Nivel persistente em SQLite, com TTL e limite de tamanho total."""
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def put(self, key, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, value, now, now, len(value)),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Remove as entradas acessadas ha mais tempo ate caber no limite
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """
+    Camada de cache para o pipeline de llm.client (metodos wrap/wrap_async).
+
+    Cada entrada guarda a resposta serializada, o tempo que a chamada original
+    levou e o usage, para que `stats()` mostre latencia e tokens economizados.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = 1024, ttl: float = 7 * 24 * 3600,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(path, ttl=ttl, max_bytes=max_bytes) if path else None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._lock = threading.Lock()
+
+    # ---- armazenamento ----
+
+    def _lookup_memory(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        self._record_hit(entry, "memory")
+        return entry["response"]
+
+    def _lookup_disk(self, key):
+        raw = self.disk.get(key) if self.disk is not None else None
+        if raw is None:
+            return None
+        # Import adiado: o SDK so e carregado quando ha algo no disco para ler
+        from openai.types.chat import ChatCompletion
+
+        stored = json.loads(raw)
+        entry = {
+            "response": ChatCompletion.model_validate(stored["response"]),
+            "elapsed": stored["elapsed"],
+            "usage": stored["usage"],
+        }
+        self.memory.put(key, entry)
+        self._record_hit(entry, "disk")
+        return entry["response"]
+
+    def _record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def lookup(self, key):
+        response = self._lookup_memory(key)
+        if response is None:
+            response = self._lookup_disk(key)
+        if response is None:
+            self._record_miss()
+        return response
+
+    async def alookup(self, key):
+        """Como lookup, mas com a leitura do SQLite fora do event loop."""
+        response = self._lookup_memory(key)
+        if response is None and self.disk is not None:
+            response = await asyncio.to_thread(self._lookup_disk, key)
+        if response is None:
+            self._record_miss()
+        return response
+
+    def _store_memory(self, key, response, elapsed: float) -> dict:
+        usage = getattr(response, "usage", None)
+        entry = {
+            "response": response,
+            "elapsed": elapsed,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens if usage else 0,
+                "completion_tokens": usage.completion_tokens if usage else 0,
+            },
+        }
+        self.memory.put(key, entry)
+        return entry
+
+    def _store_disk(self, key, entry):
+        response = entry["response"]
+        if self.disk is not None and hasattr(response, "model_dump"):
+            self.disk.put(key, json.dumps({
+                "response": response.model_dump(mode="json"),
+                "elapsed": entry["elapsed"],
+                "usage": entry["usage"],
+            }))
+
+    def store(self, key, response, elapsed: float):
+        self._store_disk(key, self._store_memory(key, response, elapsed))
+
+    async def astore(self, key, response, elapsed: float):
+        """Como store, mas com a escrita no SQLite fora do event loop."""
+        entry = self._store_memory(key, response, elapsed)
+        if self.disk is not None:
+            await asyncio.to_thread(self._store_disk, key, entry)
+
+    def _record_hit(self, entry, tier):
+        with self._lock:
+            if tier == "memory":
+                self.memory_hits += 1
+            else:
+                self.disk_hits += 1
+            self.saved_seconds += entry["elapsed"]
+            self.saved_prompt_tokens += entry["usage"]["prompt_tokens"]
+            self.saved_completion_tokens += entry["usage"]["completion_tokens"]
+
+    # ---- camada do pipeline ----
+
+    def wrap(self, create):
+        def cached_create(**kwargs):
+            if not is_deterministic(kwargs):
+                with self._lock:
+                    self.bypassed += 1
+                return create(**kwargs)
+            key = cache_key(kwargs)
+            response = self.lookup(key)
+            if response is None:
+                start = time.perf_counter()
+                response = create(**kwargs)
+                self.store(key, response, time.perf_counter() - start)
+            return response
+        return cached_create
+
+    def wrap_async(self, acreate):
+        async def cached_acreate(**kwargs):
+            if not is_deterministic(kwargs):
+                with self._lock:
+                    self.bypassed += 1
+                return await acreate(**kwargs)
+            key = cache_key(kwargs)
+            response = await self.alookup(key)
+            if response is None:
+                start = time.perf_counter()
+                response = await acreate(**kwargs)
+                await self.astore(key, response, time.perf_counter() - start)
+            return response
+        return cached_acreate
+
+    # ---- observabilidade ----
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "saved_completion_tokens": self.saved_completion_tokens,
+        }
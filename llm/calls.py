@@ -0,0 +1,30 @@
+"""
+Classes de chamada.
+
+Chamadas diferentes tem perfis diferentes de latencia e custo: um
+classificador com max_tokens=5 volta em centenas de ms, uma geracao longa
+pode levar dezenas de segundos. Timeouts (e outras politicas) sao
+escolhidos por classe.
+"""
+CLASSIFICATION = "classification"
+EXTRACTION = "extraction"
+TOOL_USE = "tool_use"
+GENERATION = "generation"
+
+CALL_CLASSES = (CLASSIFICATION, EXTRACTION, TOOL_USE, GENERATION)
+
+# Ate quantos tokens de saida consideramos a chamada um "classificador"
+CLASSIFICATION_MAX_TOKENS = 16
+
+
+def call_class(kwargs: dict) -> str:
+    """Deduz a classe de uma chamada a partir dos parametros."""
+    if kwargs.get("tools"):
+        return TOOL_USE
+    response_format = kwargs.get("response_format") or {}
+    if response_format.get("type") in ("json_schema", "json_object"):
+        return EXTRACTION
+    max_tokens = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens")
+    if max_tokens is not None and max_tokens <= CLASSIFICATION_MAX_TOKENS:
+        return CLASSIFICATION
+    return GENERATION
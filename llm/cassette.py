@@ -0,0 +1,313 @@
+"""
+Gravacao e reproducao de chamadas (cassetes) para reruns sem rede.
+
+No modo "record" cada chamada que chega a API e anexada a um arquivo JSONL
+(uma linha por interacao, so append - uma execucao interrompida perde no
+maximo a linha em andamento). A linha guarda a chave da request
+(llm.cache.cache_key), a request, a resposta e o tempo que ela levou; para
+streams, cada chunk com o instante em que chegou; para erros HTTP, o status
+e o corpo.
+
+No modo "replay" nada vai para a rede: a mesma request devolve a resposta
+gravada - instantaneamente (regressao rapida e deterministica) ou com o
+tempo original (timing="original", para testes de latencia realistas;
+`speed` acelera ou desacelera). Requests repetidas (amostras com
+temperature > 0, retries) sao reproduzidas na ordem em que foram gravadas.
+
+No modo "auto" o que ja esta no cassete e reproduzido e o resto e gravado.
+
+Registre-a PRIMEIRO (mais perto da API): retries, cache e metricas
+continuam funcionando por cima dela como numa execucao real.
+
+Uso:
+    cassette = use(Cassette("cassettes/demos.jsonl", mode="record"))
+    ...
+    cassette = use(Cassette("cassettes/demos.jsonl", mode="replay", timing="original"))
+"""
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+import httpx
+
+from llm.cache import NON_KEY_PARAMS, cache_key
+from llm.client import sdk
+from llm.streaming import AsyncObservedStream, ObservedStream
+
+MODES = ("record", "replay", "auto")
+
+# Status HTTP -> excecao do SDK na reproducao de erros gravados (pelo nome: SDK importado no uso)
+_STATUS_ERRORS = {
+    400: "BadRequestError",
+    401: "AuthenticationError",
+    403: "PermissionDeniedError",
+    404: "NotFoundError",
+    409: "ConflictError",
+    422: "UnprocessableEntityError",
+    429: "RateLimitError",
+}
+
+
+class CassetteMiss(LookupError):
+    """A request nao foi gravada no cassete (modo replay)."""
+
+
+def _dump(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    raise TypeError(f"Tipo nao serializavel no cassete: {type(value).__name__}")
+
+
+def _status_error(entry: dict):
+    error = entry["error"]
+    status = error["status"]
+    request = httpx.Request("POST", "https://cassette.local/v1/chat/completions")
+    response = httpx.Response(status, headers=error.get("headers") or {}, json=error.get("body"), request=request)
+    name = _STATUS_ERRORS.get(status, "InternalServerError" if status >= 500 else "APIStatusError")
+    error_class = getattr(sdk(), name)
+    return error_class(error.get("message") or f"Erro {status} gravado", response=response, body=error.get("body"))
+
+
+class _ReplayStream:
+    """Stream reproduzido a partir dos chunks gravados (mesma interface do Stream do SDK)."""
+
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+        self._index = 0
+        # Os instantes gravados contam desde o envio da request
+        self._start = time.perf_counter()
+
+    def _next(self):
+        if self._index >= len(self._chunks):
+            raise StopIteration
+        chunk = self._chunks[self._index]
+        self._index += 1
+        # Quanto falta ate o instante original do chunk (0 no modo instantaneo)
+        wait = self._delay(chunk["t"]) - (time.perf_counter() - self._start)
+        from openai.types.chat import ChatCompletionChunk
+
+        return ChatCompletionChunk.model_validate(chunk["chunk"]), wait
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk, wait = self._next()
+        if wait > 0:
+            time.sleep(wait)
+        return chunk
+
+    def close(self):
+        self._index = len(self._chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _AsyncReplayStream(_ReplayStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk, wait = self._next()
+        except StopIteration:
+            raise StopAsyncIteration from None
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return chunk
+
+    async def close(self):
+        self._index = len(self._chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class Cassette:
+    """
+    Camada de gravacao/reproducao.
+
+    mode:    "record" (sempre chama a API e grava), "replay" (so o cassete;
+             request nao gravada levanta CassetteMiss) ou "auto"
+    timing:  "instant" ou "original" (reproduz a latencia e o ritmo dos chunks)
+    speed:   divide os tempos originais (2.0 = duas vezes mais rapido)
+    """
+
+    def __init__(self, path: str, mode: str = "replay", timing: str = "instant", speed: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"mode deve ser um de {MODES}, nao {mode!r}")
+        if timing not in ("instant", "original"):
+            raise ValueError(f"timing deve ser 'instant' ou 'original', nao {timing!r}")
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries = collections.defaultdict(list)   # chave -> interacoes na ordem gravada
+        self._cursor = collections.Counter()            # chave -> proxima a reproduzir
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode != "record":
+            self._load()
+
+    # ---- arquivo ----
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Ultima linha cortada por uma execucao interrompida
+                    continue
+                self._entries[entry["key"]].append(entry)
+
+    def _append(self, entry: dict):
+        line = json.dumps(entry, ensure_ascii=False, default=_dump)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._entries[entry["key"]].append(entry)
+            self._cursor[entry["key"]] = len(self._entries[entry["key"]])
+            self.recorded += 1
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    # ---- gravacao ----
+
+    @staticmethod
+    def _entry(key, kwargs, elapsed: float) -> dict:
+        return {
+            "key": key,
+            "recorded_at": time.time(),
+            "request": {k: v for k, v in kwargs.items() if k not in NON_KEY_PARAMS},
+            "elapsed": round(elapsed, 6),
+        }
+
+    def _record_response(self, key, kwargs, response, elapsed):
+        self._append({**self._entry(key, kwargs, elapsed), "response": _dump(response)})
+
+    def _record_error(self, key, kwargs, error, elapsed):
+        response = error.response
+        self._append({**self._entry(key, kwargs, elapsed), "error": {
+            "status": error.status_code,
+            "message": error.message,
+            "body": error.body,
+            "headers": {k: v for k, v in response.headers.items() if k.startswith(("retry-after", "x-ratelimit"))},
+        }})
+
+    def _stream_recorder(self, key, kwargs, start):
+        chunks = []
+
+        def on_chunk(chunk):
+            chunks.append({"t": round(time.perf_counter() - start, 6), "chunk": _dump(chunk)})
+
+        def on_finish(error):
+            self._append({**self._entry(key, kwargs, time.perf_counter() - start), "stream": True, "chunks": chunks})
+
+        return on_chunk, on_finish
+
+    # ---- reproducao ----
+
+    def _delay(self, seconds: float) -> float:
+        return seconds / self.speed if self.timing == "original" else 0.0
+
+    def _next_entry(self, key):
+        """Proxima interacao gravada para a chave (a ultima se repete quando acabam)."""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                return None
+            index = min(self._cursor[key], len(entries) - 1)
+            self._cursor[key] += 1
+            self.replayed += 1
+            return entries[index]
+
+    def _lookup(self, key, kwargs):
+        if self.mode == "record":
+            return None
+        entry = self._next_entry(key)
+        if entry is None and self.mode == "replay":
+            raise CassetteMiss(f"Request nao gravada em {self.path} (modelo {kwargs.get('model')}, chave {key[:12]})")
+        return entry
+
+    def _replay(self, entry, stream_class):
+        if "error" in entry:
+            raise _status_error(entry)
+        if entry.get("stream"):
+            return stream_class(entry["chunks"], self._delay)
+        from openai.types.chat import ChatCompletion
+
+        return ChatCompletion.model_validate(entry["response"])
+
+    # ---- camada ----
+
+    def wrap(self, create):
+        def cassette_create(**kwargs):
+            key = cache_key(kwargs)
+            entry = self._lookup(key, kwargs)
+            if entry is not None:
+                if not entry.get("stream"):
+                    time.sleep(self._delay(entry["elapsed"]))
+                return self._replay(entry, _ReplayStream)
+
+            start = time.perf_counter()
+            try:
+                response = create(**kwargs)
+            except sdk().APIStatusError as error:
+                self._record_error(key, kwargs, error, time.perf_counter() - start)
+                raise
+            if kwargs.get("stream"):
+                return ObservedStream(response, *self._stream_recorder(key, kwargs, start))
+            self._record_response(key, kwargs, response, time.perf_counter() - start)
+            return response
+        return cassette_create
+
+    def wrap_async(self, acreate):
+        async def cassette_acreate(**kwargs):
+            key = cache_key(kwargs)
+            entry = self._lookup(key, kwargs)
+            if entry is not None:
+                if not entry.get("stream"):
+                    await asyncio.sleep(self._delay(entry["elapsed"]))
+                return self._replay(entry, _AsyncReplayStream)
+
+            start = time.perf_counter()
+            try:
+                response = await acreate(**kwargs)
+            except sdk().APIStatusError as error:
+                self._record_error(key, kwargs, error, time.perf_counter() - start)
+                raise
+            if kwargs.get("stream"):
+                return AsyncObservedStream(response, *self._stream_recorder(key, kwargs, start))
+            self._record_response(key, kwargs, response, time.perf_counter() - start)
+            return response
+        return cassette_acreate
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "entries": len(self),
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+        }
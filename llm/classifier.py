@@ -0,0 +1,472 @@
+"""
+Classificadores deterministicos.
+
+PackedClassifier - lote ("request packing")
+    Em vez de uma request por texto (repetindo o system prompt e pagando a
+    latencia inteira a cada chamada), varios textos vao numa unica request
+    com `response_format=json_schema`, que devolve um array de labels
+    alinhado por indice. Se a saida empacotada nao validar, os itens afetados
+    sao reclassificados individualmente (em paralelo); o texto dessas
+    respostas e casado com os labels e vira None se nao casar com nenhum.
+
+LogprobClassifier - um token por texto
+    Cada label e identificado pelo seu primeiro token. A request gera UM
+    token (`max_tokens=1`), restrito aos prefixos dos labels via
+    `logit_bias`, e pede `logprobs`/`top_logprobs`: o label vem com uma
+    distribuicao de confianca, util para mandar itens incertos para revisao.
+    Labels que dividem o primeiro token (NEGATIVO/NEUTRO) geram os poucos
+    tokens seguintes ate divergirem, e a continuacao decide entre eles.
+"""
+import json
+import math
+import warnings
+from dataclasses import dataclass, field
+
+from llm.client import create_completion
+from llm.engine import run_concurrently
+from llm.tokens import count_batch, get_encoder, token_ids
+
+ITEM_OVERHEAD_TOKENS = 8       # {"index": 0, "text": "..."} em volta de cada texto
+OUTPUT_TOKENS_PER_ITEM = 12    # {"index": 0, "label": "FINANCEIRO"},
+
+
+def labels_schema(labels) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "packed_labels",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "labels": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "index": {"type": "integer"},
+                                "label": {"type": "string", "enum": list(labels)},
+                            },
+                            "required": ["index", "label"],
+                            "additionalProperties": False,
+                        },
+                    }
+                },
+                "required": ["labels"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+class PackedClassifier:
+    """
+    Classificador que empacota N textos por completion.
+
+    Uso:
+        clf = PackedClassifier(["BUG", "FEATURE", "ELOGIO", "OUTRO"])
+        clf.classify(["O sistema travou", "Quero exportar PDF"])  # -> ["BUG", "FEATURE"]
+
+    Contadores (`requests`, `packed_requests`, `fallback_requests`,
+    `prompt_tokens`) permitem comparar com o modo uma-request-por-texto.
+
+    Com `create` proprio as chamadas sao feitas por ele, em serie; sem ele os
+    fallbacks vao juntos pelo motor assincrono (llm.engine).
+    """
+
+    def __init__(
+        self,
+        labels,
+        instructions: str = "Classifique cada texto.",
+        model: str = "gpt-4o-mini",
+        max_batch_tokens: int = 2000,
+        max_batch_size: int = 50,
+        create=None,
+    ):
+        self.labels = list(labels)
+        self.instructions = instructions
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self._create = create
+        self.create = create or create_completion
+        self.response_format = labels_schema(self.labels)
+
+        self.requests = 0
+        self.packed_requests = 0
+        self.fallback_requests = 0
+        self.prompt_tokens = 0
+
+    # ---- lotes ----
+
+    def batches(self, texts):
+        """Agrupa indices de `texts` respeitando o orcamento de tokens e o tamanho maximo."""
+        batch, used = [], 0
+        for i, tokens in enumerate(count_batch(texts, self.model)):
+            cost = tokens + ITEM_OVERHEAD_TOKENS
+            if batch and (used + cost > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                yield batch
+                batch, used = [], 0
+            batch.append(i)
+            used += cost
+        if batch:
+            yield batch
+
+    # ---- chamadas ----
+
+    def _call(self, **kwargs):
+        return self._count(self.create(model=self.model, temperature=0, **kwargs))
+
+    def _count(self, resp):
+        self.requests += 1
+        if resp.usage is not None:
+            self.prompt_tokens += resp.usage.prompt_tokens
+        return resp
+
+    def _classify_packed(self, items) -> dict:
+        """Classifica uma lista de (indice, texto). Retorna {indice: label} so com itens validos."""
+        payload = [{"index": local, "text": text} for local, (_, text) in enumerate(items)]
+        resp = self._call(
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        f"{self.instructions} Categorias: {', '.join(self.labels)}. "
+                        "Retorne um label para cada item, usando o mesmo index."
+                    ),
+                },
+                {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+            ],
+            response_format=self.response_format,
+            max_tokens=len(items) * OUTPUT_TOKENS_PER_ITEM + 20,
+        )
+        self.packed_requests += 1
+
+        choice = resp.choices[0]
+        if choice.finish_reason != "stop" or not choice.message.content:
+            return {}
+        try:
+            entries = json.loads(choice.message.content)["labels"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return {}
+
+        results = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            local, label = entry.get("index"), entry.get("label")
+            # Indices fora do lote, duplicados ou labels invalidos sao descartados
+            if isinstance(local, int) and 0 <= local < len(items) and label in self.labels:
+                results.setdefault(items[local][0], label)
+        return results
+
+    def _single_request(self, text: str) -> dict:
+        return dict(
+            model=self.model,
+            temperature=0,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"{self.instructions} Responda apenas com: {', '.join(self.labels)}.",
+                },
+                {"role": "user", "content": text},
+            ],
+            max_tokens=5,
+            stop=["\n"],
+        )
+
+    def match_label(self, output: str):
+        """Label da resposta livre (ignora caixa, pontuacao e corte por max_tokens), ou None."""
+        output = (output or "").strip().strip(".:;\"'`*").strip().upper()
+        if not output:
+            return None
+        by_upper = {label.upper(): label for label in self.labels}
+        if output in by_upper:
+            return by_upper[output]
+        matches = [label for upper, label in by_upper.items() if upper.startswith(output) or output.startswith(upper)]
+        return matches[0] if len(matches) == 1 else None
+
+    def _read_single(self, resp):
+        self._count(resp)
+        self.fallback_requests += 1
+        return self.match_label(resp.choices[0].message.content)
+
+    def classify_one(self, text: str):
+        """Modo classico: uma request por texto. Retorna um dos labels ou None."""
+        return self._read_single(self.create(**self._single_request(text)))
+
+    def _classify_singles(self, texts) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        if self._create is not None:
+            return [self.classify_one(text) for text in texts]
+        # Fallbacks de todos os lotes em paralelo pelo motor assincrono
+        return [self._read_single(resp) for resp in run_concurrently(self._single_request(text) for text in texts)]
+
+    def classify(self, texts) -> list:
+        texts = list(texts)
+        labels = [None] * len(texts)
+        fallback = []
+
+        for batch in self.batches(texts):
+            items = [(i, texts[i]) for i in batch]
+            results = self._classify_packed(items) if len(items) > 1 else {}
+            for i, text in items:
+                if i in results:
+                    labels[i] = results[i]
+                else:
+                    fallback.append(i)
+
+        for i, label in zip(fallback, self._classify_singles(texts[i] for i in fallback)):
+            labels[i] = label
+        return labels
+
+
+# =========================
+# UM TOKEN + LOGPROBS
+# =========================
+
+# logit_bias maximo aceito pela API: na pratica restringe a saida a esses tokens
+LABEL_BIAS = 100
+MAX_TOP_LOGPROBS = 20
+
+# Modelos cujo modo degradado (sem ids de token) ja foi avisado: um aviso por processo
+_warned_prompt_only = set()
+
+
+def _distinguishing_length(sequences: dict) -> int:
+    """Menor numero de tokens (ids ou caracteres) que separa todos os labels (1 se os primeiros ja diferem)."""
+    for length in range(1, max(map(len, sequences.values())) + 1):
+        prefixes = {}
+        for label, tokens in sequences.items():
+            prefixes.setdefault(tuple(tokens[:length]), []).append(label)
+        if len(prefixes) == len(sequences):
+            return length
+    clashes = [labels for labels in prefixes.values() if len(labels) > 1]
+    raise ValueError(
+        f"Labels indistinguiveis pelos ids de token: {clashes}. Um label e prefixo de outro "
+        "(renomeie) ou label_tokens so tem o primeiro token (passe a lista completa de ids)."
+    )
+
+
+def _logaddexp(a, b: float) -> float:
+    return b if a is None else max(a, b) + math.log1p(math.exp(-abs(a - b)))
+
+
+@dataclass
+class LabelPrediction:
+    label: str
+    confidence: float
+    distribution: dict = field(default_factory=dict)   # label -> probabilidade (soma 1)
+    token: str = None                                   # token gerado pelo modelo
+
+
+class LogprobClassifier:
+    """
+    Classificador de um token com confianca calibrada.
+
+    Uso:
+        clf = LogprobClassifier(["POSITIVO", "NEGATIVO", "NEUTRO"])
+        pred = clf.classify("Adorei o produto!")
+        pred.label, pred.confidence, pred.distribution
+
+    A distribuicao e a softmax dos logprobs dos prefixos, renormalizada sobre
+    os labels e escalada por `temperature` (calibracao por temperature
+    scaling; ajuste com `calibrate` a partir de exemplos rotulados).
+
+    Com o vocabulario real (llm.tokens) os prefixos sao os primeiros tokens
+    de cada label e a saida e restrita com logit_bias. Sem ele, passe os ids
+    em `label_tokens` ({label: id do primeiro token, ou a lista de ids}, ex:
+    de um tiktoken em outra maquina) para manter o logit_bias. Sem nenhum dos
+    dois o prefixo e casado pelo texto do token e a restricao fica so no
+    prompt: o modo degradado gera um aviso (uma vez por modelo) e aparece em
+    `stats()`.
+
+    Labels com o mesmo primeiro token sao aceitos: `max_tokens` passa a ser o
+    numero de tokens ate eles divergirem, o logit_bias cobre esses tokens e o
+    label sai dos top_logprobs de cada posicao do caminho gerado (ver
+    `label_logprobs`). Labels que nao divergem nunca (um e prefixo do outro)
+    sao rejeitados no construtor.
+    """
+
+    def __init__(
+        self,
+        labels,
+        instructions: str = "Classifique o texto.",
+        model: str = "gpt-4o-mini",
+        temperature: float = 1.0,
+        create=None,
+        label_tokens: dict = None,
+    ):
+        self.labels = list(labels)
+        self.instructions = instructions
+        self.model = model
+        self.temperature = temperature
+        self._create = create
+        self.requests = 0
+
+        self.logit_bias = None
+        self.max_tokens = 1
+        if label_tokens is not None:
+            missing = [label for label in self.labels if label not in label_tokens]
+            if missing:
+                raise ValueError(f"label_tokens sem o id do primeiro token de: {missing}")
+            sequences = {
+                label: [int(token) for token in ids] if isinstance(ids, (list, tuple)) else [int(ids)]
+                for label, ids in ((label, label_tokens[label]) for label in self.labels)
+            }
+        elif get_encoder(model).exact:
+            sequences = {label: token_ids(label, model) for label in self.labels}
+        else:
+            sequences = None
+            if model not in _warned_prompt_only:
+                _warned_prompt_only.add(model)
+                warnings.warn(
+                    f"Sem o vocabulario de {model!r} (python -m llm.tokens bundle) nem label_tokens: "
+                    "LogprobClassifier roda sem logit_bias, restrito so pelo prompt."
+                )
+            # Sem ids, cada token tem ao menos um caractere: os caracteres ate os labels
+            # divergirem sao o teto de tokens (1 quando as iniciais ja diferem)
+            self.max_tokens = _distinguishing_length({label: list(label.upper()) for label in self.labels})
+        if sequences is not None:
+            self.max_tokens = _distinguishing_length(sequences)
+            allowed = {token for tokens in sequences.values() for token in tokens[:self.max_tokens]}
+            self.logit_bias = {str(token): LABEL_BIAS for token in sorted(allowed)}
+
+    # ---- request ----
+
+    def request(self, text: str) -> dict:
+        request = dict(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": f"{self.instructions} Responda apenas com uma das categorias: {', '.join(self.labels)}.",
+                },
+                {"role": "user", "content": text},
+            ],
+            temperature=0,
+            max_tokens=self.max_tokens,
+            logprobs=True,
+            top_logprobs=min(MAX_TOP_LOGPROBS, max(5, len(self.labels))),
+        )
+        if self.logit_bias:
+            request["logit_bias"] = self.logit_bias
+        return request
+
+    # ---- leitura dos logprobs ----
+
+    def _consistent(self, text: str) -> list:
+        """Labels que comecam com `text` (ignora caixa e espacos)."""
+        text = text.strip().upper()
+        if not text:
+            return []
+        return [label for label in self.labels if label.upper().startswith(text)]
+
+    def match(self, text: str):
+        """Label identificado pelo texto gerado, ou None se nenhum (ou mais de um) casar."""
+        matches = self._consistent(text)
+        if not matches:
+            # Texto passou do fim do label (ex: "POSITIVO." sem logit_bias)
+            matches = [label for label in self.labels if text.strip().upper().startswith(label.upper())]
+        return matches[0] if len(matches) == 1 else None
+
+    def label_logprobs(self, response) -> dict:
+        """
+        label -> logprob (soma das variantes de token do mesmo label).
+
+        Percorre as posicoes geradas enquanto o texto ainda serve a mais de um
+        label: cada alternativa do top_logprobs soma o logprob do caminho ate
+        ali; alternativas que ainda servem a varios labels (fora do caminho
+        gerado) dividem a massa por igual entre eles.
+        """
+        choice = response.choices[0]
+        content = choice.logprobs.content if choice.logprobs is not None else None
+        if not content:
+            return {}
+        scores = {}
+        prefix, path = "", 0.0      # texto e logprob do caminho gerado antes da posicao
+        for position in content:
+            ambiguous = len(self._consistent(prefix + position.token)) > 1
+            for candidate in position.top_logprobs or [position]:
+                if ambiguous and candidate.token == position.token:
+                    continue        # a proxima posicao decide
+                labels = self._consistent(prefix + candidate.token)
+                for label in labels:
+                    scores[label] = _logaddexp(scores.get(label), path + candidate.logprob - math.log(len(labels)))
+            if not ambiguous:
+                return scores
+            prefix += position.token
+            path += position.logprob
+        # max_tokens acabou antes de os labels divergirem
+        labels = self._consistent(prefix)
+        for label in labels:
+            scores[label] = _logaddexp(scores.get(label), path - math.log(len(labels)))
+        return scores
+
+    def distribution(self, logprobs: dict, temperature: float = None) -> dict:
+        """Softmax com temperature scaling sobre os labels (ausentes do top_logprobs ficam com 0)."""
+        temperature = temperature or self.temperature
+        if not logprobs:
+            return {}
+        top = max(logprobs.values())
+        weights = {label: math.exp((lp - top) / temperature) for label, lp in logprobs.items()}
+        total = sum(weights.values())
+        return {label: weights.get(label, 0.0) / total for label in self.labels}
+
+    def predict(self, response) -> LabelPrediction:
+        choice = response.choices[0]
+        token = choice.message.content or ""
+        distribution = self.distribution(self.label_logprobs(response))
+        if not distribution:
+            # Sem logprobs (endpoint que nao suporta): cai no texto gerado
+            return LabelPrediction(self.match(token), 0.0, {}, token)
+        label = max(distribution, key=distribution.get)
+        return LabelPrediction(label, distribution[label], distribution, token)
+
+    # ---- classificacao ----
+
+    def _responses(self, texts) -> list:
+        texts = list(texts)
+        self.requests += len(texts)
+        if self._create is not None:
+            return [self._create(**self.request(text)) for text in texts]
+        # Varios textos em paralelo pelo motor assincrono
+        return run_concurrently(self.request(text) for text in texts)
+
+    def classify(self, text: str) -> LabelPrediction:
+        create = self._create or create_completion
+        self.requests += 1
+        return self.predict(create(**self.request(text)))
+
+    def classify_many(self, texts) -> list:
+        """Varios textos, um token cada."""
+        return [self.predict(resp) for resp in self._responses(texts)]
+
+    def calibrate(self, texts, labels, temperatures=None) -> float:
+        """
+        Ajusta `temperature` minimizando o log-loss em exemplos rotulados
+        (busca em grade). Retorna a temperature escolhida.
+        """
+        temperatures = temperatures or [0.25 * i for i in range(1, 21)]
+        scores = [self.label_logprobs(resp) for resp in self._responses(texts)]
+
+        def log_loss(temperature):
+            loss = 0.0
+            for logprobs, gold in zip(scores, labels):
+                p = self.distribution(logprobs, temperature).get(gold, 0.0)
+                loss -= math.log(max(p, 1e-9))
+            return loss
+
+        self.temperature = min(temperatures, key=log_loss)
+        return self.temperature
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            # "logit_bias": saida restrita aos tokens dos labels; "prompt": modo degradado
+            "constraint": "logit_bias" if self.logit_bias else "prompt",
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+        }
@@ -0,0 +1,95 @@
+"""
+Cliente OpenAI compartilhado e pipeline de camadas em volta de
+`chat.completions.create`.
+
+Camadas (cache, rate limit, retries...) sao objetos com dois metodos:
+
+    wrap(create)         -> nova funcao sincrona com a mesma assinatura
+    wrap_async(acreate)  -> nova coroutine function com a mesma assinatura
+
+`use(layer)` registra a camada tanto no caminho sincrono (`create_completion`)
+quanto no assincrono (`llm.engine`). A primeira registrada fica mais perto
+da API; a ultima e a primeira a ver cada chamada.
+"""
+import os
+
+from llm.transport import build_http_client, get_transport_config, warm_up
+
+_client = None
+_layers = []
+_create = None
+
+# Parametros lidos pelas camadas, nao pela API. Cada camada remove o seu; os que
+# sobram (camada nao registrada, ex: priority= sem RateLimiter) param aqui.
+LAYER_PARAMS = ("priority", "semantic_cache", "deadline", "hedge", "label", "route")
+
+
+def api_kwargs(kwargs: dict) -> dict:
+    """Remove de `kwargs` os parametros de camadas antes da chamada ao SDK."""
+    for name in LAYER_PARAMS:
+        kwargs.pop(name, None)
+    return kwargs
+
+
+def get_client():
+    """Retorna o cliente compartilhado (criado no primeiro uso, com o pool de llm.transport)."""
+    global _client
+    if _client is None:
+        # Import adiado: so quem de fato cria o cliente paga o import do SDK
+        from openai import OpenAI
+
+        http_client = build_http_client()
+        _client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client,
+            max_retries=get_transport_config().max_retries,
+        )
+        if get_transport_config().warm_up:
+            warm_up(http_client, _client.base_url)
+    return _client
+
+
+def sdk():
+    """
+    O pacote `openai`, importado no primeiro uso.
+
+    As camadas classificam erros do SDK (`except sdk().RateLimitError`): a
+    expressao do except so e avaliada quando ha uma excecao, entao montar o
+    pipeline e responder do cache nao carregam o SDK.
+    """
+    import openai
+    return openai
+
+
+def use(layer):
+    """Registra uma camada no pipeline de chamadas. Retorna a propria camada."""
+    global _create
+    _layers.append(layer)
+    _create = None
+    return layer
+
+
+def wrap_sync(create):
+    for layer in _layers:
+        create = layer.wrap(create)
+    return create
+
+
+def wrap_async(acreate):
+    for layer in _layers:
+        acreate = layer.wrap_async(acreate)
+    return acreate
+
+
+def _api_create(client=None, **kwargs):
+    # O cliente so e criado quando uma chamada chega a API (hits de cache nao criam).
+    # `client` vem de camadas que escolhem o endpoint (llm.router).
+    return (client or get_client()).chat.completions.create(**api_kwargs(kwargs))
+
+
+def create_completion(**kwargs):
+    """Equivalente a client.chat.completions.create passando pelas camadas registradas."""
+    global _create
+    if _create is None:
+        _create = wrap_sync(_api_create)
+    return _create(**kwargs)
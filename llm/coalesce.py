@@ -0,0 +1,334 @@
+"""
+Coalescencia de requests identicas em voo (single-flight).
+
+Numa rajada, varios workers podem pedir exatamente a mesma coisa ao mesmo
+tempo (mesmo system prompt, mesmo texto). O cache so ajuda DEPOIS que a
+primeira resposta chega; ate la cada um vai a API separadamente. Aqui a
+primeira chamada com uma chave (llm.cache.cache_key) vira a "lider" e as
+identicas que chegam enquanto ela esta em voo esperam e recebem a mesma
+resposta.
+
+Streams tambem sao compartilhados: os chunks da unica conexao ficam num
+buffer e cada consumidor le o seu proprio iterador (quem entra atrasado
+recebe os chunks ja emitidos e segue junto). A conexao so e fechada quando
+o ultimo consumidor fecha.
+
+Por padrao so chamadas deterministicas (temperature=0, n=1) sao
+coalescidas - com amostragem, cada chamador espera uma amostra
+independente.
+
+Uso:
+    from llm.client import use
+    flights = use(SingleFlight())
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from llm.cache import cache_key
+
+
+def _coalescible(kwargs: dict) -> bool:
+    return kwargs.get("n", 1) == 1 and kwargs.get("temperature", 1) == 0
+
+
+# =========================
+# STREAMS COMPARTILHADOS
+# =========================
+
+class SharedStream:
+    """
+    Um stream upstream lido sob demanda e repassado a varios consumidores.
+
+    O consumidor que precisa de um chunk ainda nao lido puxa o proximo do
+    upstream (com o lock); os demais reaproveitam o buffer.
+    """
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = upstream
+        self._iterator = iter(upstream)
+        self._on_finish = on_finish
+        self._chunks = []
+        self._error = None
+        self._done = False
+        self._aborted = False
+        self._consumers = 0
+        self._lock = threading.Lock()
+
+    def consumer(self):
+        """Novo consumidor, ou None se o stream ja foi fechado antes do fim."""
+        with self._lock:
+            if self._aborted:
+                return None
+            self._consumers += 1
+        return StreamConsumer(self)
+
+    def _chunk(self, index):
+        """Retorna o chunk `index`; levanta StopIteration no fim do stream."""
+        with self._lock:
+            while index >= len(self._chunks):
+                if self._error is not None:
+                    raise self._error
+                if self._done:
+                    raise StopIteration
+                try:
+                    self._chunks.append(next(self._iterator))
+                except StopIteration:
+                    self._finish()
+                except Exception as exc:
+                    self._error = exc
+                    self._finish()
+            return self._chunks[index]
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._on_finish()
+
+    def _release(self):
+        with self._lock:
+            self._consumers -= 1
+            if self._consumers > 0 or self._done:
+                return
+            # Ultimo consumidor saiu no meio: ninguem mais le a conexao
+            self._aborted = True
+            self._finish()
+        close = getattr(self._upstream, "close", None)
+        if close is not None:
+            close()
+
+
+class StreamConsumer:
+    """Iterador de um consumidor sobre um SharedStream (interface de `Stream` do SDK)."""
+
+    def __init__(self, shared: SharedStream):
+        self._shared = shared
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        chunk = self._shared._chunk(self._index)
+        self._index += 1
+        return chunk
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._shared._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncSharedStream:
+    """Versao async de SharedStream (sobre `AsyncStream` do SDK)."""
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = upstream
+        self._iterator = upstream.__aiter__()
+        self._on_finish = on_finish
+        self._chunks = []
+        self._error = None
+        self._done = False
+        self._aborted = False
+        self._consumers = 0
+        self._lock = asyncio.Lock()
+
+    def consumer(self):
+        if self._aborted:
+            return None
+        self._consumers += 1
+        return AsyncStreamConsumer(self)
+
+    async def _chunk(self, index):
+        async with self._lock:
+            while index >= len(self._chunks):
+                if self._error is not None:
+                    raise self._error
+                if self._done:
+                    raise StopAsyncIteration
+                try:
+                    self._chunks.append(await self._iterator.__anext__())
+                except StopAsyncIteration:
+                    self._finish()
+                except Exception as exc:
+                    self._error = exc
+                    self._finish()
+            return self._chunks[index]
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._on_finish()
+
+    async def _release(self):
+        self._consumers -= 1
+        if self._consumers > 0 or self._done:
+            return
+        self._aborted = True
+        self._finish()
+        close = getattr(self._upstream, "close", None)
+        if close is not None:
+            await close()
+
+
+class AsyncStreamConsumer:
+    def __init__(self, shared: AsyncSharedStream):
+        self._shared = shared
+        self._index = 0
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        chunk = await self._shared._chunk(self._index)
+        self._index += 1
+        return chunk
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._shared._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+# =========================
+# CAMADA
+# =========================
+
+class SingleFlight:
+    """Camada do pipeline (llm.client.use) que compartilha requests identicas em voo."""
+
+    def __init__(self, deterministic_only: bool = True):
+        self.deterministic_only = deterministic_only
+        self._flights = {}          # chave -> Future (sync) ou SharedStream
+        self._async_flights = {}    # chave -> {"task", "waiters"}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.shared_streams = 0
+
+    def _key(self, kwargs):
+        if self.deterministic_only and not _coalescible(kwargs):
+            return None
+        return cache_key(kwargs)
+
+    def _count(self, leader: bool):
+        if leader:
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+    def _forget(self, flights, key, flight):
+        with self._lock:
+            if flights.get(key) is flight:
+                del flights[key]
+
+    # ---- sync ----
+
+    def wrap(self, create):
+        def coalesced_create(**kwargs):
+            key = self._key(kwargs)
+            if key is None:
+                return create(**kwargs)
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Future()
+                self._count(leader)
+            if not leader:
+                result = flight.result()
+                if isinstance(result, SharedStream):
+                    # Stream abandonado antes do fim: faz a propria request
+                    return result.consumer() or create(**kwargs)
+                return result
+
+            try:
+                response = create(**kwargs)
+            except BaseException as exc:
+                self._forget(self._flights, key, flight)
+                flight.set_exception(exc)
+                raise
+            if kwargs.get("stream"):
+                # O voo dura enquanto o stream estiver aberto: quem chega depois entra no buffer
+                shared = SharedStream(response, lambda: self._forget(self._flights, key, flight))
+                with self._lock:
+                    self.shared_streams += 1
+                consumer = shared.consumer()
+                flight.set_result(shared)
+                return consumer
+            self._forget(self._flights, key, flight)
+            flight.set_result(response)
+            return response
+        return coalesced_create
+
+    # ---- async ----
+
+    def wrap_async(self, acreate):
+        async def fly(key, flight, kwargs):
+            try:
+                response = await acreate(**kwargs)
+            except BaseException:
+                self._forget(self._async_flights, key, flight)
+                raise
+            if kwargs.get("stream"):
+                with self._lock:
+                    self.shared_streams += 1
+                return AsyncSharedStream(response, lambda: self._forget(self._async_flights, key, flight))
+            self._forget(self._async_flights, key, flight)
+            return response
+
+        async def coalesced_acreate(**kwargs):
+            key = self._key(kwargs)
+            if key is None:
+                return await acreate(**kwargs)
+            with self._lock:
+                flight = self._async_flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._async_flights[key] = {"task": None, "waiters": 0}
+                    flight["task"] = asyncio.ensure_future(fly(key, flight, kwargs))
+                flight["waiters"] += 1
+                self._count(leader)
+            task = flight["task"]
+            try:
+                # shield: cancelar um chamador (ex: perdedor do hedge) nao cancela os outros
+                result = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                flight["waiters"] -= 1
+                if flight["waiters"] == 0 and not task.done():
+                    task.cancel()
+                    self._forget(self._async_flights, key, flight)
+                raise
+            flight["waiters"] -= 1
+            if isinstance(result, AsyncSharedStream):
+                return result.consumer() or await acreate(**kwargs)
+            return result
+        return coalesced_acreate
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / total, 3) if total else 0.0,
+            "shared_streams": self.shared_streams,
+            "in_flight": len(self._flights) + len(self._async_flights),
+        }
@@ -0,0 +1,306 @@
+"""
+Custo por chamada, totais acumulados e orcamentos.
+
+Os precos ficam numa tabela por modelo (USD por 1M tokens, separando input,
+input cacheado e output). `CostTracker` e uma camada do pipeline
+(llm.client.use) que:
+
+- atribui o custo real de cada chamada (pelo `usage`) ao label atual
+  (llm.metrics) e ao modelo, com totais acumulados
+- ANTES de enviar, estima o pior caso (prompt contado localmente +
+  max_tokens x n) e compara com o que resta dos orcamentos - da execucao
+  inteira e do label
+- se o pior caso nao cabe: bloqueia (BudgetExceeded) ou, com
+  on_exceed="downgrade", reduz max_tokens para o que ainda cabe
+
+Chamadas em voo reservam o pior caso, entao um lote concorrente nao estoura
+o orcamento so porque ninguem terminou ainda; ao fim, a reserva e trocada
+pelo custo real.
+
+Modelos fora da tabela (gpt-5, fine-tunes, endpoints locais) passam sem
+reserva: os tokens sao contados em `stats()["unpriced"]` e o custo fica
+desconhecido. So com um orcamento valendo para a chamada eles sao recusados
+(UnpricedModel), ja que nao ha como garantir o limite.
+
+Uso:
+    costs = use(CostTracker(budget=0.50, label_budgets={"demo_temperature": 0.01}))
+    ...
+    print(costs.stats())
+"""
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+from llm.metrics import current_label
+from llm.prompt_cache import cached_tokens
+from llm.rate_limit import DEFAULT_COMPLETION_ESTIMATE
+from llm.streaming import AsyncObservedStream, ObservedStream
+from llm.tokens import count_request_tokens
+
+
+@dataclass(frozen=True)
+class Price:
+    """USD por 1M tokens."""
+    input: float
+    cached_input: float
+    output: float
+
+    def cost(self, prompt_tokens: int, completion_tokens: int = 0, cached: int = 0) -> float:
+        uncached = max(0, prompt_tokens - cached)
+        return (uncached * self.input + cached * self.cached_input + completion_tokens * self.output) / 1_000_000
+
+    def usage_cost(self, usage) -> float:
+        return self.cost(usage.prompt_tokens, usage.completion_tokens, cached_tokens(usage))
+
+
+# Precos de tabela (USD / 1M tokens). Snapshots com data (gpt-4o-mini-2024-07-18)
+# usam o preco do nome base pelo prefixo mais longo.
+PRICING = {
+    "gpt-4o-mini": Price(input=0.15, cached_input=0.075, output=0.60),
+    "gpt-4o": Price(input=2.50, cached_input=1.25, output=10.00),
+    "gpt-4.1-nano": Price(input=0.10, cached_input=0.025, output=0.40),
+    "gpt-4.1-mini": Price(input=0.40, cached_input=0.10, output=1.60),
+    "gpt-4.1": Price(input=2.00, cached_input=0.50, output=8.00),
+    "o4-mini": Price(input=1.10, cached_input=0.275, output=4.40),
+    "gpt-3.5-turbo": Price(input=0.50, cached_input=0.50, output=1.50),
+}
+
+
+def find_price(model: str, pricing: dict = None):
+    """Preco do modelo (ou do prefixo mais longo da tabela que casar); None se nao houver."""
+    pricing = PRICING if pricing is None else pricing
+    if model in pricing:
+        return pricing[model]
+    matches = [name for name in pricing if model and model.startswith(name)]
+    return pricing[max(matches, key=len)] if matches else None
+
+
+def price_for(model: str, pricing: dict = None) -> Price:
+    """Como find_price, mas levanta KeyError para modelos fora da tabela."""
+    price = find_price(model, pricing)
+    if price is None:
+        raise KeyError(f"Modelo sem preco na tabela: {model!r}")
+    return price
+
+
+class UnpricedModel(KeyError):
+    """Ha orcamento valendo para a chamada, mas o modelo nao tem preco na tabela."""
+
+
+class BudgetExceeded(RuntimeError):
+    """A chamada poderia passar do orcamento (da execucao ou do label)."""
+
+    def __init__(self, scope: str, estimated: float, remaining: float):
+        super().__init__(f"Orcamento de {scope} insuficiente: pior caso ${estimated:.6f}, restam ${remaining:.6f}")
+        self.scope = scope
+        self.estimated = estimated
+        self.remaining = remaining
+
+
+def _limit_param(kwargs) -> str:
+    return "max_completion_tokens" if "max_completion_tokens" in kwargs else "max_tokens"
+
+
+class CostTracker:
+    """
+    Camada de custo e orcamento.
+
+    budget:          USD maximos da execucao (None = sem limite)
+    label_budgets:   {label: USD maximos}
+    on_exceed:       "block" (levanta BudgetExceeded) ou "downgrade" (reduz max_tokens)
+    min_max_tokens:  abaixo disso o downgrade desiste e bloqueia
+    pricing:         tabela {modelo: Price} (padrao PRICING)
+    """
+
+    def __init__(self, budget: float = None, label_budgets: dict = None, on_exceed: str = "block",
+                 min_max_tokens: int = 16, pricing: dict = None):
+        if on_exceed not in ("block", "downgrade"):
+            raise ValueError(f"on_exceed deve ser 'block' ou 'downgrade', nao {on_exceed!r}")
+        self.budget = budget
+        self.label_budgets = dict(label_budgets or {})
+        self.on_exceed = on_exceed
+        self.min_max_tokens = min_max_tokens
+        self.pricing = PRICING if pricing is None else pricing
+        self._lock = threading.Lock()
+        self.spent = 0.0
+        self.by_label = Counter()
+        self.by_model = Counter()
+        self.calls = 0
+        self.blocked = 0
+        self.downgraded = 0
+        self._reserved = 0.0
+        self._reserved_by_label = Counter()
+        self.unpriced = {}     # modelo -> {"calls", "prompt_tokens", "completion_tokens"}
+
+    # ---- estimativa ----
+
+    def estimate(self, kwargs) -> float:
+        """Custo maximo da request: prompt inteiro sem cache + max_tokens x n de saida."""
+        price = price_for(kwargs.get("model"), self.pricing)
+        limit = kwargs.get(_limit_param(kwargs)) or DEFAULT_COMPLETION_ESTIMATE
+        return price.cost(count_request_tokens(kwargs), limit * kwargs.get("n", 1))
+
+    def remaining(self, label: str = None) -> float:
+        """Quanto ainda cabe (o menor entre o orcamento da execucao e o do label)."""
+        with self._lock:
+            return self._remaining(label)
+
+    def _remaining(self, label):
+        remaining = float("inf")
+        if self.budget is not None:
+            remaining = self.budget - self.spent - self._reserved
+        if label in self.label_budgets:
+            remaining = min(remaining, self.label_budgets[label] - self.by_label[label] - self._reserved_by_label[label])
+        return remaining
+
+    def _scope(self, label) -> str:
+        if label in self.label_budgets and (
+            self.budget is None
+            or self.label_budgets[label] - self.by_label[label] - self._reserved_by_label[label]
+            < self.budget - self.spent - self._reserved
+        ):
+            return f"label {label!r}"
+        return "execucao"
+
+    # ---- reserva e acerto ----
+
+    def _reserve(self, kwargs, label) -> float:
+        """Reserva o pior caso da chamada, reduzindo max_tokens ou bloqueando se nao couber."""
+        if find_price(kwargs.get("model"), self.pricing) is None:
+            # Sem preco nao ha pior caso: passa sem reserva, a menos que um orcamento valha aqui
+            if self.budget is not None or label in self.label_budgets:
+                with self._lock:
+                    self.blocked += 1
+                raise UnpricedModel(f"Modelo sem preco na tabela e com orcamento ativo: {kwargs.get('model')!r}")
+            return None
+        estimated = self.estimate(kwargs)
+        with self._lock:
+            remaining = self._remaining(label)
+            if estimated > remaining:
+                affordable = self._affordable_tokens(kwargs, remaining)
+                if self.on_exceed != "downgrade" or affordable < self.min_max_tokens:
+                    self.blocked += 1
+                    raise BudgetExceeded(self._scope(label), estimated, max(0.0, remaining))
+                kwargs[_limit_param(kwargs)] = affordable
+                estimated = self.estimate(kwargs)
+                self.downgraded += 1
+            self._reserved += estimated
+            self._reserved_by_label[label] += estimated
+        return estimated
+
+    def _affordable_tokens(self, kwargs, remaining: float) -> int:
+        price = price_for(kwargs.get("model"), self.pricing)
+        left = remaining - price.cost(count_request_tokens(kwargs))
+        if left <= 0 or not price.output:
+            return 0
+        return int(left * 1_000_000 / price.output / kwargs.get("n", 1))
+
+    def _actual(self, model, usage, reserved: float) -> float:
+        if reserved is None:
+            return None
+        # Sem usage (stream sem include_usage) nao ha como saber: fica o pior caso reservado
+        return price_for(model, self.pricing).usage_cost(usage) if usage is not None else reserved
+
+    def _settle_unpriced(self, model, usage):
+        """Modelo sem preco: so os tokens (quando o usage veio) e o custo fica desconhecido."""
+        with self._lock:
+            entry = self.unpriced.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            entry["calls"] += 1
+            if usage is not None:
+                entry["prompt_tokens"] += usage.prompt_tokens
+                entry["completion_tokens"] += usage.completion_tokens
+            self.calls += 1
+
+    def _settle(self, model, label, reserved: float, cost: float, usage=None):
+        if reserved is None:
+            self._settle_unpriced(model, usage)
+            return
+        with self._lock:
+            self._reserved -= reserved
+            self._reserved_by_label[label] -= reserved
+            self.spent += cost
+            self.by_label[label] += cost
+            self.by_model[model] += cost
+            self.calls += 1
+
+    def _stream_callbacks(self, kwargs, label, reserved):
+        usage = []
+        chunks = [0]
+
+        def on_chunk(chunk):
+            if getattr(chunk, "usage", None) is not None:
+                usage.append(chunk.usage)
+            if getattr(chunk, "choices", None):
+                chunks[0] += 1
+
+        def on_finish(error):
+            model = kwargs.get("model")
+            if reserved is None:
+                self._settle(model, label, None, None, usage[-1] if usage else None)
+                return
+            if usage or not chunks[0]:
+                cost = self._actual(model, usage[-1] if usage else None, reserved)
+            else:
+                # Stream fechado antes do chunk final (parada do cliente, llm.early_stop):
+                # prompt contado localmente + ~1 token por chunk recebido
+                price = price_for(model, self.pricing)
+                cost = min(reserved, price.cost(count_request_tokens(kwargs), chunks[0]))
+            self._settle(model, label, reserved, cost)
+
+        return on_chunk, on_finish
+
+    # ---- camada ----
+
+    def wrap(self, create):
+        def budgeted_create(**kwargs):
+            label = current_label()
+            reserved = self._reserve(kwargs, label)
+            try:
+                response = create(**kwargs)
+            except Exception:
+                # Erros nao sao cobrados: so libera a reserva
+                if reserved is not None:
+                    self._settle(kwargs.get("model"), label, reserved, 0.0)
+                raise
+            if kwargs.get("stream"):
+                return ObservedStream(response, *self._stream_callbacks(kwargs, label, reserved))
+            model = kwargs.get("model")
+            usage = getattr(response, "usage", None)
+            self._settle(model, label, reserved, self._actual(model, usage, reserved), usage)
+            return response
+        return budgeted_create
+
+    def wrap_async(self, acreate):
+        async def budgeted_acreate(**kwargs):
+            label = current_label()
+            reserved = self._reserve(kwargs, label)
+            try:
+                response = await acreate(**kwargs)
+            except Exception:
+                # Erros nao sao cobrados: so libera a reserva
+                if reserved is not None:
+                    self._settle(kwargs.get("model"), label, reserved, 0.0)
+                raise
+            if kwargs.get("stream"):
+                return AsyncObservedStream(response, *self._stream_callbacks(kwargs, label, reserved))
+            model = kwargs.get("model")
+            usage = getattr(response, "usage", None)
+            self._settle(model, label, reserved, self._actual(model, usage, reserved), usage)
+            return response
+        return budgeted_acreate
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "calls": self.calls,
+                "spent": round(self.spent, 6),
+                "by_label": {label: round(cost, 6) for label, cost in self.by_label.items()},
+                "by_model": {model: round(cost, 6) for model, cost in self.by_model.items()},
+                "blocked": self.blocked,
+                "downgraded": self.downgraded,
+            }
+            if self.unpriced:
+                stats["unpriced"] = {model: dict(entry) for model, entry in self.unpriced.items()}
+            if self.budget is not None:
+                stats["remaining"] = round(self.budget - self.spent - self._reserved, 6)
+        return stats
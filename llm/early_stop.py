@@ -0,0 +1,151 @@
+"""
+Condicoes de parada do lado do cliente para streams.
+
+O parametro `stop` da API aceita so ate 4 strings literais. Nao da para
+dizer "pare quando o objeto JSON fechar" ou "pare depois do 3o item" (em
+`demo_stop_sequences` isso vira o truque stop=["\\n4.", "4."], que falha se
+o modelo numerar "4)" ou usar "-"). Aqui as condicoes rodam sobre o texto
+acumulado do stream; quando uma casa, `stream_completion(stop_when=[...])`
+corta o texto no ponto certo, fecha a conexao (o modelo para de gerar - e
+de cobrar) e devolve o motivo em `result.stopped_by`.
+
+Condicoes:
+- Regex(padrao, include=False):  para no primeiro match (antes ou depois dele)
+- MaxItems(n):                    para quando o item n+1 de uma lista comeca
+- JsonComplete():                 para quando o primeiro objeto/array JSON fecha
+- MaxChars(n):                    para em n caracteres
+
+Cada condicao guarda estado do stream atual (o que ja foi varrido):
+`stream_completion` chama `reset()` no inicio, entao a mesma instancia pode
+ser reutilizada em chamadas sequenciais, mas nao em streams simultaneos.
+
+Uso:
+    result = stream_completion(model=..., messages=[...], stop_when=[MaxItems(3), MaxChars(500)])
+    result.content, result.stopped_by
+"""
+import re
+
+# Quantos caracteres antes do trecho novo sao revarridos (matches que
+# atravessam a fronteira entre dois chunks)
+LOOKBACK = 64
+
+
+class StopCondition:
+    """Base: `check(text, start)` devolve onde cortar o texto ou None."""
+
+    reason = "condicao"
+
+    def reset(self):
+        pass
+
+    def check(self, text: str, start: int):
+        """`text` e tudo que chegou ate agora; `start`, onde comeca o trecho novo."""
+        raise NotImplementedError
+
+
+class Regex(StopCondition):
+    """Para no primeiro match do padrao (include=True mantem o match no texto)."""
+
+    def __init__(self, pattern, include: bool = False, flags: int = 0):
+        self.pattern = re.compile(pattern, flags)
+        self.include = include
+        self.reason = f"regex {self.pattern.pattern!r}"
+
+    def check(self, text, start):
+        match = self.pattern.search(text, max(0, start - LOOKBACK))
+        if match is None:
+            return None
+        return match.end() if self.include else match.start()
+
+
+class MaxItems(StopCondition):
+    """
+    Para quando o item n+1 de uma lista comeca (o item n so esta completo
+    quando o proximo aparece). Reconhece "1." "1)" "-" "*" e "•" no inicio
+    da linha; `marker` troca o padrao.
+    """
+
+    MARKER = r"^[ \t]*(?:\d+[.)]|[-*•])[ \t]"
+
+    def __init__(self, n: int, marker: str = None):
+        self.n = n
+        self.marker = re.compile(marker or self.MARKER, re.MULTILINE)
+        self.reason = f"{n} itens"
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+        self._last = -1
+
+    def check(self, text, start):
+        # `^` com MULTILINE so casa em inicio de linha real, mesmo com pos > 0
+        for match in self.marker.finditer(text, max(0, start - LOOKBACK)):
+            if match.start() <= self._last:
+                continue
+            self._last = match.start()
+            self._count += 1
+            if self._count > self.n:
+                return len(text[:match.start()].rstrip())
+        return None
+
+
+class JsonComplete(StopCondition):
+    """Para assim que o primeiro objeto ou array JSON fecha (texto antes dele e ignorado)."""
+
+    reason = "json completo"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._pos = 0
+
+    def check(self, text, start):
+        for index in range(self._pos, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char in "{[":
+                self._depth += 1
+                self._started = True
+            elif not self._started:
+                continue
+            elif char == '"':
+                self._in_string = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._pos = index + 1
+                    return index + 1
+        self._pos = len(text)
+        return None
+
+
+class MaxChars(StopCondition):
+    """Para em n caracteres."""
+
+    def __init__(self, n: int):
+        self.n = n
+        self.reason = f"{n} caracteres"
+
+    def check(self, text, start):
+        return self.n if len(text) >= self.n else None
+
+
+def first_stop(conditions, text: str, start: int):
+    """(corte, motivo) da condicao que corta mais cedo, ou None."""
+    best = None
+    for condition in conditions:
+        cut = condition.check(text, start)
+        if cut is not None and (best is None or cut < best[0]):
+            best = (cut, condition.reason)
+    return best
@@ -0,0 +1,175 @@
+"""
+Motor de execucao concorrente para Chat Completions.
+
+Os demos montam uma lista de kwargs (um por chamada) e recebem as respostas
+na MESMA ORDEM da lista, com no maximo `concurrency` requests em voo.
+
+O motor roda um event loop dedicado em uma thread de fundo, entao pode ser
+usado a partir de codigo sincrono (como os demos) sem recriar o loop nem o
+cliente `AsyncOpenAI` a cada lote - as conexoes HTTP ficam vivas entre lotes.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from llm.client import api_kwargs, wrap_async
+from llm.transport import awarm_up, build_async_http_client, get_transport_config
+
+DEFAULT_CONCURRENCY = 8
+
+
+async def _in_context(context: contextvars.Context, coro):
+    # A task roda na thread do motor, com um contexto proprio; copiamos o do
+    # chamador para que valores como o label de llm.metrics acompanhem a chamada
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+class AsyncEngine:
+    """
+    Scheduler com concorrencia limitada (asyncio.Semaphore) sobre AsyncOpenAI.
+
+    - submit(**kwargs) -> Future com a resposta de uma chamada
+    - map(calls)       -> lista de respostas na ordem de `calls`
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, client_factory=None, create=None):
+        self.concurrency = concurrency
+        self._client_factory = client_factory or self._default_client
+        # `create` permite plugar outra coroutine no lugar de
+        # client.chat.completions.create. Sem ela, usamos o cliente com as
+        # camadas registradas via llm.client.use() (cache, retries, etc).
+        self._create = create
+        self._client = None
+        self._http_client = None
+        self._warmed_up = False
+        self._semaphore = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="chat-engine", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    def _default_client(self):
+        # Pool httpx compartilhado por todas as chamadas do motor (llm.transport)
+        from openai import AsyncOpenAI
+
+        self._http_client = build_async_http_client()
+        return AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=self._http_client,
+            max_retries=get_transport_config().max_retries,
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    async def awarm_up(self) -> int:
+        """Abre ate `concurrency` conexoes antes do primeiro lote (so com o cliente padrao)."""
+        self._warmed_up = True
+        client = self.client
+        if self._http_client is None:
+            return 0
+        connections = min(self.concurrency, get_transport_config().max_keepalive_connections)
+        return await awarm_up(self._http_client, client.base_url, connections)
+
+    def warm_up(self) -> int:
+        return self.run(self.awarm_up()).result()
+
+    async def _api_create(self, client=None, **kwargs):
+        # Cliente criado na primeira chamada que chega a API, nao ao montar o pipeline
+        # (`client` vem de camadas que escolhem o endpoint, como llm.router)
+        return await (client or self.client).chat.completions.create(**api_kwargs(kwargs))
+
+    def _get_create(self):
+        if self._create is None:
+            self._create = wrap_async(self._api_create)
+        return self._create
+
+    async def _slots(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            if get_transport_config().warm_up and not self._warmed_up:
+                await self.awarm_up()
+        return self._semaphore
+
+    async def acreate(self, **kwargs):
+        """Executa uma chamada respeitando o limite de concorrencia (dentro do loop do motor)."""
+        async with await self._slots():
+            return await self._get_create()(**kwargs)
+
+    async def acreate_timed(self, **kwargs):
+        """Como acreate, mas retorna (resposta, segundos) medindo so a chamada (sem a espera na fila)."""
+        async with await self._slots():
+            start = time.perf_counter()
+            response = await self._get_create()(**kwargs)
+            return response, time.perf_counter() - start
+
+    def run(self, coro) -> Future:
+        """Agenda uma coroutine qualquer no loop do motor (com as contextvars de quem chamou)."""
+        return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coro), self.loop)
+
+    def submit(self, **kwargs) -> Future:
+        return self.run(self.acreate(**kwargs))
+
+    def map(self, calls, return_exceptions: bool = False) -> list:
+        """
+        Dispara todas as chamadas de uma vez e devolve as respostas em ordem.
+        Se alguma chamada falhar, a excecao e propagada (as demais terminam
+        normalmente) - ou, com return_exceptions=True, entra na lista no lugar
+        da resposta.
+        """
+        futures = [self.submit(**kwargs) for kwargs in calls]
+        if return_exceptions:
+            return [future.exception() or future.result() for future in futures]
+        return [future.result() for future in futures]
+
+    def map_timed(self, calls, return_exceptions: bool = False) -> list:
+        """Como map, mas cada item e (resposta, latencia em segundos); falhas viram (excecao, None)."""
+        futures = [self.run(self.acreate_timed(**kwargs)) for kwargs in calls]
+        if return_exceptions:
+            return [(future.exception(), None) if future.exception() else future.result() for future in futures]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            if self._client is not None:
+                asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = self._thread = self._client = self._http_client = self._semaphore = None
+            self._warmed_up = False
+
+
+_engine = None
+
+
+def get_engine() -> AsyncEngine:
+    """Motor compartilhado pelos demos (criado no primeiro uso; limite em CHAT_CONCURRENCY)."""
+    global _engine
+    if _engine is None:
+        _engine = AsyncEngine(concurrency=int(os.getenv("CHAT_CONCURRENCY", DEFAULT_CONCURRENCY)))
+    return _engine
+
+
+def run_concurrently(calls, return_exceptions: bool = False) -> list:
+    """Atalho usado pelos demos: executa `calls` em paralelo e retorna em ordem."""
+    return get_engine().map(list(calls), return_exceptions=return_exceptions)
@@ -0,0 +1,326 @@
+"""
+Saida estruturada (json_schema) com parse incremental.
+
+`structured_output` esperava a resposta inteira para rodar `json.loads`.
+Aqui o JSON e lido conforme os chunks chegam: cada campo de primeiro nivel
+(ex: `nome`, `idade`) e emitido assim que seu valor fecha, e validado contra
+o schema na hora. JSON malformado e detectado no primeiro caractere
+invalido, sem esperar o resto do stream.
+
+Schemas sao compilados uma vez (validadores em closures) e ficam em cache
+por nome.
+
+Uso:
+    result = stream_structured(
+        on_field=lambda key, value: print(key, value),
+        model="gpt-4o-mini", messages=[...],
+        response_format={"type": "json_schema", "json_schema": {"name": "person", "schema": {...}}},
+    )
+    result.data, result.errors, result.field_times
+"""
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+
+from llm.streaming import stream_completion
+
+
+class StreamingJSONError(ValueError):
+    """O texto recebido nao e um objeto JSON valido."""
+
+
+class SchemaValidationError(ValueError):
+    """Um campo nao respeita o schema (so levantado com strict=True)."""
+
+
+# =========================
+# SCHEMA COMPILADO
+# =========================
+
+_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "null": lambda v: v is None,
+}
+
+
+def _compile(schema: dict):
+    """Transforma um schema em uma funcao validate(value, path) -> lista de erros."""
+    checks = []
+
+    kinds = schema.get("type")
+    if kinds is not None:
+        kinds = [kinds] if isinstance(kinds, str) else list(kinds)
+        predicates = [_TYPES[kind] for kind in kinds if kind in _TYPES]
+
+        def check_type(value, path):
+            if predicates and not any(p(value) for p in predicates):
+                return [f"{path}: esperado {'/'.join(kinds)}, recebido {type(value).__name__}"]
+            return []
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path):
+            return [] if value in allowed else [f"{path}: {value!r} fora de {allowed}"]
+        checks.append(check_enum)
+
+    if "properties" in schema or "required" in schema:
+        compiled = CompiledSchema(schema)
+
+        def check_object(value, path):
+            return compiled.validate_object(value, path) if isinstance(value, dict) else []
+        checks.append(check_object)
+
+    if "items" in schema:
+        item_validator = _compile(schema["items"])
+
+        def check_items(value, path):
+            if not isinstance(value, list):
+                return []
+            errors = []
+            for i, item in enumerate(value):
+                errors.extend(item_validator(item, f"{path}[{i}]"))
+            return errors
+        checks.append(check_items)
+
+    def validate(value, path="$"):
+        errors = []
+        for check in checks:
+            errors.extend(check(value, path))
+        return errors
+    return validate
+
+
+class CompiledSchema:
+    """Schema de objeto com validador por campo (para validar campo a campo)."""
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.required = list(schema.get("required", []))
+        self.additional_properties = schema.get("additionalProperties", True)
+        self.fields = {key: _compile(sub) for key, sub in schema.get("properties", {}).items()}
+
+    def validate_field(self, key, value, path="$") -> list:
+        validator = self.fields.get(key)
+        if validator is None:
+            return [] if self.additional_properties is not False else [f"{path}.{key}: campo nao previsto no schema"]
+        return validator(value, f"{path}.{key}")
+
+    def missing_required(self, present, path="$") -> list:
+        return [f"{path}.{key}: campo obrigatorio ausente" for key in self.required if key not in present]
+
+    def validate_object(self, value: dict, path="$") -> list:
+        errors = []
+        for key, item in value.items():
+            errors.extend(self.validate_field(key, item, path))
+        errors.extend(self.missing_required(value, path))
+        return errors
+
+
+_schema_cache = {}
+
+
+def compile_schema(name: str, schema: dict) -> CompiledSchema:
+    """Compila (uma vez) e guarda em cache por nome + conteudo do schema."""
+    digest = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+    key = (name, digest)
+    if key not in _schema_cache:
+        _schema_cache[key] = CompiledSchema(schema)
+    return _schema_cache[key]
+
+
+# =========================
+# PARSER INCREMENTAL
+# =========================
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    Parser de um objeto JSON de primeiro nivel alimentado em pedacos.
+
+    feed(text) devolve a lista de (chave, valor) que ficaram completos com
+    esse pedaco. close() confirma que o objeto terminou.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self._text = ""
+        self._pos = 0
+        self._state = "start"
+        self._start = None        # inicio da chave/valor sendo lido
+        self._key = None
+        self._escape = False
+        self._nesting = 0         # profundidade dentro de um valor objeto/array
+        self._nested_string = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def _error(self, message):
+        raise StreamingJSONError(f"{message} (posicao {self._pos}): ...{self._text[max(0, self._pos - 20):self._pos + 1]!r}")
+
+    def _emit(self, raw, completed):
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self._error(f"Valor invalido para {self._key!r}")
+        self.data[self._key] = value
+        completed.append((self._key, value))
+
+    def _scan_string(self, c) -> bool:
+        """Avanca dentro de uma string; retorna True quando a aspa de fechamento chega."""
+        if self._escape:
+            self._escape = False
+        elif c == "\\":
+            self._escape = True
+        elif c == '"':
+            return True
+        return False
+
+    def feed(self, text: str) -> list:
+        completed = []
+        self._text += text
+        while self._pos < len(self._text):
+            c = self._text[self._pos]
+            state = self._state
+
+            if state == "start":
+                if c == "{":
+                    self._state = "key_or_end"
+                elif c not in _WHITESPACE:
+                    self._error("Esperado '{' no inicio")
+
+            elif state in ("key_or_end", "key"):
+                if c == '"':
+                    self._start, self._state = self._pos, "in_key"
+                elif c == "}" and state == "key_or_end":
+                    self._state = "done"
+                elif c not in _WHITESPACE:
+                    self._error("Esperado nome de campo")
+
+            elif state == "in_key":
+                if self._scan_string(c):
+                    self._key = json.loads(self._text[self._start:self._pos + 1])
+                    self._state = "colon"
+
+            elif state == "colon":
+                if c == ":":
+                    self._state = "value"
+                elif c not in _WHITESPACE:
+                    self._error("Esperado ':'")
+
+            elif state == "value":
+                if c in _WHITESPACE:
+                    pass
+                elif c == '"':
+                    self._start, self._state = self._pos, "in_string_value"
+                elif c in "{[":
+                    self._start, self._state, self._nesting = self._pos, "in_container", 1
+                elif c in ",}]:":
+                    self._error("Valor ausente")
+                else:
+                    self._start, self._state = self._pos, "in_scalar"
+
+            elif state == "in_string_value":
+                if self._scan_string(c):
+                    self._emit(self._text[self._start:self._pos + 1], completed)
+                    self._state = "after_value"
+
+            elif state == "in_container":
+                if self._nested_string:
+                    if self._scan_string(c):
+                        self._nested_string = False
+                elif c == '"':
+                    self._nested_string = True
+                elif c in "{[":
+                    self._nesting += 1
+                elif c in "}]":
+                    self._nesting -= 1
+                    if self._nesting == 0:
+                        self._emit(self._text[self._start:self._pos + 1], completed)
+                        self._state = "after_value"
+
+            elif state == "in_scalar":
+                if c in _WHITESPACE or c in ",}":
+                    self._emit(self._text[self._start:self._pos], completed)
+                    self._state = "after_value"
+                    continue  # reprocessa o delimitador em after_value
+
+            elif state == "after_value":
+                if c == ",":
+                    self._state = "key"
+                elif c == "}":
+                    self._state = "done"
+                elif c not in _WHITESPACE:
+                    self._error("Esperado ',' ou '}'")
+
+            elif state == "done":
+                if c not in _WHITESPACE:
+                    self._error("Conteudo apos o fim do objeto")
+
+            self._pos += 1
+        return completed
+
+    def close(self) -> dict:
+        if self._state != "done":
+            raise StreamingJSONError(f"JSON incompleto (estado: {self._state})")
+        return self.data
+
+
+# =========================
+# STREAMING ESTRUTURADO
+# =========================
+
+@dataclass
+class StructuredResult:
+    data: dict
+    errors: list = field(default_factory=list)
+    field_times: dict = field(default_factory=dict)   # segundos desde o inicio ate cada campo fechar
+    finish_reason: str = None
+    metrics: object = None
+
+
+def stream_structured(on_field=None, strict: bool = False, create=None, **kwargs) -> StructuredResult:
+    """
+    Executa a chamada com stream=True, emitindo cada campo assim que fecha.
+
+    on_field(key, value): callback por campo completo
+    strict: levanta SchemaValidationError no primeiro campo invalido (aborta o stream)
+    """
+    json_schema = kwargs["response_format"]["json_schema"]
+    compiled = compile_schema(json_schema["name"], json_schema.get("schema", {}))
+    parser = IncrementalJSONParser()
+    result = StructuredResult(data=parser.data)
+    start = time.perf_counter()
+
+    def on_token(text):
+        for key, value in parser.feed(text):
+            result.field_times[key] = time.perf_counter() - start
+            errors = compiled.validate_field(key, value)
+            if errors:
+                result.errors.extend(errors)
+                if strict:
+                    raise SchemaValidationError("; ".join(errors))
+            if on_field is not None:
+                on_field(key, value)
+
+    streamed = stream_completion(on_token=on_token, create=create, **kwargs)
+    result.finish_reason = streamed.finish_reason
+    result.metrics = streamed.metrics
+
+    parser.close()
+    missing = compiled.missing_required(parser.data)
+    result.errors.extend(missing)
+    if strict and missing:
+        raise SchemaValidationError("; ".join(missing))
+    return result
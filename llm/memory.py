@@ -0,0 +1,200 @@
+"""
+Memoria de conversa com orcamento de tokens.
+
+Em conversas longas (agentes, chat multi-turno) cada chamada reenviava o
+historico inteiro: o prompt - e a latencia - crescem a cada turno. Aqui a
+conversa completa fica guardada, mas cada request recebe uma JANELA que
+cabe em `budget` tokens:
+
+- mensagens `system` e mensagens fixadas (pin=True) sempre entram
+- o resto entra do mais novo para o mais antigo enquanto couber
+- resultados de tool grandes sao truncados (so na janela; o original fica)
+- opcionalmente, o que saiu da janela vira um resumo (incremental: cada
+  trecho e resumido uma vez so)
+
+A unidade de corte e o "grupo": um assistant com `tool_calls` e TODAS as
+mensagens `tool` que respondem a ele entram ou saem juntos, entao uma
+mensagem `tool` nunca fica orfa.
+
+Uso:
+    memory = ConversationMemory(budget=4000, summarize=True)
+    memory.append({"role": "system", "content": "..."})
+    memory.append({"role": "user", "content": "..."})
+    create_completion(model="gpt-4o-mini", messages=memory.window())
+"""
+import asyncio
+
+from llm.client import create_completion
+from llm.tokens import DEFAULT_MODEL, TokenBudgetExceeded, count_message_tokens, count_tokens
+
+SUMMARY_PREFIX = "Resumo da conversa anterior:"
+
+
+def _as_dict(message) -> dict:
+    return message.model_dump(exclude_none=True) if hasattr(message, "model_dump") else dict(message)
+
+
+def _render(messages) -> str:
+    lines = []
+    for message in messages:
+        content = message.get("content") or ""
+        if message.get("tool_calls"):
+            calls = ", ".join(f"{c['function']['name']}({c['function']['arguments']})" for c in message["tool_calls"])
+            content = f"{content} [chamou: {calls}]".strip()
+        lines.append(f"{message.get('role')}: {content}")
+    return "\n".join(lines)
+
+
+def summarize_messages(previous: str, messages, model: str = DEFAULT_MODEL, max_tokens: int = 256, create=None) -> str:
+    """Resumo padrao: uma chamada curta que incorpora `messages` ao resumo anterior."""
+    create = create or create_completion
+    previous = f"Resumo ate agora:\n{previous}\n\n" if previous else ""
+    resp = create(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": "Resuma a conversa em poucas frases, mantendo fatos, decisoes, "
+                           "preferencias do usuario e resultados de ferramentas relevantes.",
+            },
+            {"role": "user", "content": f"{previous}Novas mensagens:\n{_render(messages)}"},
+        ],
+        temperature=0,
+        max_tokens=max_tokens,
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+
+class ConversationMemory:
+    """
+    Historico completo + janela com orcamento de tokens para cada request.
+
+    budget:           tokens maximos das mensagens enviadas (sem tools/schema)
+    max_tool_tokens:  resultados de tool acima disso sao truncados na janela
+    summarize:        False, True (resumo via modelo) ou callable(previous, messages) -> str
+    summary_tokens:   orcamento reservado para o resumo
+    """
+
+    def __init__(
+        self,
+        budget: int = 4000,
+        max_tool_tokens: int = 500,
+        summarize=False,
+        summary_tokens: int = 256,
+        model: str = DEFAULT_MODEL,
+    ):
+        self.budget = budget
+        self.max_tool_tokens = max_tool_tokens
+        self.summary_tokens = summary_tokens
+        self.model = model
+        if summarize is True:
+            def summarize(previous, messages):
+                return summarize_messages(previous, messages, model, summary_tokens)
+        self._summarizer = summarize or None
+
+        self.messages = []
+        self._pinned = set()           # indices em self.messages
+        self.summary = ""
+        self._summarized = set()       # indices ja incorporados ao resumo
+
+        self.dropped = 0               # mensagens fora da ultima janela
+        self.window_tokens = 0
+
+    # ---- historico ----
+
+    def append(self, message, pin: bool = False):
+        self.messages.append(_as_dict(message))
+        if pin:
+            self._pinned.add(len(self.messages) - 1)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _groups(self) -> list:
+        """Indices de mensagens nao-system agrupados (assistant com tool_calls + seus tools)."""
+        groups = []
+        for i, message in enumerate(self.messages):
+            role = message.get("role")
+            if role == "system":
+                continue
+            if role == "tool" and groups and self.messages[groups[-1][0]].get("tool_calls"):
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    # ---- janela ----
+
+    def _truncated(self, message: dict) -> dict:
+        if message.get("role") != "tool" or not isinstance(message.get("content"), str):
+            return message
+        content = message["content"]
+        tokens = count_tokens(content, self.model)
+        if tokens <= self.max_tool_tokens:
+            return message
+        keep = int(len(content) * self.max_tool_tokens / tokens)
+        return {**message, "content": f"{content[:keep]}\n...[truncado: {tokens - self.max_tool_tokens} tokens]"}
+
+    def _tokens(self, indices) -> int:
+        return count_message_tokens([self._truncated(self.messages[i]) for i in indices], self.model)
+
+    def window(self) -> list:
+        """Mensagens para a proxima request, dentro de `budget`."""
+        system = [i for i, m in enumerate(self.messages) if m.get("role") == "system"]
+        groups = self._groups()
+        pinned = [g for g in groups if any(i in self._pinned for i in g)]
+        # O ultimo grupo (a mensagem atual) sempre entra
+        required = system + [i for g in pinned for i in g] + (groups[-1] if groups and groups[-1] not in pinned else [])
+
+        reserve = self.summary_tokens if self._summarizer else 0
+        used = self._tokens(required)
+        if used + reserve > self.budget:
+            raise TokenBudgetExceeded(used + reserve, self.budget)
+
+        kept = set(required)
+        dropped = []
+        for group in reversed(groups[:-1]):
+            if group in pinned:
+                continue
+            cost = self._tokens(group)
+            if not dropped and used + cost + reserve <= self.budget:
+                kept.update(group)
+                used += cost
+            else:
+                # Depois do primeiro corte nada mais antigo volta (a janela e continua)
+                dropped.extend(group)
+
+        window = [self._truncated(self.messages[i]) for i in sorted(kept)]
+        if dropped and self._summarizer:
+            self._update_summary(sorted(dropped))
+        if self.summary and dropped:
+            position = next((i for i, m in enumerate(window) if m.get("role") != "system"), len(window))
+            window.insert(position, {"role": "system", "content": f"{SUMMARY_PREFIX} {self.summary}"})
+
+        self.dropped = len(dropped)
+        self.window_tokens = count_message_tokens(window, self.model)
+        return window
+
+    async def awindow(self) -> list:
+        """window() numa thread: o resumo incremental chama a API de forma sincrona."""
+        return await asyncio.to_thread(self.window)
+
+    def _update_summary(self, dropped):
+        new = [i for i in dropped if i not in self._summarized]
+        if not new:
+            return
+        self.summary = self._summarizer(self.summary, [self.messages[i] for i in new])
+        self._summarized.update(new)
+
+    def stats(self) -> dict:
+        return {
+            "messages": len(self.messages),
+            "total_tokens": count_message_tokens(self.messages, self.model),
+            "window_tokens": self.window_tokens,
+            "dropped": self.dropped,
+            "summarized": len(self._summarized),
+        }
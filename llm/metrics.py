@@ -0,0 +1,397 @@
+"""
+Instrumentacao por chamada: latencia, TTFT, tokens, finish_reason e retries.
+
+Ate aqui a telemetria eram `print`s e os campos de `usage` lidos a mao.
+`Metrics` e uma camada do pipeline (llm.client.use) que registra, para cada
+chamada:
+
+- latencia total e TTFT (so com stream: tempo ate o primeiro token)
+- prompt/completion/cached tokens (de `usage`; com stream, do chunk final)
+- finish_reason, modelo, classe da chamada (llm.calls) e um `label` do
+  chamador (ex: o nome do demo)
+- tentativas feitas a API (retries) e se a resposta veio da API ou do
+  cache/single-flight
+- erros, pelo nome da excecao
+
+Tudo e agregado em contadores e histogramas por (label, modelo), que podem
+ser exportados no formato texto do Prometheus ou em JSON. Hooks `before`
+e `after` recebem cada chamada, para quem quiser mandar para outro lugar.
+
+O label vem de `label=` na chamada ou do contexto:
+
+    metrics = Metrics()
+    use(metrics.attempts)       # antes do Retry: conta tentativas reais
+    retry = use(Retry())
+    ...
+    use(metrics)                # por ultimo: ve todas as chamadas, ate hits de cache
+
+    with metrics.label("demo_temperature"):
+        demo_temperature()
+    metrics.save("metrics.prom")    # ou .json
+"""
+import bisect
+import collections
+import contextlib
+import contextvars
+import json
+import math
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+from llm.calls import call_class
+from llm.prompt_cache import cached_tokens
+from llm.streaming import AsyncObservedStream, ObservedStream
+
+DEFAULT_LABEL = "default"
+
+# Limites (segundos) dos buckets dos histogramas
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TTFT_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+# nome -> (tipo, descricao) na exportacao
+METRICS = {
+    "chat_requests_total": ("counter", "Chamadas de chat completion"),
+    "chat_errors_total": ("counter", "Chamadas que terminaram em excecao"),
+    "chat_retries_total": ("counter", "Tentativas extras feitas a API"),
+    "chat_tokens_total": ("counter", "Tokens por tipo (prompt, completion, cached)"),
+    "chat_latency_seconds": ("histogram", "Latencia total da chamada"),
+    "chat_ttft_seconds": ("histogram", "Tempo ate o primeiro token (streams)"),
+}
+
+_label = contextvars.ContextVar("metrics_label", default=DEFAULT_LABEL)
+# Chamada em andamento no contexto atual (para a camada de tentativas)
+_current = contextvars.ContextVar("metrics_call", default=None)
+
+
+def current_label() -> str:
+    """Label das chamadas no contexto atual (camadas internas usam para atribuir custo etc.)."""
+    return _label.get()
+
+
+@dataclass
+class CallRecord:
+    label: str
+    model: str
+    call_class: str
+    stream: bool
+    latency: float = 0.0
+    ttft: float = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    finish_reason: str = None
+    attempts: int = 0
+    error: str = None
+
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+    @property
+    def source(self) -> str:
+        # Sem nenhuma tentativa registrada, a resposta veio do cache ou de outra chamada em voo
+        return "api" if self.attempts else "cache"
+
+
+class Histogram:
+    """Histograma com buckets fixos (cumulativos na exportacao, como no Prometheus)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)   # o ultimo e o +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """[(limite, contagem acumulada)], terminando em (+Inf, count)."""
+        total, result = 0, []
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Estimativa por interpolacao linear dentro do bucket (como histogram_quantile)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower, seen = 0.0, 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            if count and seen + count >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: tuple, value, suffix: str = "", extra: str = "") -> str:
+    pairs = [f'{key}="{_escape(val)}"' for key, val in labels]
+    if extra:
+        pairs.append(extra)
+    rendered = "{" + ",".join(pairs) + "}" if pairs else ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{name}{suffix}{rendered} {value}"
+
+
+class _AttemptCounter:
+    """Camada interna: conta cada tentativa que de fato vai para a API."""
+
+    def wrap(self, create):
+        def counted_create(**kwargs):
+            record = _current.get()
+            if record is not None:
+                record.attempts += 1
+            return create(**kwargs)
+        return counted_create
+
+    def wrap_async(self, acreate):
+        async def counted_acreate(**kwargs):
+            record = _current.get()
+            if record is not None:
+                record.attempts += 1
+            return await acreate(**kwargs)
+        return counted_acreate
+
+
+class Metrics:
+    """
+    Camada do pipeline que agrega metricas por (label, modelo).
+
+    before(info):   chamado antes de cada chamada com label, model, call_class e stream
+    after(record):  chamado com o CallRecord ao fim (para streams, quando o stream termina)
+    keep:           quantos CallRecords recentes guardar para o dump em JSON
+    """
+
+    def __init__(self, before=None, after=None, keep: int = 1000,
+                 latency_buckets=LATENCY_BUCKETS, ttft_buckets=TTFT_BUCKETS):
+        self.before = [before] if before else []
+        self.after = [after] if after else []
+        self.latency_buckets = latency_buckets
+        self.ttft_buckets = ttft_buckets
+        self.attempts = _AttemptCounter()
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)   # (nome, labels) -> valor
+        self._histograms = {}                             # (nome, labels) -> Histogram
+        self.recent = collections.deque(maxlen=keep)
+
+    def add_hook(self, before=None, after=None):
+        if before is not None:
+            self.before.append(before)
+        if after is not None:
+            self.after.append(after)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def label(name: str):
+        """Rotula as chamadas feitas dentro do bloco (tambem funciona como decorador)."""
+        token = _label.set(name)
+        try:
+            yield
+        finally:
+            _label.reset(token)
+
+    # ---- registro ----
+
+    def _start(self, kwargs) -> CallRecord:
+        record = CallRecord(
+            label=kwargs.pop("label", None) or _label.get(),
+            model=kwargs.get("model"),
+            call_class=call_class(kwargs),
+            stream=bool(kwargs.get("stream")),
+        )
+        for hook in self.before:
+            hook({"label": record.label, "model": record.model,
+                  "call_class": record.call_class, "stream": record.stream})
+        return record
+
+    @staticmethod
+    def _observe_usage(record, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            record.prompt_tokens = usage.prompt_tokens
+            record.completion_tokens = usage.completion_tokens
+            record.cached_tokens = cached_tokens(usage)
+
+    def _observe_response(self, record, response):
+        self._observe_usage(record, response)
+        choices = getattr(response, "choices", None) or []
+        if choices:
+            record.finish_reason = choices[0].finish_reason
+
+    def _observe_chunk(self, record, chunk, start):
+        self._observe_usage(record, chunk)
+        if not chunk.choices:
+            return
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            record.finish_reason = choice.finish_reason
+        delta = choice.delta
+        if record.ttft is None and delta is not None and (delta.content or delta.tool_calls):
+            record.ttft = time.perf_counter() - start
+
+    def _stream_callbacks(self, record, start):
+        return (
+            lambda chunk: self._observe_chunk(record, chunk, start),
+            lambda error: self._finish(record, start, error),
+        )
+
+    def _finish(self, record, start, error=None):
+        record.latency = time.perf_counter() - start
+        if error is not None:
+            record.error = type(error).__name__
+        self.record(record)
+
+    def record(self, record: CallRecord):
+        labels = (("label", record.label), ("model", record.model))
+        with self._lock:
+            self._counters["chat_requests_total", labels + (
+                ("source", record.source), ("finish_reason", record.finish_reason or "none"))] += 1
+            if record.error:
+                self._counters["chat_errors_total", labels + (("error", record.error),)] += 1
+            self._counters["chat_retries_total", labels] += record.retries
+            for kind in ("prompt", "completion", "cached"):
+                self._counters["chat_tokens_total", labels + (("kind", kind),)] += getattr(record, f"{kind}_tokens")
+            self._histogram("chat_latency_seconds", labels, self.latency_buckets).observe(record.latency)
+            if record.ttft is not None:
+                self._histogram("chat_ttft_seconds", labels, self.ttft_buckets).observe(record.ttft)
+            self.recent.append(record)
+        for hook in self.after:
+            hook(record)
+
+    def _histogram(self, name, labels, buckets) -> Histogram:
+        key = (name, labels)
+        if key not in self._histograms:
+            self._histograms[key] = Histogram(buckets)
+        return self._histograms[key]
+
+    # ---- camada ----
+
+    def wrap(self, create):
+        def instrumented_create(**kwargs):
+            record = self._start(kwargs)
+            tokens = _current.set(record), _label.set(record.label)
+            start = time.perf_counter()
+            try:
+                response = create(**kwargs)
+            except Exception as exc:
+                self._finish(record, start, exc)
+                raise
+            finally:
+                _current.reset(tokens[0])
+                _label.reset(tokens[1])
+            if record.stream:
+                return ObservedStream(response, *self._stream_callbacks(record, start))
+            self._observe_response(record, response)
+            self._finish(record, start)
+            return response
+        return instrumented_create
+
+    def wrap_async(self, acreate):
+        async def instrumented_acreate(**kwargs):
+            record = self._start(kwargs)
+            tokens = _current.set(record), _label.set(record.label)
+            start = time.perf_counter()
+            try:
+                response = await acreate(**kwargs)
+            except Exception as exc:
+                self._finish(record, start, exc)
+                raise
+            finally:
+                _current.reset(tokens[0])
+                _label.reset(tokens[1])
+            if record.stream:
+                return AsyncObservedStream(response, *self._stream_callbacks(record, start))
+            self._observe_response(record, response)
+            self._finish(record, start)
+            return response
+        return instrumented_acreate
+
+    # ---- exportacao ----
+
+    def prometheus(self) -> str:
+        """Formato texto de exposicao do Prometheus."""
+        lines = []
+        with self._lock:
+            for name, (kind, description) in METRICS.items():
+                if kind == "counter":
+                    series = sorted((labels, value) for (n, labels), value in self._counters.items() if n == name)
+                else:
+                    series = sorted((labels, hist) for (n, labels), hist in self._histograms.items() if n == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series:
+                    if kind == "counter":
+                        lines.append(_series(name, labels, value))
+                        continue
+                    for bound, count in value.cumulative():
+                        le = "+Inf" if bound == math.inf else f"{bound:g}"
+                        lines.append(_series(name, labels, count, "_bucket", f'le="{le}"'))
+                    lines.append(_series(name, labels, value.sum, "_sum"))
+                    lines.append(_series(name, labels, value.count, "_count"))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            counters = collections.defaultdict(list)
+            for (name, labels), value in sorted(self._counters.items()):
+                counters[name].append({"labels": dict(labels), "value": value})
+            histograms = collections.defaultdict(list)
+            for (name, labels), hist in sorted(self._histograms.items(), key=lambda item: item[0]):
+                histograms[name].append({
+                    "labels": dict(labels),
+                    "count": hist.count,
+                    "sum": hist.sum,
+                    **{f"p{int(q * 100)}": hist.quantile(q) for q in (0.5, 0.95, 0.99)},
+                    "buckets": {("+Inf" if b == math.inf else b): c for b, c in hist.cumulative()},
+                })
+            recent = [dict(asdict(r), retries=r.retries, source=r.source) for r in self.recent]
+        return {"counters": dict(counters), "histograms": dict(histograms), "recent": recent}
+
+    def save(self, path: str):
+        """Grava em JSON (.json) ou no formato texto do Prometheus (qualquer outra extensao)."""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+            else:
+                f.write(self.prometheus())
+
+    def stats(self) -> dict:
+        """Resumo por label: chamadas, erros, retries, tokens e latencia p50/p95."""
+        summary = collections.defaultdict(lambda: collections.Counter())
+        latency = collections.defaultdict(lambda: Histogram(self.latency_buckets))
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                fields = dict(labels)
+                key = name.removeprefix("chat_").removesuffix("_total")
+                if name == "chat_tokens_total":
+                    key = f"{fields['kind']}_tokens"
+                summary[fields["label"]][key] += value
+            for (name, labels), hist in self._histograms.items():
+                if name == "chat_latency_seconds":
+                    merged = latency[dict(labels)["label"]]
+                    merged.counts = [a + b for a, b in zip(merged.counts, hist.counts)]
+                    merged.count += hist.count
+                    merged.sum += hist.sum
+        return {
+            label: {
+                **{key: int(value) for key, value in counts.items()},
+                "p50_latency": round(latency[label].quantile(0.5), 3),
+                "p95_latency": round(latency[label].quantile(0.95), 3),
+            }
+            for label, counts in summary.items()
+        }
@@ -0,0 +1,423 @@
+"""
+Pre-classificador local na frente do classificador LLM.
+
+Boa parte dos tickets e obvia ("O sistema travou e perdi meu trabalho",
+"cobrando imposto errado no boleto") e mesmo assim cada um paga uma ida e
+volta a API. Aqui a primeira etapa roda no processo, em microssegundos:
+
+RuleClassifier
+    Regras de palavra-chave/regex por label (sem acento, sem caixa). Cada
+    match soma o peso da regra ao label; a confianca e a softmax dos pontos
+    (`scale`) - um match fraco ou regras de labels diferentes ao mesmo tempo
+    ficam abaixo do limiar.
+
+NgramModel (opcional, requer NumPy)
+    Naive Bayes multinomial sobre n-gramas de caracteres e palavras
+    espalhados em `dim` posicoes por hash. Treino e pontuacao vetorizados
+    (contagens com np.add.at, pontuacao com np.bincount por label); aprende
+    incrementalmente (`partial_fit`), entao pode ser alimentado com os
+    proprios labels do LLM.
+
+CascadeClassifier
+    Regras -> modelo -> LLM. A primeira etapa com confianca >= `threshold`
+    decide; o resto e escalado para o classificador LLM (LogprobClassifier
+    ou PackedClassifier) em um unico lote. Para calibrar o limiar:
+    - itens escalados ja tem o palpite local e o label do LLM
+    - `audit_rate` manda uma amostra dos itens decididos localmente tambem
+      para o LLM (custo controlado)
+    A concordancia local x LLM por faixa de confianca fica em `stats()`,
+    cada comparacao vai para `log_path` (JSONL) e `suggest_threshold()`
+    sugere o menor limiar com a concordancia desejada.
+
+Uso:
+    cascade = CascadeClassifier(
+        RuleClassifier([Rule("FINANCEIRO", r"boleto|fatura|cobr"), Rule("BUGGADO", r"trav|erro")]),
+        fallback=LogprobClassifier(["BUGGADO", "FEATURE", "FINANCEIRO", "OUTRO"]),
+        threshold=0.9, audit_rate=0.05, log_path=".cache/preclassifier.jsonl",
+    )
+    cascade.classify_many(textos)   # -> [LabelPrediction]
+    cascade.stats(), cascade.suggest_threshold(0.97)
+"""
+import importlib.util
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+
+from llm.classifier import LabelPrediction
+from llm.text import char_ngrams, normalize, strip_accents
+
+# Faixas de confianca da concordancia em stats()
+CONFIDENCE_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def _numpy():
+    if importlib.util.find_spec("numpy") is None:
+        raise RuntimeError("NgramModel requer `pip install numpy`; RuleClassifier funciona sem.")
+    import numpy
+    return numpy
+
+
+def _softmax(scores: dict, scale: float) -> dict:
+    top = max(scores.values())
+    weights = {label: math.exp(scale * (score - top)) for label, score in scores.items()}
+    total = sum(weights.values())
+    return {label: weight / total for label, weight in weights.items()}
+
+
+def _prediction(distribution: dict) -> LabelPrediction:
+    label = max(distribution, key=distribution.get)
+    return LabelPrediction(label, distribution[label], distribution)
+
+
+# =========================
+# REGRAS
+# =========================
+
+@dataclass
+class Rule:
+    """`pattern` e uma regex (sem acentos, sem caixa) aplicada ao texto normalizado."""
+    label: str
+    pattern: str
+    weight: float = 1.0
+
+    def __post_init__(self):
+        self._regex = re.compile(strip_accents(self.pattern), re.IGNORECASE)
+
+    @classmethod
+    def keywords(cls, label: str, words, weight: float = 1.0) -> "Rule":
+        """Regra que casa qualquer das palavras (inteiras)."""
+        return cls(label, r"\b(?:" + "|".join(re.escape(normalize(w)) for w in words) + r")\b", weight)
+
+    def hits(self, text: str) -> int:
+        return sum(1 for _ in self._regex.finditer(text))
+
+
+class RuleClassifier:
+    """
+    Pontua os labels pelas regras que casam; confianca = softmax(scale x pontos).
+
+    Com 4 labels e scale=2: um match sozinho da ~0.71, dois matches ~0.95,
+    um match de cada lado ~0.44.
+    """
+
+    def __init__(self, rules, labels=None, scale: float = 2.0):
+        self.rules = list(rules)
+        self.labels = list(labels) if labels else list(dict.fromkeys(rule.label for rule in self.rules))
+        self.scale = scale
+
+    def predict(self, text: str) -> LabelPrediction:
+        text = normalize(text)
+        scores = dict.fromkeys(self.labels, 0.0)
+        for rule in self.rules:
+            scores[rule.label] += rule.weight * rule.hits(text)
+        if not any(scores.values()):
+            return LabelPrediction(None, 0.0, {})
+        return _prediction(_softmax(scores, self.scale))
+
+    def predict_many(self, texts) -> list:
+        return [self.predict(text) for text in texts]
+
+
+# =========================
+# MODELO DE N-GRAMAS
+# =========================
+
+class NgramModel:
+    """
+    Naive Bayes multinomial com features por hash (n-gramas de caracteres + palavras).
+
+    dim:          posicoes do hash (colisoes somam contagens; 2**16 sobra para tickets)
+    alpha:        suavizacao de Laplace
+    temperature:  divide os log-scores antes da softmax (NB e confiante demais;
+                  ajuste com `calibrate`)
+    min_examples: abaixo disso o modelo se abstem (poucos exemplos = confianca falsa)
+    """
+
+    def __init__(self, labels, dim: int = 2 ** 16, n: int = 3, alpha: float = 0.1, temperature: float = 1.0,
+                 min_examples: int = 50):
+        np = self._np = _numpy()
+        self.labels = list(labels)
+        self.dim = dim
+        self.n = n
+        self.alpha = alpha
+        self.temperature = temperature
+        self.min_examples = min_examples
+        self.counts = np.zeros((dim, len(self.labels)), dtype=np.float32)
+        self.documents = np.zeros(len(self.labels), dtype=np.float64)
+        self._weights = None
+
+    def features(self, text: str) -> list:
+        text = normalize(text)
+        grams = char_ngrams(text, self.n) + ["w:" + word for word in re.findall(r"\w+", text)]
+        return [zlib.crc32(gram.encode()) % self.dim for gram in grams]
+
+    def _hashed(self, texts):
+        """(linha de cada feature, coluna de cada feature) de um lote de textos."""
+        np = self._np
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            features = self.features(text)
+            rows.extend([row] * len(features))
+            cols.extend(features)
+        return np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)
+
+    def partial_fit(self, texts, labels):
+        """Soma as contagens de mais exemplos (treino incremental)."""
+        np = self._np
+        texts, labels = list(texts), list(labels)
+        index = {label: i for i, label in enumerate(self.labels)}
+        targets = np.array([index[label] for label in labels], dtype=np.intp)
+        rows, cols = self._hashed(texts)
+        np.add.at(self.counts, (cols, targets[rows]), 1.0)
+        np.add.at(self.documents, targets, 1.0)
+        self._weights = None
+        return self
+
+    def fit(self, texts, labels):
+        self.counts[:] = 0
+        self.documents[:] = 0
+        return self.partial_fit(texts, labels)
+
+    def _log_weights(self):
+        if self._weights is None:
+            np = self._np
+            totals = self.counts.sum(axis=0) + self.alpha * self.dim
+            log_likelihood = np.log(self.counts + self.alpha) - np.log(totals)
+            prior = np.log((self.documents + 1.0) / (self.documents.sum() + len(self.labels)))
+            self._weights = (log_likelihood.astype(np.float32), prior)
+        return self._weights
+
+    def log_scores(self, texts):
+        """Matriz (textos x labels) de log P(label) + soma dos log P(feature | label)."""
+        np = self._np
+        texts = list(texts)
+        weights, prior = self._log_weights()
+        rows, cols = self._hashed(texts)
+        gathered = weights[cols]   # (features, labels)
+        scores = np.stack([
+            np.bincount(rows, weights=gathered[:, j], minlength=len(texts)) for j in range(len(self.labels))
+        ], axis=1)
+        return scores + prior
+
+    def _distributions(self, scores, temperature):
+        np = self._np
+        scaled = scores / temperature
+        scaled -= scaled.max(axis=1, keepdims=True)
+        probabilities = np.exp(scaled)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict_many(self, texts) -> list:
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.documents.sum() < max(self.min_examples, 1):
+            return [LabelPrediction(None, 0.0, {}) for _ in texts]
+        probabilities = self._distributions(self.log_scores(texts), self.temperature)
+        return [_prediction(dict(zip(self.labels, map(float, row)))) for row in probabilities]
+
+    def predict(self, text: str) -> LabelPrediction:
+        return self.predict_many([text])[0]
+
+    def calibrate(self, texts, labels, temperatures=None) -> float:
+        """Escolhe `temperature` pelo menor log-loss em exemplos rotulados (busca em grade)."""
+        np = self._np
+        temperatures = temperatures or [1, 2, 4, 8, 16, 32, 64, 128]
+        scores = self.log_scores(texts)
+        gold = np.array([self.labels.index(label) for label in labels], dtype=np.intp)
+
+        def log_loss(temperature):
+            probabilities = self._distributions(scores, temperature)[np.arange(len(gold)), gold]
+            return -np.log(np.maximum(probabilities, 1e-9)).sum()
+
+        self.temperature = min(temperatures, key=log_loss)
+        return self.temperature
+
+    def save(self, path: str):
+        self._np.savez_compressed(
+            path, counts=self.counts, documents=self.documents, labels=self.labels,
+            params=[self.dim, self.n, self.alpha, self.temperature, self.min_examples],
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "NgramModel":
+        np = _numpy()
+        data = np.load(path)
+        dim, n, alpha, temperature, min_examples = data["params"]
+        model = cls([str(label) for label in data["labels"]], int(dim), int(n), float(alpha), float(temperature),
+                    int(min_examples))
+        model.counts[:] = data["counts"]
+        model.documents[:] = data["documents"]
+        return model
+
+
+# =========================
+# CASCATA
+# =========================
+
+class CascadeClassifier:
+    """
+    Etapas locais (regras, modelo) -> classificador LLM para o que ficar abaixo do limiar.
+
+    fallback:     LogprobClassifier (classify_many -> LabelPrediction) ou
+                  PackedClassifier (classify -> labels)
+    threshold:    confianca minima para decidir localmente
+    audit_rate:   fracao dos itens decididos localmente que tambem vai ao LLM
+    learn:        alimenta o NgramModel com os labels do LLM
+    log_path:     JSONL com cada comparacao local x LLM
+    """
+
+    def __init__(self, rules: RuleClassifier = None, fallback=None, model: NgramModel = None,
+                 threshold: float = 0.9, audit_rate: float = 0.0, learn: bool = False,
+                 log_path: str = None, seed: int = None):
+        self.stages = [(name, stage) for name, stage in (("rules", rules), ("model", model)) if stage is not None]
+        self.fallback = fallback
+        self.model = model
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.learn = learn
+        self.log_path = log_path
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.decisions = Counter()        # origem da decisao -> itens
+        self.local_seconds = 0.0
+        self.audited = 0
+        self._comparisons = []            # (confianca local, concordou)
+
+    # ---- etapas ----
+
+    def local(self, text: str):
+        """(origem, previsao, decidiu) da primeira etapa confiante ou do melhor palpite local."""
+        best_name, best = None, LabelPrediction(None, 0.0, {})
+        for name, stage in self.stages:
+            prediction = stage.predict(text)
+            if prediction.label is not None and prediction.confidence >= self.threshold:
+                return name, prediction, True
+            if prediction.confidence > best.confidence:
+                best_name, best = name, prediction
+        return best_name, best, False
+
+    def _llm(self, texts) -> list:
+        if not texts:
+            return []
+        if hasattr(self.fallback, "classify_many"):
+            return self.fallback.classify_many(texts)
+        # PackedClassifier: so o label (ou None fora do conjunto), sem confianca
+        return [LabelPrediction(label, 1.0 if label is not None else 0.0) for label in self.fallback.classify(texts)]
+
+    # ---- classificacao ----
+
+    def classify_many(self, texts) -> list:
+        texts = list(texts)
+        results = [None] * len(texts)
+        pending = {}     # indice -> (origem, palpite local, escalado) dos itens que vao ao LLM
+        start = time.perf_counter()
+        for i, text in enumerate(texts):
+            source, prediction, decided = self.local(text)
+            if decided or self.fallback is None:
+                # Sem LLM o melhor palpite local vale, mesmo abaixo do limiar
+                results[i] = prediction
+                with self._lock:
+                    self.decisions[source if decided else "below_threshold"] += 1
+                if decided and self.fallback is not None and self._random.random() < self.audit_rate:
+                    pending[i] = (source, prediction, False)
+            else:
+                pending[i] = (source, prediction, True)
+        with self._lock:
+            self.local_seconds += time.perf_counter() - start
+
+        learned = []
+        for i, llm in zip(pending, self._llm([texts[i] for i in pending])):
+            source, guess, escalated = pending[i]
+            with self._lock:
+                if escalated:
+                    self.decisions["llm"] += 1
+                else:
+                    self.audited += 1
+            if escalated:
+                results[i] = llm
+            self._compare(texts[i], source, guess, llm, escalated)
+            if self.model is not None and llm.label in self.model.labels:
+                learned.append((texts[i], llm.label))
+        if self.learn and learned:
+            self.model.partial_fit(*zip(*learned))
+        return results
+
+    def classify(self, text: str) -> LabelPrediction:
+        return self.classify_many([text])[0]
+
+    # ---- concordancia ----
+
+    def _compare(self, text, source, guess, llm, escalated):
+        if guess.label is None or llm.label is None:
+            return
+        agreed = guess.label == llm.label
+        with self._lock:
+            self._comparisons.append((guess.confidence, agreed))
+            if self.log_path:
+                directory = os.path.dirname(self.log_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({
+                        "ts": time.time(),
+                        "text": text,
+                        "source": source,
+                        "local_label": guess.label,
+                        "local_confidence": round(guess.confidence, 4),
+                        "llm_label": llm.label,
+                        "llm_confidence": round(llm.confidence, 4) if llm.confidence is not None else None,
+                        "escalated": escalated,
+                        "agreed": agreed,
+                    }, ensure_ascii=False) + "\n")
+
+    def agreement_by_confidence(self) -> dict:
+        """{faixa: (comparacoes, taxa de concordancia)} pela confianca local."""
+        with self._lock:
+            comparisons = list(self._comparisons)
+        buckets = {}
+        edges = (0.0,) + CONFIDENCE_BUCKETS + (1.01,)
+        for low, high in zip(edges, edges[1:]):
+            hits = [agreed for confidence, agreed in comparisons if low <= confidence < high]
+            if hits:
+                buckets[f"{low:.2f}-{min(high, 1.0):.2f}"] = (len(hits), round(sum(hits) / len(hits), 3))
+        return buckets
+
+    def suggest_threshold(self, target: float = 0.97, min_samples: int = 20):
+        """Menor limiar em que os itens com confianca >= ele concordam com o LLM em >= target."""
+        with self._lock:
+            comparisons = sorted(self._comparisons, reverse=True)
+        agreed = 0
+        best = None
+        for count, (confidence, ok) in enumerate(comparisons, start=1):
+            agreed += ok
+            # So avalia no fim de cada grupo de confiancas iguais (o limiar nao separa empates)
+            if count < len(comparisons) and comparisons[count][0] == confidence:
+                continue
+            if count >= min_samples and agreed / count >= target:
+                best = confidence
+        return best
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.decisions.values())
+            local = total - self.decisions["llm"]
+            comparisons = len(self._comparisons)
+            agreed = sum(ok for _, ok in self._comparisons)
+            stats = {
+                "items": total,
+                "decisions": dict(self.decisions),
+                "local_rate": round(local / total, 3) if total else 0.0,
+                "local_ms_per_item": round(1000 * self.local_seconds / total, 4) if total else 0.0,
+                "audited": self.audited,
+                "comparisons": comparisons,
+                "agreement": round(agreed / comparisons, 3) if comparisons else None,
+            }
+        stats["agreement_by_confidence"] = self.agreement_by_confidence()
+        return stats
@@ -0,0 +1,164 @@
+"""
+Cache de prefixo do prompt (do lado do provedor).
+
+A API reaproveita o processamento do INICIO do prompt quando ele e identico
+byte a byte a uma request recente (a partir de ~1024 tokens). Tokens
+cacheados custam menos e reduzem o TTFT, e aparecem em
+`usage.prompt_tokens_details.cached_tokens`. Para isso funcionar:
+
+- conteudo estatico primeiro: tools, schema, system prompt, documentos fixos
+- conteudo variavel por ultimo: historico, pergunta do usuario, datas, ids
+- serializacao estavel: dicts de tools/schemas sempre na mesma ordem
+
+PrefixLayout monta requests nesse formato; PromptCacheStats (camada do
+pipeline) le `cached_tokens` de cada resposta e agrega a taxa de acerto.
+
+Uso:
+    layout = PrefixLayout(system="Voce e...", context=[manual], tools=tools)
+    prompt_cache = use(PromptCacheStats())
+    create_completion(**layout.request("pergunta do usuario", max_tokens=100))
+    print(prompt_cache.stats())
+"""
+import hashlib
+import json
+import threading
+
+from llm.tokens import count_message_tokens, count_response_format_tokens, count_tools_tokens
+
+# Abaixo disso o provedor nao cacheia o prefixo
+MIN_CACHEABLE_TOKENS = 1024
+
+
+def canonical(value):
+    """Copia com as chaves de todos os dicts ordenadas (serializacao byte a byte estavel)."""
+    if isinstance(value, dict):
+        return {key: canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+def cached_tokens(usage) -> int:
+    """`usage.prompt_tokens_details.cached_tokens` (0 se o endpoint nao informa)."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+def prefix_fingerprint(kwargs: dict) -> str:
+    """Hash de tools + response_format + mensagens antes da ultima (o que deveria se repetir)."""
+    head = {key: kwargs.get(key) for key in ("model", "tools", "response_format")}
+    payload = json.dumps([head, list(kwargs.get("messages", []))[:-1]], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class PrefixLayout:
+    """
+    Monta requests com prefixo estatico estavel e conteudo variavel no fim.
+
+    system + context viram UMA mensagem de sistema fixa; tools e
+    response_format sao canonicalizados uma vez e reutilizados (mesmo
+    objeto, mesma ordem de chaves) em todas as requests.
+    """
+
+    def __init__(self, system: str, context=(), tools=None, response_format=None, model: str = "gpt-4o-mini"):
+        self.model = model
+        self.system_message = {"role": "system", "content": "\n\n".join([system, *context])}
+        self.tools = canonical(tools) if tools else None
+        self.response_format = canonical(response_format) if response_format else None
+
+    @property
+    def prefix_tokens(self) -> int:
+        tokens = count_message_tokens([self.system_message], self.model)
+        if self.tools:
+            tokens += count_tools_tokens(self.tools, self.model)
+        if self.response_format:
+            tokens += count_response_format_tokens(self.response_format, self.model)
+        return tokens
+
+    @property
+    def cacheable(self) -> bool:
+        return self.prefix_tokens >= MIN_CACHEABLE_TOKENS
+
+    def messages(self, user_content, history=()) -> list:
+        user = user_content if isinstance(user_content, dict) else {"role": "user", "content": user_content}
+        return [self.system_message, *history, user]
+
+    def request(self, user_content, history=(), **params) -> dict:
+        request = dict(model=self.model, messages=self.messages(user_content, history), **params)
+        if self.tools:
+            request["tools"] = self.tools
+        if self.response_format:
+            request["response_format"] = self.response_format
+        return request
+
+
+class PromptCacheStats:
+    """
+    Camada do pipeline (llm.client.use) que agrega `cached_tokens`.
+
+    Registre-a antes do ResponseCache (mais perto da API), para contar so o
+    que de fato foi enviado ao provedor. `on_call(info)` recebe, por chamada:
+    model, prompt_tokens, cached_tokens e o fingerprint do prefixo.
+    """
+
+    def __init__(self, on_call=None):
+        self.on_call = on_call
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.calls_with_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prefixes = set()
+        self.last = None
+
+    def record(self, kwargs, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        info = {
+            "model": kwargs.get("model"),
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": cached_tokens(usage),
+            "prefix": prefix_fingerprint(kwargs),
+        }
+        with self._lock:
+            self.calls += 1
+            self.calls_with_hits += info["cached_tokens"] > 0
+            self.prompt_tokens += info["prompt_tokens"]
+            self.cached_tokens += info["cached_tokens"]
+            self.prefixes.add(info["prefix"])
+            self.last = info
+        if self.on_call is not None:
+            self.on_call(info)
+
+    def wrap(self, create):
+        def observed_create(**kwargs):
+            response = create(**kwargs)
+            if not kwargs.get("stream"):
+                self.record(kwargs, response)
+            return response
+        return observed_create
+
+    def wrap_async(self, acreate):
+        async def observed_acreate(**kwargs):
+            response = await acreate(**kwargs)
+            if not kwargs.get("stream"):
+                self.record(kwargs, response)
+            return response
+        return observed_acreate
+
+    @property
+    def hit_ratio(self) -> float:
+        """Fracao dos tokens de prompt que vieram do cache do provedor."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "calls_with_hits": self.calls_with_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_ratio": round(self.hit_ratio, 3),
+            # Muitos prefixos distintos para poucas chamadas = algo variavel no inicio do prompt
+            "distinct_prefixes": len(self.prefixes),
+        }
@@ -0,0 +1,258 @@
+"""
+Rate limiter do lado do cliente (RPM e TPM).
+
+Sem controle, um lote concorrente estoura o limite da conta, recebe 429 e
+entra em ciclos de rajada + backoff. Este modulo coloca dois token buckets
+na frente de `chat.completions.create`:
+
+- requests por minuto (RPM): 1 por chamada
+- tokens por minuto (TPM):   tokens de prompt estimados (llm.tokens) + max_tokens
+
+Quem nao cabe no bucket ESPERA na fila (ordenada por prioridade, menor
+primeiro) em vez de falhar. Depois da resposta, a estimativa e acertada
+com o `usage` real. Um 429 esvazia os buckets ate o reset informado e e
+repassado: retentar e papel da camada Retry (llm.resilience), registrada
+por fora do limiter, cuja proxima tentativa espera aqui na fila. Os headers `x-ratelimit-*` das respostas de chat
+completions do endpoint deste limiter (`base_url`) ajustam os limites e o
+saldo dos buckets ao que o provedor realmente informa; embeddings, files e
+outros endpoints (llm.router) tem limites proprios e sao ignorados.
+
+Uso:
+    from llm.client import use
+    limiter = use(RateLimiter(rpm=500, tpm=200_000))
+    create_completion(..., priority=0)   # prioridade opcional (padrao 10)
+    limiter.close()                      # para de observar os headers
+"""
+import asyncio
+import os
+import heapq
+import itertools
+import re
+import threading
+import time
+
+from llm.client import sdk
+from llm.tokens import count_request_tokens
+from llm.transport import add_response_hook, remove_response_hook
+
+DEFAULT_PRIORITY = 10
+# Reserva de saida quando a request nao define max_tokens
+DEFAULT_COMPLETION_ESTIMATE = 512
+
+_DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset(value: str) -> float:
+    """Converte '1s', '6m0s', '20ms', '1h2m3.5s' em segundos."""
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_PART.findall(value or ""))
+
+
+class TokenBucket:
+    """Bucket que reabastece `capacity` unidades por minuto, de forma continua."""
+
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos ate `amount` caber (0 se ja cabe). Pedidos maiores que a capacidade esperam o bucket cheio."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Camada do pipeline (llm.client.use) com fila por prioridade sobre buckets de RPM/TPM.
+
+    base_url:  endpoint cujos headers ajustam os buckets (padrao OPENAI_BASE_URL
+               ou api.openai.com)
+    """
+
+    def __init__(self, rpm: int = 500, tpm: int = 200_000, header_safety: float = 0.95, base_url: str = None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.header_safety = header_safety
+        base_url = base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+        self._chat_url = base_url.rstrip("/") + "/chat/completions"
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._queue = []                 # heap de (prioridade, seq)
+        self._seq = itertools.count()
+
+        self.waited_seconds = 0.0
+        self.rate_limited = 0
+        self._hook = add_response_hook(self.observe_headers)
+
+    def close(self):
+        """Remove o hook de headers (limiters descartados nao continuam ajustando buckets)."""
+        remove_response_hook(self._hook)
+
+    # ---- estimativa ----
+
+    @staticmethod
+    def estimate(kwargs: dict) -> int:
+        completion = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or DEFAULT_COMPLETION_ESTIMATE
+        return count_request_tokens(kwargs) + completion * kwargs.get("n", 1)
+
+    # ---- fila ----
+
+    def _enqueue(self, priority) -> tuple:
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _try_acquire(self, ticket, cost) -> float:
+        """Com o lock: retorna 0 e consome os buckets se for a vez do ticket; senao, quanto esperar."""
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        if self._queue[0] != ticket:
+            return 0.05
+        wait = max(self.requests.wait_time(1), self.tokens.wait_time(cost))
+        if wait > 0:
+            return wait
+        self.requests.take(1)
+        self.tokens.take(cost)
+        heapq.heappop(self._queue)
+        self._condition.notify_all()
+        return 0.0
+
+    def _abandon(self, ticket):
+        """Com o lock: tira da fila um ticket que nao foi atendido (espera cancelada)."""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._condition.notify_all()
+
+    def acquire(self, cost: int, priority: int = DEFAULT_PRIORITY):
+        start = time.monotonic()
+        with self._condition:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_acquire(ticket, cost)
+                    if wait == 0:
+                        break
+                    self._condition.wait(timeout=wait)
+            finally:
+                self._abandon(ticket)
+        self.waited_seconds += time.monotonic() - start
+
+    async def aacquire(self, cost: int, priority: int = DEFAULT_PRIORITY):
+        start = time.monotonic()
+        with self._lock:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_acquire(ticket, cost)
+                if wait == 0:
+                    break
+                # Cancelamento aqui (Hedge, SingleFlight, Router) passa pelo finally
+                await asyncio.sleep(min(wait, 0.25))
+        finally:
+            with self._lock:
+                self._abandon(ticket)
+        self.waited_seconds += time.monotonic() - start
+
+    def settle(self, estimated: int, response):
+        """Devolve ao bucket a diferenca entre a estimativa e o usage real."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        with self._condition:
+            self.tokens.give_back(max(0, estimated - usage.total_tokens))
+            self._condition.notify_all()
+
+    def _on_rate_limited(self, error):
+        # 429: o provedor diz que nao ha saldo - esvazia os buckets ate o reset informado
+        headers = error.response.headers if error.response is not None else {}
+        with self._condition:
+            self.rate_limited += 1
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                reset = parse_reset(headers.get(f"x-ratelimit-reset-{kind}", ""))
+                bucket.level = min(bucket.level, -reset * bucket.rate)
+
+    # ---- headers ----
+
+    def observe_headers(self, response):
+        if not str(response.request.url).startswith(self._chat_url):
+            return
+        headers = response.headers
+        if "x-ratelimit-limit-requests" not in headers and "x-ratelimit-limit-tokens" not in headers:
+            return
+        now = time.monotonic()
+        with self._condition:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                bucket.refill(now)
+                if limit is not None:
+                    bucket.capacity = float(limit) * self.header_safety
+                    bucket.level = min(bucket.level, bucket.capacity)
+                if remaining is not None:
+                    # O saldo local nunca fica acima do que o provedor diz que resta
+                    bucket.level = min(bucket.level, float(remaining) * self.header_safety)
+            self._condition.notify_all()
+
+    # ---- camada do pipeline ----
+
+    def wrap(self, create):
+        def limited_create(**kwargs):
+            priority = kwargs.pop("priority", DEFAULT_PRIORITY)
+            cost = self.estimate(kwargs)
+            self.acquire(cost, priority)
+            try:
+                response = create(**kwargs)
+            except sdk().RateLimitError as error:
+                self._on_rate_limited(error)
+                raise
+            if not kwargs.get("stream"):
+                self.settle(cost, response)
+            return response
+        return limited_create
+
+    def wrap_async(self, acreate):
+        async def limited_acreate(**kwargs):
+            priority = kwargs.pop("priority", DEFAULT_PRIORITY)
+            cost = self.estimate(kwargs)
+            await self.aacquire(cost, priority)
+            try:
+                response = await acreate(**kwargs)
+            except sdk().RateLimitError as error:
+                self._on_rate_limited(error)
+                raise
+            if not kwargs.get("stream"):
+                self.settle(cost, response)
+            return response
+        return limited_acreate
+
+    def stats(self) -> dict:
+        return {
+            "rpm_capacity": round(self.requests.capacity, 1),
+            "tpm_capacity": round(self.tokens.capacity, 1),
+            "requests_available": round(self.requests.level, 1),
+            "tokens_available": round(self.tokens.level, 1),
+            "queued": len(self._queue),
+            "waited_seconds": round(self.waited_seconds, 3),
+            "rate_limited": self.rate_limited,
+        }
@@ -0,0 +1,335 @@
+"""
+Retries, deadlines e hedging para controlar a latencia de cauda.
+
+Uma chamada lenta (p99) trava o loop inteiro que espera por ela. Duas
+camadas para o pipeline (llm.client.use):
+
+Retry
+    Retenta erros transitorios com backoff exponencial e jitter completo;
+    a base e o teto do backoff dependem da classe do erro (429 espera mais
+    que uma conexao recusada, e respeita `retry-after`). Erros do cliente
+    (400, 401, 404...) nunca sao retentados. Aceita `deadline=` (segundos)
+    por chamada: o tempo total, somando tentativas e esperas, nunca passa
+    dele - o timeout de cada tentativa e encurtado para caber no que resta.
+
+Hedge
+    Para chamadas curtas e idempotentes (classe CLASSIFICATION, sem stream),
+    se a resposta nao chegou ate o p95 de latencia observado para o modelo,
+    dispara uma copia da request e fica com a que terminar primeiro; a
+    outra e cancelada. `stats()` informa a taxa de hedge (custo extra) e a
+    economia estimada de latencia.
+
+Ordem sugerida: registrar Hedge antes de Retry (cada tentativa pode ser
+hedgeada) e ambos antes do cache. Com Retry ativo, desligue os retries
+internos do SDK (TransportConfig.max_retries = 0) para nao multiplicar
+tentativas.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import random
+import statistics
+import threading
+import time
+
+import httpx
+
+from llm.calls import CLASSIFICATION, call_class
+from llm.client import sdk
+from llm.transport import timeout_for
+
+
+class DeadlineExceeded(TimeoutError):
+    """O deadline da chamada acabou antes de uma resposta valida."""
+
+
+# =========================
+# RETRY
+# =========================
+
+# (classe do erro, base do backoff, teto do backoff) - a primeira que casar vale.
+# Classes do SDK pelo nome, resolvidas so quando ha um erro (llm.client.sdk).
+# APITimeoutError vem antes de APIConnectionError porque e subclasse dela.
+DEFAULT_BACKOFF = (
+    ("RateLimitError", 1.0, 30.0),
+    ("APITimeoutError", 0.5, 8.0),
+    ("APIConnectionError", 0.25, 8.0),
+    ("InternalServerError", 0.5, 10.0),
+)
+
+
+def _retry_after(error) -> float:
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+class Retry:
+    """Camada de retries com backoff por classe de erro e deadline por chamada."""
+
+    def __init__(self, max_attempts: int = 4, backoff=DEFAULT_BACKOFF, default_deadline: float = None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.default_deadline = default_deadline
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+        self.errors = collections.Counter()
+
+    def delay(self, error, attempt: int):
+        """Espera antes da proxima tentativa, ou None se o erro nao deve ser retentado."""
+        for error_class, base, cap in self.backoff:
+            if isinstance(error_class, str):
+                error_class = getattr(sdk(), error_class)
+            if isinstance(error, error_class):
+                # Jitter completo: espalha as retentativas de clientes concorrentes
+                return max(random.uniform(0, min(cap, base * 2 ** attempt)), _retry_after(error))
+        return None
+
+    def _record(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _prepare(self, kwargs):
+        """Retorna o instante limite (monotonic) da chamada, ou None."""
+        deadline = kwargs.pop("deadline", self.default_deadline)
+        self._record("calls")
+        if deadline is None:
+            return None
+        kwargs.setdefault("timeout", timeout_for(kwargs))
+        return time.monotonic() + deadline
+
+    @staticmethod
+    def _attempt_kwargs(kwargs, expires):
+        if expires is None:
+            return kwargs
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline esgotado antes da tentativa")
+        timeout = kwargs["timeout"]
+        read = timeout.read if isinstance(timeout, httpx.Timeout) else timeout
+        return dict(kwargs, timeout=min(read, remaining) if read is not None else remaining)
+
+    def _next_delay(self, error, attempt, expires):
+        """Registra a falha e decide a espera; levanta se nao ha nova tentativa."""
+        with self._lock:
+            self.errors[type(error).__name__] += 1
+        delay = self.delay(error, attempt)
+        if delay is None or attempt + 1 >= self.max_attempts:
+            raise error
+        if expires is not None and time.monotonic() + delay >= expires:
+            self._record("deadline_exceeded")
+            raise DeadlineExceeded(f"deadline esgotado apos {attempt + 1} tentativa(s)") from error
+        self._record("retries")
+        return delay
+
+    def wrap(self, create):
+        def create_with_retry(**kwargs):
+            expires = self._prepare(kwargs)
+            for attempt in range(self.max_attempts):
+                try:
+                    return create(**self._attempt_kwargs(kwargs, expires))
+                except sdk().APIError as error:
+                    time.sleep(self._next_delay(error, attempt, expires))
+        return create_with_retry
+
+    def wrap_async(self, acreate):
+        async def acreate_with_retry(**kwargs):
+            expires = self._prepare(kwargs)
+            for attempt in range(self.max_attempts):
+                try:
+                    return await acreate(**self._attempt_kwargs(kwargs, expires))
+                except sdk().APIError as error:
+                    await asyncio.sleep(self._next_delay(error, attempt, expires))
+        return acreate_with_retry
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+            "errors": dict(self.errors),
+        }
+
+
+# =========================
+# HEDGE
+# =========================
+
+class LatencyWindow:
+    """Ultimas N latencias de sucesso de um modelo."""
+
+    def __init__(self, size: int = 200):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def expected_remaining(self, elapsed: float) -> float:
+        """E[latencia - elapsed | latencia > elapsed] pelo historico (0 sem dados)."""
+        tail = [s for s in self.samples if s > elapsed]
+        return statistics.fmean(tail) - elapsed if tail else 0.0
+
+
+class Hedge:
+    """
+    Camada de hedging para chamadas curtas e idempotentes.
+
+    `hedge=True/False` por chamada forca ou desliga; por padrao so chamadas
+    CLASSIFICATION sem stream sao hedgeadas.
+
+    No caminho async o perdedor e cancelado de fato. No sincrono nao da para
+    interromper uma request em voo: o perdedor so e cancelado se ainda nao
+    comecou, e o resultado dele e descartado - mas a latencia real dele e
+    usada para medir a economia (no async ela e estimada pelo historico).
+
+    Quando o backup ganha, o primario entra na janela com o tempo ate a
+    vitoria (>= o delay) como limite inferior, se a latencia real dele nao
+    for conhecida. Sem isso so as chamadas rapidas seriam amostradas, o p95
+    cairia e o hedge dispararia cada vez mais.
+    """
+
+    def __init__(self, quantile: float = 0.95, initial_delay: float = 1.0, min_delay: float = 0.05,
+                 min_samples: int = 20, max_workers: int = 16):
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._windows = collections.defaultdict(LatencyWindow)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+
+    def eligible(self, kwargs) -> bool:
+        forced = kwargs.pop("hedge", None)
+        if forced is not None:
+            return forced
+        return not kwargs.get("stream") and call_class(kwargs) == CLASSIFICATION
+
+    def hedge_delay(self, model) -> float:
+        window = self._windows[model]
+        if len(window.samples) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, window.percentile(self.quantile))
+
+    def _record(self, model, latency: float, hedged: bool = False, hedge_won: bool = False, saved: float = 0.0):
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.hedge_wins += hedge_won
+            self.saved_seconds += saved
+            if latency is not None:
+                self._windows[model].add(latency)
+
+    def _record_primary(self, model, start, finished, future):
+        """Callback do primario que perdeu (sincrono): latencia real e economia medida."""
+        if future.cancelled() or future.exception() is not None:
+            # Sem latencia real: fica o limite inferior (o tempo ate o backup ganhar)
+            with self._lock:
+                self._windows[model].add(finished)
+            return
+        latency = time.monotonic() - start
+        with self._lock:
+            self._windows[model].add(latency)
+            self.saved_seconds += max(0.0, latency - finished)
+
+    def wrap(self, create):
+        def hedged_create(**kwargs):
+            if not self.eligible(kwargs):
+                return create(**kwargs)
+            model = kwargs.get("model")
+            delay = self.hedge_delay(model)
+            start = time.monotonic()
+            # As threads do pool rodam com o contexto do chamador (ex: label de llm.metrics)
+            primary = self._pool.submit(contextvars.copy_context().run, create, **kwargs)
+            done, _ = concurrent.futures.wait([primary], timeout=delay)
+            if done:
+                response = primary.result()
+                self._record(model, time.monotonic() - start)
+                return response
+
+            backup = self._pool.submit(contextvars.copy_context().run, create, **kwargs)
+            pending, error = {primary, backup}, None
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    for loser in pending:
+                        loser.cancel()
+                    elapsed = time.monotonic() - start
+                    if future is backup:
+                        self._record(model, None, hedged=True, hedge_won=True)
+                        primary.add_done_callback(lambda f: self._record_primary(model, start, elapsed, f))
+                    else:
+                        self._record(model, elapsed, hedged=True)
+                    return future.result()
+            raise error
+        return hedged_create
+
+    def wrap_async(self, acreate):
+        async def hedged_acreate(**kwargs):
+            if not self.eligible(kwargs):
+                return await acreate(**kwargs)
+            model = kwargs.get("model")
+            delay = self.hedge_delay(model)
+            start = time.monotonic()
+            primary = asyncio.ensure_future(acreate(**kwargs))
+            tasks = [primary]
+            try:
+                # Cancelar quem chamou (deadline, SingleFlight) ja durante esta espera
+                # tambem cancela o primario, pelo finally
+                done, _ = await asyncio.wait([primary], timeout=delay)
+                if done:
+                    response = primary.result()
+                    self._record(model, time.monotonic() - start)
+                    return response
+
+                backup = asyncio.ensure_future(acreate(**kwargs))
+                tasks.append(backup)
+                pending, error = {primary, backup}, None
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is not None:
+                            error = error or task.exception()
+                            continue
+                        elapsed = time.monotonic() - start
+                        if task is backup:
+                            # Primario cancelado: estima quanto ele ainda levaria pelo historico
+                            saved = self._windows[model].expected_remaining(elapsed)
+                            # e entra na janela com o limite inferior da latencia dele
+                            self._record(model, elapsed, hedged=True, hedge_won=True, saved=saved)
+                        else:
+                            self._record(model, elapsed, hedged=True)
+                        return task.result()
+                raise error
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+        return hedged_acreate
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 3) if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "delays": {model: round(self.hedge_delay(model), 3) for model in list(self._windows)},
+        }
@@ -0,0 +1,410 @@
+"""
+Roteamento de chamadas entre modelos/endpoints, com failover.
+
+Cada funcao do repo fixa `model="gpt-4o-mini"` num unico endpoint. Com um
+pool de backends (modelo + qualquer `base_url` compativel com a API da
+OpenAI), `Router` escolhe por chamada, conforme a classe dela
+(llm.calls: classificacao, extracao, geracao, tool use):
+
+- latencia: EWMA por backend e por classe (um classificador e uma geracao
+  longa nao se comparam), ajustada pela taxa de erro (EWMA tambem) - um
+  backend rapido que falha metade das vezes custa retentativas
+- custo: o preco da tabela de llm.cost pesa contra backends mais caros
+  (`cost_weight`: 0 = so latencia)
+- exploracao: uma fracao pequena das chamadas vai para outro backend
+  disponivel, para a latencia de quem estava ruim voltar a ser medida
+- failover: erro de conexao, timeout, 429 ou 5xx passa a mesma chamada para
+  o proximo backend da lista na hora, sem o backoff do Retry
+- circuit breaker por backend: `failure_threshold` falhas seguidas tiram o
+  backend do pool por `cooldown` segundos; depois uma unica chamada de
+  teste (half-open) decide se ele volta
+
+Erros da request (400, 422) nao trocam de backend: o proximo recusaria
+igual. Um backend sem preco (llm.cost) so e pulado quando ha orcamento
+valendo (UnpricedModel), sem contar como falha dele. Sem nenhum backend disponivel levanta NoBackendAvailable (um
+APIConnectionError - o Retry espera e tenta de novo).
+
+Registre-a por dentro do Hedge e do Retry e por fora do CostTracker: o custo
+e o rate limit veem o modelo escolhido, e cada copia hedgeada ou retentativa
+e roteada de novo.
+
+Atencao: logit_bias com ids de token (LogprobClassifier) so vale para
+modelos com o mesmo tokenizer - restrinja as classes desses backends.
+
+Uso:
+    router = use(Router([
+        Backend("mini", "gpt-4o-mini"),
+        Backend("nano", "gpt-4.1-nano", classes=(CLASSIFICATION,)),
+        Backend("local", "llama3.1", base_url="http://localhost:11434/v1", api_key_env="OLLAMA_API_KEY"),
+    ]))
+    ...
+    print(router.stats())
+
+Ou de um JSON ([{"name", "model", "base_url"?, "api_key_env"?, "classes"?}, ...]):
+    router = use(Router(load_backends("router.json")))
+"""
+import json
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+
+import httpx
+
+from llm.calls import CALL_CLASSES, call_class
+from llm.client import sdk
+from llm.cost import UnpricedModel, find_price
+from llm.transport import build_async_http_client, build_http_client, get_transport_config
+
+# Erros que sao do backend (trocar de backend pode resolver). Nomes de classes do SDK,
+# resolvidos no primeiro erro: importar o roteador nao carrega o SDK.
+_FAILOVER_ERROR_NAMES = ("APIConnectionError", "RateLimitError", "InternalServerError",
+                         "AuthenticationError", "PermissionDeniedError", "NotFoundError")
+
+
+@lru_cache(maxsize=None)
+def _failover_errors() -> tuple:
+    return tuple(getattr(sdk(), name) for name in _FAILOVER_ERROR_NAMES)
+
+
+@lru_cache(maxsize=None)
+def _no_backend_class():
+    class NoBackendAvailable(sdk().APIConnectionError):
+        """Todos os backends da classe estao com o circuito aberto (ou falharam nesta chamada)."""
+
+        def __init__(self, message: str):
+            super().__init__(message=message, request=httpx.Request("POST", "router://chat/completions"))
+
+    NoBackendAvailable.__module__ = __name__
+    return NoBackendAvailable
+
+
+def __getattr__(name):
+    # FAILOVER_ERRORS e NoBackendAvailable dependem do SDK: criados no primeiro acesso
+    if name == "FAILOVER_ERRORS":
+        return _failover_errors()
+    if name == "NoBackendAvailable":
+        return _no_backend_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class CircuitBreaker:
+    """
+    closed -> open depois de `failure_threshold` falhas seguidas; open ->
+    half_open quando passa o `cooldown` (uma chamada de teste por vez);
+    sucesso no teste fecha, falha reabre.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def acquire(self) -> bool:
+        """Reserva a chamada; em half_open so a primeira passa."""
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self._probing = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        # Falhas de chamadas que ja estavam em voo nao estendem um circuito ja aberto
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            self.opened += 1
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """Chamada de teste terminou sem dizer nada sobre o backend (ex: erro 400)."""
+        self._probing = False
+
+
+class Backend:
+    """
+    Um modelo num endpoint.
+
+    base_url:     None = o endpoint padrao (OPENAI_BASE_URL / api.openai.com),
+                  com o cliente compartilhado de llm.client
+    api_key_env:  variavel de ambiente com a chave deste endpoint
+    classes:      classes de chamada que ele atende
+    price:        llm.cost.Price (padrao: tabela de llm.cost; None se o modelo nao esta la)
+    """
+
+    def __init__(self, name: str, model: str, base_url: str = None, api_key_env: str = "OPENAI_API_KEY",
+                 classes=CALL_CLASSES, price=None):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key_env = api_key_env
+        self.classes = tuple(classes)
+        self.price = find_price(model) if price is None else price
+        self._client = None
+        self._async_client = None
+
+    @property
+    def is_default(self) -> bool:
+        return self.base_url is None and self.api_key_env == "OPENAI_API_KEY"
+
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(
+                base_url=self.base_url,
+                api_key=os.getenv(self.api_key_env) or "sem-chave",
+                http_client=build_http_client(),
+                max_retries=get_transport_config().max_retries,
+            )
+        return self._client
+
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+
+            self._async_client = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=os.getenv(self.api_key_env) or "sem-chave",
+                http_client=build_async_http_client(),
+                max_retries=get_transport_config().max_retries,
+            )
+        return self._async_client
+
+    def __repr__(self):
+        return f"Backend({self.name!r}, {self.model!r})"
+
+
+def load_backends(path: str) -> list:
+    """Backends de um JSON: [{"name", "model", "base_url"?, "api_key_env"?, "classes"?}, ...]."""
+    with open(path, encoding="utf-8") as f:
+        return [Backend(**entry) for entry in json.load(f)]
+
+
+class _Health:
+    """EWMAs e circuito de um backend."""
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.latency = {}      # classe -> EWMA de segundos
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+
+
+class Router:
+    """
+    Camada de roteamento do pipeline.
+
+    cost_weight:        quanto o preco relativo pesa (1.0 = o dobro do preco
+                        equivale ao dobro da latencia)
+    alpha:              peso da amostra nova nas EWMAs
+    explore:            fracao das chamadas enviada a outro backend disponivel
+    max_failover:       backends tentados por chamada
+    failure_threshold / cooldown: circuit breaker de cada backend
+    `route=False` numa chamada mantem o modelo pedido, no endpoint padrao.
+    """
+
+    def __init__(self, backends, cost_weight: float = 0.5, alpha: float = 0.2, explore: float = 0.05,
+                 max_failover: int = 3, failure_threshold: int = 5, cooldown: float = 30.0, seed: int = None):
+        if not backends:
+            raise ValueError("Router precisa de pelo menos um backend")
+        self.backends = list(backends)
+        self.cost_weight = cost_weight
+        self.alpha = alpha
+        self.explore = explore
+        self.max_failover = max_failover
+        self._health = {b.name: _Health(CircuitBreaker(failure_threshold, cooldown)) for b in self.backends}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failovers = 0
+        self.explored = 0
+        self.unavailable = 0
+
+    # ---- escolha ----
+
+    def _score(self, backend, cls, prior: float, cheapest: float, max_tokens: int) -> float:
+        health = self._health[backend.name]
+        # Nunca medido nesta classe: empata com o melhor medido (a taxa de erro desempata)
+        latency = health.latency.get(cls, prior)
+        expected = latency / max(0.1, 1.0 - health.error_rate)
+        if backend.price is None or not cheapest:
+            return expected
+        relative = backend.price.cost(1000, max_tokens) / cheapest
+        return expected * (1.0 + self.cost_weight * (relative - 1.0))
+
+    def plan(self, kwargs) -> list:
+        """Backends da classe da chamada, na ordem em que serao tentados."""
+        cls = call_class(kwargs)
+        max_tokens = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or 512
+        with self._lock:
+            candidates = [b for b in self.backends if cls in b.classes and self._health[b.name].breaker.available()]
+            if not candidates:
+                return []
+            # Prompt nominal de 1000 tokens: so a proporcao de preco entre backends importa
+            prices = [b.price.cost(1000, max_tokens) for b in candidates if b.price is not None]
+            cheapest = min(prices) if prices else 0.0
+            measured = [self._health[b.name].latency[cls] for b in candidates if cls in self._health[b.name].latency]
+            prior = min(measured, default=1.0)
+            # Empates ficam na ordem da configuracao
+            ordered = sorted(candidates, key=lambda b: self._score(b, cls, prior, cheapest, max_tokens))
+            if len(ordered) > 1 and self._random.random() < self.explore:
+                ordered.insert(0, ordered.pop(self._random.randrange(1, len(ordered))))
+                self.explored += 1
+        return ordered[:self.max_failover]
+
+    # ---- registro ----
+
+    def _acquire(self, backend) -> bool:
+        with self._lock:
+            return self._health[backend.name].breaker.acquire()
+
+    def _success(self, backend, cls, elapsed: float):
+        with self._lock:
+            health = self._health[backend.name]
+            health.calls += 1
+            previous = health.latency.get(cls)
+            health.latency[cls] = elapsed if previous is None else previous + self.alpha * (elapsed - previous)
+            health.error_rate -= self.alpha * health.error_rate
+            health.breaker.success()
+
+    def _failure(self, backend):
+        with self._lock:
+            health = self._health[backend.name]
+            health.calls += 1
+            health.failures += 1
+            health.error_rate += self.alpha * (1.0 - health.error_rate)
+            health.breaker.failure()
+
+    def _release(self, backend):
+        with self._lock:
+            self._health[backend.name].breaker.release()
+
+    def _attempt_kwargs(self, backend, kwargs, async_client: bool) -> dict:
+        attempt = dict(kwargs, model=backend.model)
+        if not backend.is_default:
+            # Consumido por llm.client._api_create / llm.engine (cliente deste endpoint)
+            attempt["client"] = backend.async_client() if async_client else backend.client()
+        return attempt
+
+    def _start(self, kwargs):
+        with self._lock:
+            self.calls += 1
+        plan = self.plan(kwargs)
+        if not plan:
+            with self._lock:
+                self.unavailable += 1
+            raise _no_backend_class()(f"Nenhum backend disponivel para chamadas {call_class(kwargs)}")
+        return plan
+
+    def _count_failover(self):
+        with self._lock:
+            self.failovers += 1
+
+    # ---- camada ----
+
+    def wrap(self, create):
+        def routed_create(**kwargs):
+            if not kwargs.pop("route", True):
+                return create(**kwargs)
+            cls = call_class(kwargs)
+            error = None
+            for backend in self._start(kwargs):
+                if not self._acquire(backend):
+                    continue
+                if error is not None:
+                    self._count_failover()
+                start = time.monotonic()
+                try:
+                    response = create(**self._attempt_kwargs(backend, kwargs, async_client=False))
+                except _failover_errors() as exc:
+                    self._failure(backend)
+                    error = exc
+                    continue
+                except UnpricedModel as exc:
+                    # Orcamento ativo e modelo sem preco: tenta um backend com preco
+                    self._release(backend)
+                    error = exc
+                    continue
+                except BaseException:
+                    self._release(backend)
+                    raise
+                self._success(backend, cls, time.monotonic() - start)
+                return response
+            raise error or _no_backend_class()("Backends ocupados com chamadas de teste")
+        return routed_create
+
+    def wrap_async(self, acreate):
+        async def routed_acreate(**kwargs):
+            if not kwargs.pop("route", True):
+                return await acreate(**kwargs)
+            cls = call_class(kwargs)
+            error = None
+            for backend in self._start(kwargs):
+                if not self._acquire(backend):
+                    continue
+                if error is not None:
+                    self._count_failover()
+                start = time.monotonic()
+                try:
+                    response = await acreate(**self._attempt_kwargs(backend, kwargs, async_client=True))
+                except _failover_errors() as exc:
+                    self._failure(backend)
+                    error = exc
+                    continue
+                except UnpricedModel as exc:
+                    # Orcamento ativo e modelo sem preco: tenta um backend com preco
+                    self._release(backend)
+                    error = exc
+                    continue
+                except BaseException:
+                    self._release(backend)
+                    raise
+                self._success(backend, cls, time.monotonic() - start)
+                return response
+            raise error or _no_backend_class()("Backends ocupados com chamadas de teste")
+        return routed_acreate
+
+    # ---- observabilidade ----
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failovers": self.failovers,
+                "explored": self.explored,
+                "unavailable": self.unavailable,
+                "backends": {
+                    backend.name: {
+                        "model": backend.model,
+                        "state": health.breaker.state,
+                        "calls": health.calls,
+                        "failures": health.failures,
+                        "error_rate": round(health.error_rate, 3),
+                        "latency": {cls: round(value, 3) for cls, value in health.latency.items()},
+                        "circuit_opened": health.breaker.opened,
+                    }
+                    for backend in self.backends
+                    for health in [self._health[backend.name]]
+                },
+            }
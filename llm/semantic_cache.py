@@ -0,0 +1,406 @@
+"""
+Cache semantico: respostas reaproveitadas para perguntas parecidas.
+
+O cache exato (llm/cache.py) so acerta quando a request e identica byte a
+byte. Em atendimento a mesma pergunta chega escrita de dezenas de jeitos
+("Meu pedido nao chegou ainda, o que faco?", "meu pedido ainda nao chegou,
+e agora?"). Aqui a ultima mensagem do usuario vira um embedding e e
+comparada com as perguntas ja respondidas:
+
+- os embeddings ficam numa matriz NumPy (capacity x dim), normalizados, e a
+  busca e um unico produto matricial (similaridade de cosseno contra todas
+  as linhas de uma vez)
+- opcionalmente a matriz e um arquivo .npy mapeado em memoria (np.memmap):
+  persiste entre execucoes e o SO carrega so as paginas tocadas
+- so vale dentro do mesmo escopo: model, system prompt, historico anterior e
+  parametros (temperature, max_tokens...) entram num hash - a mesma pergunta
+  com outro system prompt nao reaproveita a resposta
+- acima de `threshold` a resposta guardada volta sem chamar o modelo
+- cheio (capacity), a entrada usada ha mais tempo da lugar a nova
+
+Requer NumPy (`pip install numpy`). Os embeddings vem da API
+(OpenAIEmbedder, uma chamada barata por pergunta) ou de HashingEmbedder
+(n-gramas de caracteres, local e sem rede - pega parafrases com palavras em
+comum, nao sinonimos).
+
+So entram chamadas que pedem o cache (`semantic_cache=True`, removido aqui
+antes de seguir): respostas livres como as de atendimento. Classificacao e
+extracao ficam de fora - "tenho 32 anos" e "tenho 33 anos" sao parecidas o
+bastante para devolver o dado extraido do outro texto.
+
+No caminho async o SQLite e o flush da matriz rodam numa thread
+(asyncio.to_thread), sem travar o event loop.
+
+Registre-a ANTES do cache exato (llm.client: a ultima registrada e a
+primeira a ver a chamada): o que for identico volta do cache exato e nem
+chega a gerar embedding.
+
+Embedding com dimensao diferente da do indice (outro embedder sobre um
+indice persistido) nao quebra a chamada: o cache fica de fora, como quando
+o embedding falha.
+
+Uso:
+    semantic = use(SemanticCache(threshold=0.9, capacity=10_000, path=".cache/semantic"))
+    cache = use(ResponseCache(...))
+    ...
+    create_completion(..., semantic_cache=True)
+    print(semantic.stats())
+"""
+import asyncio
+import importlib.util
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from llm.cache import cache_key
+from llm.client import get_client
+from llm.text import char_ngrams
+
+
+def _numpy():
+    if importlib.util.find_spec("numpy") is None:
+        raise RuntimeError("O cache semantico requer `pip install numpy`.")
+    import numpy
+    return numpy
+
+
+def _normalize(np, matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+# ---- embeddings ----
+
+class HashingEmbedder:
+    """
+    Embedding local: n-gramas de caracteres espalhados em `dim` posicoes por hash.
+
+    Deterministico e sem rede. Bom para parafrases que mudam ordem, acento e
+    pontuacao; nao entende sinonimos.
+    """
+
+    def __init__(self, dim: int = 512, n: int = 3):
+        self.dim = dim
+        self.n = n
+
+    def embed(self, texts):
+        np = _numpy()
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for gram in char_ngrams(text, self.n):
+                rows.append(row)
+                cols.append(zlib.crc32(gram.encode()) % self.dim)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+        return _normalize(np, matrix)
+
+
+class OpenAIEmbedder:
+    """
+    Embeddings da API (uma request para varios textos).
+
+    dimensions: reduz o vetor (text-embedding-3-*) - 256 ja separa bem
+    perguntas de atendimento e ocupa 6x menos que os 1536 padrao.
+    """
+
+    def __init__(self, model: str = "text-embedding-3-small", dimensions: int = None, client=None):
+        self.model = model
+        self.dimensions = dimensions
+        self._client = client
+
+    def embed(self, texts):
+        np = _numpy()
+        extra = {"dimensions": self.dimensions} if self.dimensions else {}
+        response = (self._client or get_client()).embeddings.create(model=self.model, input=list(texts), **extra)
+        data = sorted(response.data, key=lambda item: item.index)
+        return _normalize(np, np.array([item.embedding for item in data], dtype=np.float32))
+
+
+# ---- indice ----
+
+class VectorIndex:
+    """
+    Matriz de embeddings normalizados com o escopo e o ultimo uso de cada linha.
+
+    As linhas sao ocupadas em ordem; cheio, `add` reutiliza a linha usada ha
+    mais tempo. `path` (.npy) guarda a matriz num arquivo mapeado em memoria.
+    """
+
+    def __init__(self, capacity: int = 10_000, path: str = None):
+        np = self._np = _numpy()
+        self.path = path
+        self.vectors = None
+        if path and os.path.exists(path):
+            self.vectors = np.lib.format.open_memmap(path, mode="r+")
+            capacity = self.vectors.shape[0]
+        self.capacity = capacity
+        self.scopes = np.zeros(capacity, dtype=np.int64)
+        self.used = np.full(capacity, -np.inf)   # -inf = linha livre
+        self.filled = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return int((self.used[:self.filled] > -self._np.inf).sum())
+
+    def _allocate(self, dim: int):
+        np = self._np
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.vectors = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float32, shape=(self.capacity, dim))
+        else:
+            self.vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+
+    def search(self, queries, scopes):
+        """(linha, similaridade) da melhor entrada do mesmo escopo para cada consulta (-1 se nenhuma)."""
+        np = self._np
+        queries = np.atleast_2d(queries)
+        scopes = np.asarray(scopes, dtype=np.int64).reshape(-1)
+        if self.filled == 0:
+            return np.full(len(queries), -1), np.full(len(queries), -np.inf)
+        # Vetores normalizados: cosseno = produto escalar, todas as linhas de uma vez
+        similarity = queries @ self.vectors[:self.filled].T
+        other = (self.scopes[:self.filled][None, :] != scopes[:, None]) | (self.used[:self.filled] == -np.inf)[None, :]
+        similarity[other] = -np.inf
+        best = similarity.argmax(axis=1)
+        scores = similarity[np.arange(len(queries)), best]
+        return np.where(np.isfinite(scores), best, -1), scores
+
+    def add(self, vector, scope: int, now: float) -> int:
+        """Grava o vetor e devolve a linha (a menos usada, se o indice estiver cheio)."""
+        if self.vectors is None:
+            self._allocate(len(vector))
+        elif len(vector) != self.vectors.shape[1]:
+            raise ValueError(f"Embedding com {len(vector)} dimensoes, indice com {self.vectors.shape[1]}")
+        if self.filled < self.capacity:
+            slot = self.filled
+            self.filled += 1
+        else:
+            slot = int(self.used.argmin())
+            if self.used[slot] > -self._np.inf:
+                self.evictions += 1
+        self.vectors[slot] = vector
+        self.scopes[slot] = scope
+        self.used[slot] = now
+        return slot
+
+    def restore(self, slot: int, scope: int, used: float):
+        self.scopes[slot] = scope
+        self.used[slot] = used
+        self.filled = max(self.filled, slot + 1)
+
+    def touch(self, slot: int, now: float):
+        self.used[slot] = now
+
+    def flush(self):
+        if hasattr(self.vectors, "flush"):
+            self.vectors.flush()
+
+
+# ---- camada ----
+
+class SemanticCache:
+    """
+    Camada de cache semantico para o pipeline de llm.client.
+
+    embedder:   OpenAIEmbedder (padrao) ou HashingEmbedder
+    threshold:  similaridade de cosseno minima para reaproveitar a resposta
+    capacity:   entradas no indice (a menos usada sai quando enche)
+    path:       prefixo dos arquivos persistentes (<path>.npy e <path>.sqlite)
+    """
+
+    def __init__(self, embedder=None, threshold: float = 0.9, capacity: int = 10_000, path: str = None):
+        self.embedder = embedder or OpenAIEmbedder()
+        self.threshold = threshold
+        self.index = VectorIndex(capacity, path + ".npy" if path else None)
+        self._entries = {}   # linha -> {"text", "response", "elapsed"}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._open(path + ".sqlite")
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.embed_errors = 0
+        self.index_errors = 0
+        self.saved_seconds = 0.0
+        self.embed_seconds = 0.0
+        self._hit_similarity = 0.0
+
+    # ---- persistencia ----
+
+    def _open(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " slot INTEGER PRIMARY KEY, scope INTEGER NOT NULL, text TEXT NOT NULL,"
+            " response TEXT NOT NULL, elapsed REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+        if self.index.vectors is None:
+            # Matriz perdida ou nunca criada: os metadados nao servem sem ela
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            return
+        from openai.types.chat import ChatCompletion
+
+        for slot, scope, text, response, elapsed, accessed in self._conn.execute("SELECT * FROM entries"):
+            self.index.restore(slot, scope, accessed)
+            self._entries[slot] = {
+                "text": text,
+                "response": ChatCompletion.model_validate_json(response),
+                "elapsed": elapsed,
+            }
+
+    def _persist(self, slot, scope, entry, now):
+        if self._conn is None:
+            return
+        self.index.flush()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (slot, scope, text, response, elapsed, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+            (slot, scope, entry["text"], entry["response"].model_dump_json(), entry["elapsed"], now),
+        )
+        self._conn.commit()
+
+    # ---- busca ----
+
+    @staticmethod
+    def _query(kwargs):
+        """(texto, escopo) da request, ou None se ela nao pode usar o cache."""
+        if kwargs.get("stream") or kwargs.get("n", 1) != 1:
+            return None
+        messages = list(kwargs.get("messages") or [])
+        last = messages[-1] if messages else None
+        if not isinstance(last, dict) or last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        # Escopo: tudo menos a ultima mensagem (model, system prompt, historico, parametros)
+        scope = int(cache_key({**kwargs, "messages": messages[:-1]})[:15], 16)
+        return last["content"], scope
+
+    def _lookup(self, vector, scope):
+        """Resposta guardada, None se nao ha entrada parecida ou False se o indice nao aceita o vetor."""
+        with self._lock:
+            try:
+                slots, scores = self.index.search(vector, [scope])
+            except ValueError:
+                # Dimensao do embedding diferente da do indice
+                self.index_errors += 1
+                return False
+            slot, score = int(slots[0]), float(scores[0])
+            if slot < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[slot]
+            now = time.time()
+            self.index.touch(slot, now)
+            if self._conn is not None:
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE slot = ?", (now, slot))
+                self._conn.commit()
+            self.hits += 1
+            self.saved_seconds += entry["elapsed"]
+            self._hit_similarity += score
+            return entry["response"]
+
+    def _store(self, text, vector, scope, response, elapsed):
+        choice = response.choices[0] if getattr(response, "choices", None) else None
+        # So respostas completas de texto (nada cortado por max_tokens nem tool calls)
+        if choice is None or choice.finish_reason != "stop" or not choice.message.content or choice.message.tool_calls:
+            return
+        entry = {"text": text, "response": response, "elapsed": elapsed}
+        with self._lock:
+            now = time.time()
+            try:
+                slot = self.index.add(vector, scope, now)
+            except ValueError:
+                # A chamada ja deu certo: o cache so fica de fora
+                self.index_errors += 1
+                return
+            self._entries[slot] = entry
+            self._persist(slot, scope, entry, now)
+
+    def _embed(self, text):
+        start = time.perf_counter()
+        try:
+            return self.embedder.embed([text])[0]
+        except Exception:
+            # Sem embedding o cache so fica de fora: a chamada segue normal
+            with self._lock:
+                self.embed_errors += 1
+            return None
+        finally:
+            with self._lock:
+                self.embed_seconds += time.perf_counter() - start
+
+    # ---- camada do pipeline ----
+
+    async def _in_thread(self, func, *args):
+        # Com persistencia (SQLite + memmap) a I/O sai do event loop; so em memoria roda direto
+        if self._conn is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+
+    def wrap(self, create):
+        def semantic_create(**kwargs):
+            if not kwargs.pop("semantic_cache", False):
+                return create(**kwargs)
+            query = self._query(kwargs)
+            vector = self._embed(query[0]) if query is not None else None
+            if vector is None:
+                with self._lock:
+                    self.bypassed += 1
+                return create(**kwargs)
+            response = self._lookup(vector, query[1])
+            if response is False:
+                with self._lock:
+                    self.bypassed += 1
+                return create(**kwargs)
+            if response is None:
+                start = time.perf_counter()
+                response = create(**kwargs)
+                self._store(query[0], vector, query[1], response, time.perf_counter() - start)
+            return response
+        return semantic_create
+
+    def wrap_async(self, acreate):
+        async def semantic_acreate(**kwargs):
+            if not kwargs.pop("semantic_cache", False):
+                return await acreate(**kwargs)
+            query = self._query(kwargs)
+            vector = await asyncio.to_thread(self._embed, query[0]) if query is not None else None
+            if vector is None:
+                with self._lock:
+                    self.bypassed += 1
+                return await acreate(**kwargs)
+            response = await self._in_thread(self._lookup, vector, query[1])
+            if response is False:
+                with self._lock:
+                    self.bypassed += 1
+                return await acreate(**kwargs)
+            if response is None:
+                start = time.perf_counter()
+                response = await acreate(**kwargs)
+                await self._in_thread(self._store, query[0], vector, query[1], response, time.perf_counter() - start)
+            return response
+        return semantic_acreate
+
+    # ---- observabilidade ----
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "mean_hit_similarity": round(self._hit_similarity / self.hits, 4) if self.hits else None,
+            "entries": len(self.index),
+            "evictions": self.index.evictions,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "embed_seconds": round(self.embed_seconds, 3),
+            "embed_errors": self.embed_errors,
+            "index_errors": self.index_errors,
+        }
@@ -0,0 +1,255 @@
+"""
+Streaming (`stream=True`) com medicao de latencia.
+
+Sem streaming, o usuario so ve algo quando a resposta inteira chega. Com
+streaming, o que ele sente e o TTFT (time to first token). Este modulo
+consome o stream, repassa cada pedaco de texto para um callback e mede:
+
+- ttft:          tempo ate o primeiro token (texto ou tool call)
+- inter_token:   intervalos entre chunks consecutivos
+- total:         tempo ate o fim do stream
+- tokens/s:      completion_tokens / (total - ttft)
+
+Tambem remonta `tool_calls` a partir dos deltas (id/nome chegam no primeiro
+delta de cada indice, os argumentos chegam fatiados) e le o chunk final de
+`usage` (stream_options={"include_usage": True}).
+
+Com `stop_when` (condicoes de llm.early_stop), o texto acumulado e avaliado
+a cada chunk e o stream e fechado assim que uma condicao casa.
+"""
+import statistics
+import time
+from dataclasses import dataclass, field
+
+from llm.client import create_completion
+from llm.early_stop import first_stop
+
+
+@dataclass
+class StreamMetrics:
+    ttft: float = None
+    total: float = 0.0
+    inter_token: list = field(default_factory=list)
+    chunks: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        generation = self.total - (self.ttft or 0.0)
+        return self.completion_tokens / generation if generation > 0 else 0.0
+
+    @property
+    def mean_inter_token(self) -> float:
+        return statistics.fmean(self.inter_token) if self.inter_token else 0.0
+
+    def summary(self) -> str:
+        ttft = f"{self.ttft * 1000:.0f}ms" if self.ttft is not None else "-"
+        return (
+            f"TTFT={ttft} | inter-token={self.mean_inter_token * 1000:.1f}ms | "
+            f"total={self.total * 1000:.0f}ms | {self.tokens_per_second:.1f} tokens/s"
+        )
+
+
+@dataclass
+class StreamResult:
+    content: str = ""
+    tool_calls: list = field(default_factory=list)
+    finish_reason: str = None
+    usage: object = None
+    metrics: StreamMetrics = field(default_factory=StreamMetrics)
+    # Motivo da parada do lado do cliente (stop_when), None se o stream terminou sozinho
+    stopped_by: str = None
+
+    def to_message(self) -> dict:
+        """Mensagem do assistente pronta para ser reenviada em `messages`."""
+        message = {"role": "assistant", "content": self.content or None}
+        if self.tool_calls:
+            message["tool_calls"] = self.tool_calls
+        return message
+
+
+def _merge_tool_call_deltas(tool_calls: dict, deltas):
+    for delta in deltas:
+        call = tool_calls.setdefault(delta.index, {
+            "id": None,
+            "type": "function",
+            "function": {"name": "", "arguments": ""},
+        })
+        if delta.id:
+            call["id"] = delta.id
+        if delta.function is not None:
+            if delta.function.name:
+                call["function"]["name"] += delta.function.name
+            if delta.function.arguments:
+                call["function"]["arguments"] += delta.function.arguments
+
+
+def stream_completion(on_token=None, create=None, stop_when=None, **kwargs) -> StreamResult:
+    """
+    Executa uma chamada com stream=True e retorna o resultado remontado + metricas.
+
+    on_token:  callback chamado com cada pedaco de texto assim que ele chega
+               (ex: lambda t: print(t, end="", flush=True)).
+    stop_when: condicoes de llm.early_stop; a primeira que casar corta o texto
+               e fecha a conexao (motivo em result.stopped_by). Se o corte cair
+               num chunk anterior, on_token ja tera recebido esses caracteres.
+    """
+    create = create or create_completion
+    kwargs["stream"] = True
+    kwargs.setdefault("stream_options", {"include_usage": True})
+
+    result = StreamResult()
+    metrics = result.metrics
+    tool_calls = {}
+    content = ""
+    stop_when = list(stop_when or [])
+    for condition in stop_when:
+        condition.reset()
+
+    start = time.perf_counter()
+    last = None
+    stream = create(**kwargs)
+    try:
+        for chunk in stream:
+            now = time.perf_counter()
+
+            # O ultimo chunk (include_usage) vem com choices vazio
+            if chunk.usage is not None:
+                result.usage = chunk.usage
+            if not chunk.choices:
+                continue
+
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if choice.finish_reason:
+                result.finish_reason = choice.finish_reason
+
+            if delta is None or not (delta.content or delta.tool_calls):
+                continue
+
+            metrics.chunks += 1
+            if metrics.ttft is None:
+                metrics.ttft = now - start
+            else:
+                metrics.inter_token.append(now - last)
+            last = now
+
+            if delta.tool_calls:
+                _merge_tool_call_deltas(tool_calls, delta.tool_calls)
+            if delta.content:
+                start_of_delta = len(content)
+                content += delta.content
+                stop = first_stop(stop_when, content, start_of_delta) if stop_when else None
+                if stop is not None:
+                    cut, result.stopped_by = stop
+                    if on_token is not None and cut > start_of_delta:
+                        on_token(content[start_of_delta:cut])
+                    content = content[:cut]
+                    # O finally fecha a conexao: o modelo para de gerar
+                    break
+                if on_token is not None:
+                    on_token(delta.content)
+    finally:
+        # Fecha a conexao mesmo se o callback abortar o stream no meio
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+    metrics.total = time.perf_counter() - start
+    result.content = content
+    result.tool_calls = [tool_calls[i] for i in sorted(tool_calls)]
+    # Sem usage (endpoint que ignora include_usage), cada chunk ~ 1 token
+    metrics.completion_tokens = result.usage.completion_tokens if result.usage else metrics.chunks
+    return result
+
+
+class ObservedStream:
+    """
+    Repassa os chunks de um stream do SDK chamando `on_chunk(chunk)` para
+    cada um e `on_finish(error)` uma unica vez - no fim, no erro ou no close
+    (quem abandona o stream no meio tambem conta). Usado pelas camadas que
+    precisam ver o `usage` do chunk final (llm.metrics, llm.cost).
+    """
+
+    def __init__(self, stream, on_chunk=None, on_finish=None):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._on_chunk = on_chunk
+        self._on_finish = on_finish
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._finish()
+            raise
+        except Exception as exc:
+            self._finish(exc)
+            raise
+        if self._on_chunk is not None:
+            self._on_chunk(chunk)
+        return chunk
+
+    def _finish(self, error=None):
+        if not self._finished:
+            self._finished = True
+            if self._on_finish is not None:
+                self._on_finish(error)
+
+    def close(self):
+        self._finish()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class AsyncObservedStream(ObservedStream):
+    """Versao para streams async (AsyncStream do SDK)."""
+
+    def __init__(self, stream, on_chunk=None, on_finish=None):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._on_chunk = on_chunk
+        self._on_finish = on_finish
+        self._finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except Exception as exc:
+            self._finish(exc)
+            raise
+        if self._on_chunk is not None:
+            self._on_chunk(chunk)
+        return chunk
+
+    async def close(self):
+        self._finish()
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            await close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
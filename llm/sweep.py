@@ -0,0 +1,216 @@
+"""
+Varredura declarativa de parametros.
+
+Em vez de loops aninhados com `for i in range(3)` (uma request por amostra),
+uma varredura e descrita por:
+
+- prompts:  {id: texto ou lista de messages}
+- grid:     {parametro: [valores]} (produto cartesiano) ou lista explicita
+            de pontos [{parametro: valor}, ...]
+- samples:  amostras por ponto - viram `n=` numa UNICA request
+
+Cada (prompt, ponto) e uma request; todas rodam em paralelo pelo motor
+(llm.engine). Parametros do ponto sobrescrevem os fixos (`params`). O
+resultado guarda parametros, saidas, tokens, latencia e finish_reason e pode
+ser salvo em formato colunar para analise. Uma request que falha nao derruba
+a varredura: o erro fica no ponto (`SweepPoint.error`, coluna `error`).
+
+Formatos:
+
+    .parquet  (requer pyarrow)
+    .csv
+    .json     ({coluna: [valores]}, o padrao)
+
+Uso:
+    sweep = Sweep(
+        prompts={"startup": "Sugira um nome para uma startup de IA"},
+        grid={"temperature": [0.0, 0.7, 1.2], "top_p": [0.5, 1.0]},
+        samples=3, params={"max_tokens": 20},
+    )
+    result = sweep.run()
+    result.save("sweep.parquet")
+
+Ou por linha de comando, a partir de um JSON com os mesmos campos:
+    python -m llm.sweep spec.json --output sweep.csv
+"""
+import argparse
+import csv
+import importlib.util
+import itertools
+import json
+from dataclasses import dataclass, field
+
+from llm.engine import get_engine
+
+# Ordem das colunas de parametros no arquivo de saida
+PARAM_COLUMNS = ("temperature", "top_p", "presence_penalty", "frequency_penalty", "max_tokens")
+
+
+def _messages(prompt) -> list:
+    return [{"role": "user", "content": prompt}] if isinstance(prompt, str) else list(prompt)
+
+
+@dataclass
+class SweepPoint:
+    """Uma request da varredura: um prompt em um ponto da grade, com `n` amostras."""
+    prompt_id: str
+    params: dict
+    outputs: list = field(default_factory=list)
+    finish_reasons: list = field(default_factory=list)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    error: str = None          # "Tipo: mensagem" quando a request do ponto falhou
+
+
+@dataclass
+class SweepResult:
+    model: str
+    points: list
+
+    def select(self, prompt_id=None, **params) -> list:
+        """Pontos de um prompt e/ou com os parametros informados."""
+        return [
+            point for point in self.points
+            if (prompt_id is None or point.prompt_id == prompt_id)
+            and all(point.params.get(k) == v for k, v in params.items())
+        ]
+
+    def rows(self) -> list:
+        """Uma linha por amostra (tokens e latencia sao da request inteira)."""
+        keys = [k for k in PARAM_COLUMNS if any(k in p.params for p in self.points)]
+        keys += sorted({k for p in self.points for k in p.params} - set(keys))
+        rows = []
+        for point in self.points:
+            # Ponto com erro vira uma linha sem saida, para nao sumir da analise
+            samples = list(zip(point.outputs, point.finish_reasons)) or [(None, None)]
+            for sample, (output, finish_reason) in enumerate(samples):
+                rows.append({
+                    "model": self.model,
+                    "prompt_id": point.prompt_id,
+                    **{k: point.params.get(k) for k in keys},
+                    "sample": sample,
+                    "output": output,
+                    "finish_reason": finish_reason,
+                    "prompt_tokens": point.prompt_tokens,
+                    "completion_tokens": point.completion_tokens,
+                    "latency": round(point.latency, 4),
+                    "error": point.error,
+                })
+        return rows
+
+    def columns(self) -> dict:
+        rows = self.rows()
+        return {key: [row[key] for row in rows] for key in (rows[0] if rows else {})}
+
+    def save(self, path: str):
+        if path.endswith(".parquet"):
+            if importlib.util.find_spec("pyarrow") is None:
+                raise RuntimeError("Salvar em .parquet requer `pip install pyarrow`; use .csv ou .json.")
+            import pyarrow
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(pyarrow.table(self.columns()), path)
+        elif path.endswith(".csv"):
+            rows = self.rows()
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.columns(), f, ensure_ascii=False)
+
+    @property
+    def requests(self) -> int:
+        return len(self.points)
+
+    @property
+    def errors(self) -> list:
+        """Pontos cuja request falhou."""
+        return [point for point in self.points if point.error is not None]
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(p.prompt_tokens + p.completion_tokens for p in self.points)
+
+
+@dataclass
+class Sweep:
+    prompts: dict
+    grid: object = field(default_factory=dict)   # {param: [valores]} ou [{param: valor}, ...]
+    samples: int = 1
+    model: str = "gpt-4o-mini"
+    params: dict = field(default_factory=dict)   # fixos em todas as requests
+    system: str = None
+
+    def __post_init__(self):
+        if not isinstance(self.prompts, dict):
+            self.prompts = {str(i): prompt for i, prompt in enumerate(self.prompts)}
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "Sweep":
+        return cls(**spec)
+
+    def grid_points(self) -> list:
+        if isinstance(self.grid, list):
+            return [dict(point) for point in self.grid]
+        keys = list(self.grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(self.grid[k] for k in keys))]
+
+    def calls(self) -> list:
+        """(prompt_id, ponto, kwargs) de cada request da varredura."""
+        calls = []
+        for prompt_id, prompt in self.prompts.items():
+            messages = _messages(prompt)
+            if self.system:
+                messages = [{"role": "system", "content": self.system}] + messages
+            for point in self.grid_points():
+                # O ponto sobrescreve params (dict(**params, **point) levantaria TypeError)
+                kwargs = {"model": self.model, "messages": messages, **self.params, **point}
+                if self.samples > 1:
+                    kwargs["n"] = self.samples
+                calls.append((prompt_id, point, kwargs))
+        return calls
+
+    def run(self, engine=None) -> SweepResult:
+        engine = engine or get_engine()
+        calls = self.calls()
+        points = []
+        responses = engine.map_timed((kwargs for *_, kwargs in calls), return_exceptions=True)
+        for (prompt_id, point, _), (response, latency) in zip(calls, responses):
+            if isinstance(response, BaseException):
+                points.append(SweepPoint(prompt_id=prompt_id, params=point,
+                                         error=f"{type(response).__name__}: {response}"))
+                continue
+            choices = sorted(response.choices, key=lambda c: c.index)
+            usage = response.usage
+            points.append(SweepPoint(
+                prompt_id=prompt_id,
+                params=point,
+                outputs=[(c.message.content or "").strip() for c in choices],
+                finish_reasons=[c.finish_reason for c in choices],
+                prompt_tokens=usage.prompt_tokens if usage else 0,
+                completion_tokens=usage.completion_tokens if usage else 0,
+                latency=latency,
+            ))
+        return SweepResult(self.model, points)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Varredura de parametros de Chat Completions.")
+    parser.add_argument("spec", help="JSON com prompts, grid, samples, model, params, system")
+    parser.add_argument("--output", default="sweep.json", help="arquivo de saida (.parquet, .csv ou .json)")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    with open(args.spec, encoding="utf-8") as f:
+        sweep = Sweep.from_dict(json.load(f))
+    result = sweep.run()
+    result.save(args.output)
+    print(f"{result.requests} requests ({len(result.errors)} com erro), {len(result.rows())} amostras, "
+          f"{result.total_tokens} tokens -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
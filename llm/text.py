@@ -0,0 +1,27 @@
+"""
+Normalizacao de texto sem dependencias.
+
+Usada pelo pre-classificador (llm.preclassifier) e pelo embedder local do
+cache semantico (llm.semantic_cache): regras, features e n-gramas nao
+dependem de caixa nem de acentos. So a biblioteca padrao, para que importar
+um nao carregue o outro (nem NumPy, nem o SDK).
+"""
+import unicodedata
+
+
+def strip_accents(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+
+
+def normalize(text: str) -> str:
+    """Minusculo e sem acentos (regras e features nao dependem de grafia)."""
+    return strip_accents(text.lower())
+
+
+def char_ngrams(text: str, n: int = 3) -> list:
+    """N-gramas de caracteres de cada palavra (minusculo, sem acentos)."""
+    grams = []
+    for word in normalize(text).split():
+        padded = f" {word} "
+        grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
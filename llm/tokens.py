@@ -0,0 +1,374 @@
+"""
+Contagem local de tokens e orcamento pre-envio.
+
+`demo_max_tokens` estimava tamanho com `len(content.split())` e o custo so
+era conhecido depois da resposta. Aqui contamos tokens ANTES de enviar:
+
+- count_tokens / count_batch:  texto(s) avulso(s)
+- count_message_tokens:        lista `messages` completa (overhead por mensagem)
+- count_request_tokens:        request inteira, incluindo tools e json_schema
+- fit_max_tokens / TokenBudget: rejeitar, cortar historico ou escolher max_tokens
+
+Encoder:
+- Exato: tiktoken, SOMENTE se o arquivo do vocabulario ja estiver em disco
+  (diretorio `CHAT_TOKENIZER_DIR`, padrao `llm/tokenizer_data/`). Nunca
+  baixamos nada em tempo de execucao; para empacotar o vocabulario junto do
+  deploy, rode uma vez no build:  python -m llm.tokens bundle
+- Aproximado: sem tiktoken/vocabulario, um pre-tokenizador por regex no
+  estilo do o200k (palavras, grupos de 3 digitos, pontuacao). Erra por poucos
+  porcento em texto comum - suficiente para orcamento, nao para cobranca.
+
+O repositorio NAO traz o vocabulario (sao varios MB) nem exige tiktoken: numa
+instalacao padrao (requirements.txt) TODAS as contagens sao aproximadas.
+Contagem exata exige `pip install tiktoken` + `python -m llm.tokens bundle`;
+`get_encoder(model).exact` diz qual encoder esta em uso.
+
+Encoders sao criados uma vez por modelo e contagens de textos repetidos
+(system prompts) ficam num LRU.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+
+DEFAULT_MODEL = "gpt-4o-mini"
+TOKENIZER_DIR = os.getenv(
+    "CHAT_TOKENIZER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizer_data")
+)
+
+ENCODING_URLS = {
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+}
+
+# Janela de contexto (prompt + resposta) por modelo
+CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+}
+
+# Limite de tokens de saida por resposta
+MAX_OUTPUT_TOKENS = {
+    "gpt-4o-mini": 16_384,
+    "gpt-4o": 16_384,
+    "gpt-4-turbo": 4_096,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 4_096,
+}
+
+# Overhead do formato de chat (OpenAI cookbook)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+
+# Overhead da definicao de tools (OpenAI cookbook, modelos gpt-4o)
+FUNC_INIT, PROP_INIT, PROP_KEY, ENUM_INIT, ENUM_ITEM, FUNC_END = 7, 3, 3, -3, 3, 12
+RESPONSE_FORMAT_OVERHEAD = 10
+
+
+class TokenBudgetExceeded(ValueError):
+    """A request nao cabe no orcamento de tokens configurado."""
+
+    def __init__(self, prompt_tokens: int, budget: int):
+        super().__init__(f"Prompt com {prompt_tokens} tokens excede o orcamento de {budget}")
+        self.prompt_tokens = prompt_tokens
+        self.budget = budget
+
+
+def encoding_name(model: str) -> str:
+    if model.startswith(("gpt-4o", "o1", "o3", "o4", "gpt-4.1", "gpt-5")):
+        return "o200k_base"
+    return "cl100k_base"
+
+
+def _by_model_prefix(table: dict, model: str) -> int:
+    for prefix, value in sorted(table.items(), key=lambda item: -len(item[0])):
+        if model.startswith(prefix):
+            return value
+    return table[DEFAULT_MODEL]
+
+
+def context_window(model: str) -> int:
+    return _by_model_prefix(CONTEXT_WINDOWS, model)
+
+
+def max_output_tokens(model: str) -> int:
+    return _by_model_prefix(MAX_OUTPUT_TOKENS, model)
+
+
+# =========================
+# ENCODERS
+# =========================
+
+class ApproximateEncoder:
+    """Pre-tokenizacao por regex + regra de tamanho para palavras longas."""
+
+    name = "approximate"
+    exact = False
+
+    _PIECES = re.compile(r"[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n/]*|\s*[\r\n]+|\s+")
+
+    def count(self, text: str) -> int:
+        total = 0
+        for piece in self._PIECES.findall(text):
+            stripped = piece.strip()
+            if not stripped:
+                total += 1
+            elif stripped[-1].isalpha():
+                # Palavras comuns de ate ~6 letras costumam ser 1 token; as maiores quebram
+                total += 1 + max(0, len(stripped) - 6) // 4
+            elif stripped.isdigit():
+                total += 1
+            else:
+                total += max(1, math.ceil(len(stripped) / 2))
+        return total
+
+    def count_batch(self, texts) -> list:
+        return [self.count(text) for text in texts]
+
+
+class TiktokenEncoder:
+    """Contagem exata com o vocabulario BPE real (carregado de disco)."""
+
+    exact = True
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self.name = encoding.name
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def encode(self, text: str) -> list:
+        return self._encoding.encode(text, disallowed_special=())
+
+    def decode(self, tokens) -> str:
+        return self._encoding.decode(list(tokens))
+
+    def count_batch(self, texts) -> list:
+        # encode_batch paraleliza em threads nativas do tiktoken
+        return [len(tokens) for tokens in self._encoding.encode_batch(list(texts), disallowed_special=())]
+
+
+def _bundled_file(name: str) -> str:
+    # Mesmo nome de arquivo que o cache do tiktoken usa (sha1 da URL)
+    return os.path.join(TOKENIZER_DIR, hashlib.sha1(ENCODING_URLS[name].encode()).hexdigest())
+
+
+@contextmanager
+def _tiktoken_cache_dir():
+    """Aponta o cache do tiktoken para TOKENIZER_DIR so durante o bloco (outros usuarios do tiktoken nao mudam)."""
+    previous = os.environ.get("TIKTOKEN_CACHE_DIR")
+    os.environ["TIKTOKEN_CACHE_DIR"] = TOKENIZER_DIR
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("TIKTOKEN_CACHE_DIR", None)
+        else:
+            os.environ["TIKTOKEN_CACHE_DIR"] = previous
+
+
+@lru_cache(maxsize=None)
+def _load_encoder(name: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return ApproximateEncoder()
+    if not os.path.exists(_bundled_file(name)):
+        return ApproximateEncoder()
+    with _tiktoken_cache_dir():
+        return TiktokenEncoder(tiktoken.get_encoding(name))
+
+
+def get_encoder(model: str = DEFAULT_MODEL):
+    return _load_encoder(encoding_name(model))
+
+
+# =========================
+# CONTAGEM
+# =========================
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    return get_encoder(model).count(text)
+
+
+def count_batch(texts, model: str = DEFAULT_MODEL) -> list:
+    return get_encoder(model).count_batch(texts)
+
+
+def token_ids(text: str, model: str = DEFAULT_MODEL):
+    """Ids dos tokens de `text`, ou None sem o vocabulario real (encoder aproximado)."""
+    encoder = get_encoder(model)
+    return encoder.encode(text) if encoder.exact else None
+
+
+def _content_text(content) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    # Conteudo multimodal: soma apenas as partes de texto
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def _as_dict(message) -> dict:
+    return message.model_dump(exclude_none=True) if hasattr(message, "model_dump") else message
+
+
+def count_message_tokens(messages, model: str = DEFAULT_MODEL) -> int:
+    total = REPLY_PRIMING_TOKENS
+    for message in messages:
+        message = _as_dict(message)
+        total += TOKENS_PER_MESSAGE
+        total += count_tokens(message.get("role", ""), model)
+        total += count_tokens(_content_text(message.get("content")), model)
+        if message.get("name"):
+            total += TOKENS_PER_NAME + count_tokens(message["name"], model)
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call["function"]
+            total += count_tokens(function["name"], model) + count_tokens(function["arguments"], model)
+        if message.get("tool_call_id"):
+            total += count_tokens(message["tool_call_id"], model)
+    return total
+
+
+def count_tools_tokens(tools, model: str = DEFAULT_MODEL) -> int:
+    if not tools:
+        return 0
+    total = 0
+    for tool in tools:
+        function = tool["function"]
+        total += FUNC_INIT
+        total += count_tokens(f"{function['name']}:{function.get('description', '').rstrip('.')}", model)
+        properties = (function.get("parameters") or {}).get("properties") or {}
+        if properties:
+            total += PROP_INIT
+            for key, spec in properties.items():
+                total += PROP_KEY
+                total += count_tokens(f"{key}:{spec.get('type', '')}:{spec.get('description', '').rstrip('.')}", model)
+                if spec.get("enum"):
+                    total += ENUM_INIT + sum(ENUM_ITEM + count_tokens(str(item), model) for item in spec["enum"])
+    return total + FUNC_END
+
+
+def count_response_format_tokens(response_format, model: str = DEFAULT_MODEL) -> int:
+    if not response_format or response_format.get("type") != "json_schema":
+        return 0
+    schema = json.dumps(response_format["json_schema"], separators=(",", ":"), ensure_ascii=False)
+    return RESPONSE_FORMAT_OVERHEAD + count_tokens(schema, model)
+
+
+def count_request_tokens(kwargs: dict) -> int:
+    """Tokens de prompt de uma request completa (messages + tools + response_format)."""
+    model = kwargs.get("model", DEFAULT_MODEL)
+    return (
+        count_message_tokens(kwargs.get("messages", []), model)
+        + count_tools_tokens(kwargs.get("tools"), model)
+        + count_response_format_tokens(kwargs.get("response_format"), model)
+    )
+
+
+# =========================
+# ORCAMENTO
+# =========================
+
+def fit_max_tokens(kwargs: dict, prompt_tokens: int = None, reserve: int = 0) -> int:
+    """
+    max_tokens que cabe na janela do modelo: o pedido na request (ou o limite
+    de saida do modelo) limitado pelo espaco que sobra depois do prompt.
+    """
+    model = kwargs.get("model", DEFAULT_MODEL)
+    if prompt_tokens is None:
+        prompt_tokens = count_request_tokens(kwargs)
+    available = context_window(model) - prompt_tokens - reserve
+    if available <= 0:
+        raise TokenBudgetExceeded(prompt_tokens, context_window(model) - reserve)
+    requested = kwargs.get("max_completion_tokens") or kwargs.get("max_tokens") or max_output_tokens(model)
+    return min(requested, available, max_output_tokens(model))
+
+
+def trim_messages(messages, budget: int, model: str = DEFAULT_MODEL) -> list:
+    """
+    Remove as mensagens mais antigas (preservando system) ate caber em `budget`.
+    Uma mensagem `tool` nunca fica sem o assistant que a pediu.
+    """
+    messages = [_as_dict(m) for m in messages]
+    pinned = [m for m in messages if m.get("role") == "system"]
+    rest = [m for m in messages if m.get("role") != "system"]
+
+    while rest and count_message_tokens(pinned + rest, model) > budget:
+        rest.pop(0)
+        while rest and rest[0].get("role") == "tool":
+            rest.pop(0)
+    if count_message_tokens(pinned + rest, model) > budget:
+        raise TokenBudgetExceeded(count_message_tokens(pinned + rest, model), budget)
+    return pinned + rest
+
+
+class TokenBudget:
+    """
+    Camada do pipeline (llm.client.use) que conta o prompt antes de enviar.
+
+    - max_prompt_tokens: acima disso, corta historico (trim=True) ou levanta TokenBudgetExceeded
+    - preenche/limita max_tokens ao espaco que sobra na janela do modelo
+    """
+
+    def __init__(self, max_prompt_tokens: int = None, trim: bool = False):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.trim = trim
+
+    def prepare(self, kwargs: dict) -> dict:
+        prompt_tokens = count_request_tokens(kwargs)
+        if self.max_prompt_tokens is not None and prompt_tokens > self.max_prompt_tokens:
+            if not self.trim:
+                raise TokenBudgetExceeded(prompt_tokens, self.max_prompt_tokens)
+            overhead = prompt_tokens - count_message_tokens(kwargs["messages"], kwargs.get("model", DEFAULT_MODEL))
+            kwargs["messages"] = trim_messages(
+                kwargs["messages"], self.max_prompt_tokens - overhead, kwargs.get("model", DEFAULT_MODEL)
+            )
+            prompt_tokens = count_request_tokens(kwargs)
+        key = "max_completion_tokens" if "max_completion_tokens" in kwargs else "max_tokens"
+        fitted = fit_max_tokens(kwargs, prompt_tokens)
+        # So escreve max_tokens se a request ja tinha um ou se o limite padrao nao cabe
+        if key in kwargs or fitted < max_output_tokens(kwargs.get("model", DEFAULT_MODEL)):
+            kwargs[key] = fitted
+        return kwargs
+
+    def wrap(self, create):
+        def budgeted_create(**kwargs):
+            return create(**self.prepare(kwargs))
+        return budgeted_create
+
+    def wrap_async(self, acreate):
+        async def budgeted_acreate(**kwargs):
+            return await acreate(**self.prepare(kwargs))
+        return budgeted_acreate
+
+
+def bundle():
+    """Baixa os vocabularios para TOKENIZER_DIR (rodar no build, nunca em runtime)."""
+    import tiktoken
+
+    os.makedirs(TOKENIZER_DIR, exist_ok=True)
+    with _tiktoken_cache_dir():
+        for name in ENCODING_URLS:
+            tiktoken.get_encoding(name)
+            print(f"{name} -> {_bundled_file(name)}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["bundle"]:
+        bundle()
+    else:
+        encoder = get_encoder()
+        text = " ".join(sys.argv[1:]) or sys.stdin.read()
+        print(f"{encoder.count(text)} tokens ({encoder.name})")
@@ -0,0 +1,199 @@
+"""
+Transporte HTTP compartilhado e ajustado.
+
+Por padrao cada `OpenAI(...)` cria seu proprio pool httpx com limites e
+timeouts genericos. Sob concorrencia, handshakes TLS e pool esgotado
+dominam a latencia de cauda. Aqui configuramos explicitamente:
+
+- pool de conexoes (limite total e de keep-alive) e expiracao do keep-alive
+- HTTP/2 opcional (multiplexa varias requests numa conexao; requer `h2`)
+- timeouts de connect/read por classe de chamada (classificador vs geracao longa)
+- aquecimento de conexoes antes da primeira request
+
+Variaveis de ambiente (lidas por TransportConfig.from_env):
+    CHAT_MAX_CONNECTIONS, CHAT_MAX_KEEPALIVE, CHAT_KEEPALIVE_EXPIRY,
+    CHAT_HTTP2=1, CHAT_CONNECT_TIMEOUT, CHAT_WARM_UP=1, CHAT_SDK_MAX_RETRIES
+"""
+import asyncio
+import importlib.util
+import os
+import warnings
+from dataclasses import dataclass, field
+
+import httpx
+
+from llm.calls import CLASSIFICATION, EXTRACTION, GENERATION, TOOL_USE, call_class
+
+# Timeout de leitura (segundos) por classe de chamada
+DEFAULT_READ_TIMEOUTS = {
+    CLASSIFICATION: 10.0,
+    EXTRACTION: 30.0,
+    TOOL_USE: 30.0,
+    GENERATION: 120.0,
+}
+
+
+@dataclass
+class TransportConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 10.0
+    read_timeouts: dict = field(default_factory=lambda: dict(DEFAULT_READ_TIMEOUTS))
+    warm_up: bool = False
+    # Retries internos do SDK; use 0 quando a camada llm.resilience.Retry estiver ativa
+    max_retries: int = 2
+
+    @classmethod
+    def from_env(cls) -> "TransportConfig":
+        config = cls()
+        config.max_connections = int(os.getenv("CHAT_MAX_CONNECTIONS", config.max_connections))
+        config.max_keepalive_connections = int(os.getenv("CHAT_MAX_KEEPALIVE", config.max_keepalive_connections))
+        config.keepalive_expiry = float(os.getenv("CHAT_KEEPALIVE_EXPIRY", config.keepalive_expiry))
+        config.http2 = os.getenv("CHAT_HTTP2", "0") == "1"
+        config.connect_timeout = float(os.getenv("CHAT_CONNECT_TIMEOUT", config.connect_timeout))
+        config.warm_up = os.getenv("CHAT_WARM_UP", "0") == "1"
+        config.max_retries = int(os.getenv("CHAT_SDK_MAX_RETRIES", config.max_retries))
+        return config
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout(self, call_class_name: str = GENERATION) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeouts.get(call_class_name, self.read_timeouts[GENERATION]),
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def use_http2(self) -> bool:
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            warnings.warn("CHAT_HTTP2 ativo mas o pacote `h2` nao esta instalado (pip install httpx[http2]); usando HTTP/1.1.")
+            return False
+        return self.http2
+
+
+_config = None
+_response_hooks = []
+
+
+def add_response_hook(hook):
+    """
+    Registra hook(response: httpx.Response) chamado a cada resposta HTTP
+    (ex: ler os headers x-ratelimit-*). Vale tambem para clientes ja criados.
+    """
+    _response_hooks.append(hook)
+    return hook
+
+
+def remove_response_hook(hook):
+    """Desfaz add_response_hook (sem erro se o hook nao estiver registrado)."""
+    if hook in _response_hooks:
+        _response_hooks.remove(hook)
+
+
+def _dispatch_response(response):
+    for hook in _response_hooks:
+        hook(response)
+
+
+async def _adispatch_response(response):
+    _dispatch_response(response)
+
+
+def get_transport_config() -> TransportConfig:
+    global _config
+    if _config is None:
+        _config = TransportConfig.from_env()
+    return _config
+
+
+def configure_transport(config: TransportConfig):
+    """Define a configuracao usada pelos clientes criados depois desta chamada."""
+    global _config
+    _config = config
+
+
+def build_http_client(config: TransportConfig = None) -> httpx.Client:
+    config = config or get_transport_config()
+    return httpx.Client(
+        limits=config.limits,
+        http2=config.use_http2(),
+        timeout=config.timeout(GENERATION),
+        event_hooks={"response": [_dispatch_response]},
+    )
+
+
+def build_async_http_client(config: TransportConfig = None) -> httpx.AsyncClient:
+    config = config or get_transport_config()
+    return httpx.AsyncClient(
+        limits=config.limits,
+        http2=config.use_http2(),
+        timeout=config.timeout(GENERATION),
+        event_hooks={"response": [_adispatch_response]},
+    )
+
+
+def timeout_for(kwargs_or_class) -> httpx.Timeout:
+    """Timeout para uma chamada (dict de kwargs) ou para uma classe de chamada."""
+    name = kwargs_or_class if isinstance(kwargs_or_class, str) else call_class(kwargs_or_class)
+    return get_transport_config().timeout(name)
+
+
+# =========================
+# AQUECIMENTO
+# =========================
+
+def warm_up(http_client: httpx.Client, base_url) -> bool:
+    """
+    Abre (DNS + TCP + TLS) uma conexao do pool antes da primeira request.
+    O status da resposta nao importa; falhas sao ignoradas.
+    """
+    try:
+        http_client.get(str(base_url), timeout=get_transport_config().timeout(CLASSIFICATION))
+        return True
+    except httpx.HTTPError:
+        return False
+
+
+async def awarm_up(http_client: httpx.AsyncClient, base_url, connections: int = 1) -> int:
+    """Versao async: abre `connections` conexoes em paralelo. Retorna quantas deram certo."""
+    timeout = get_transport_config().timeout(CLASSIFICATION)
+
+    async def one():
+        try:
+            await http_client.get(str(base_url), timeout=timeout)
+            return True
+        except httpx.HTTPError:
+            return False
+
+    return sum(await asyncio.gather(*(one() for _ in range(connections))))
+
+
+# =========================
+# CAMADA: TIMEOUT POR CLASSE
+# =========================
+
+class TimeoutPolicy:
+    """Camada do pipeline (llm.client.use) que preenche `timeout` conforme a classe da chamada."""
+
+    def wrap(self, create):
+        def create_with_timeout(**kwargs):
+            kwargs.setdefault("timeout", timeout_for(kwargs))
+            return create(**kwargs)
+        return create_with_timeout
+
+    def wrap_async(self, acreate):
+        async def acreate_with_timeout(**kwargs):
+            kwargs.setdefault("timeout", timeout_for(kwargs))
+            return await acreate(**kwargs)
+        return acreate_with_timeout
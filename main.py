@@ -1,11 +1,129 @@
 import os
+import importlib.util
 import json
-import requests
-from openai import OpenAI
-from dotenv import load_dotenv
+import time
+
+from llm.agent import ToolRegistry, run_agent
+from llm.batch import BatchPipeline, read_jsonl, results_cost
+from llm.cache import ResponseCache
+from llm.classifier import LogprobClassifier, PackedClassifier
+from llm.client import create_completion, use
+from llm.coalesce import SingleFlight
+from llm.early_stop import JsonComplete, MaxChars, MaxItems
+from llm.cost import CostTracker, find_price
+from llm.engine import run_concurrently
+from llm.json_stream import stream_structured
+from llm.memory import ConversationMemory
+from llm.metrics import Metrics
+from llm.preclassifier import CascadeClassifier, NgramModel, Rule, RuleClassifier
+from llm.prompt_cache import PrefixLayout, PromptCacheStats, cached_tokens
+from llm.resilience import Hedge, Retry
+from llm.streaming import stream_completion
+from llm.sweep import Sweep
+from llm.tokens import count_request_tokens, count_tokens, get_encoder
+from llm.transport import TimeoutPolicy, get_transport_config
+
+# Modelo de todos os demos (no CLI: --model). Definido em setup().
+MODEL = "gpt-4o-mini"
+
+# Camadas do pipeline, criadas por setup() a partir do ambiente (CHAT_*). As opcionais
+# ficam None quando a variavel delas nao esta definida.
+cassette = prompt_cache = limiter = costs = router = None
+hedge = metrics = retry = flights = semantic = cache = None
+
+
+def setup():
+    """
+    Monta o pipeline de camadas a partir do ambiente (CHAT_*). Idempotente.
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    Nao roda no import: os pontos de entrada (cli.main, `python main.py`) carregam o .env
+    e aplicam as opcoes antes. Camadas opcionais so sao importadas quando habilitadas.
+    """
+    global MODEL, cassette, prompt_cache, limiter, costs, router
+    global hedge, metrics, retry, flights, semantic, cache
+    if metrics is not None:
+        return
+
+    MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+
+    # Retries ficam com a camada Retry (backoff por classe de erro), nao com o SDK.
+    # O cliente OpenAI so e criado na primeira chamada (llm.client.get_client).
+    get_transport_config().max_retries = 0
+
+    # Gravacao/reproducao das chamadas (CHAT_CASSETTE=arquivo.jsonl). Primeira camada,
+    # mais perto da API: em replay nada vai para a rede e o resto do pipeline nao muda.
+    if os.getenv("CHAT_CASSETTE"):
+        from llm.cassette import Cassette
+
+        cassette = use(Cassette(
+            os.environ["CHAT_CASSETTE"],
+            mode=os.getenv("CHAT_CASSETTE_MODE", "replay"),
+            timing=os.getenv("CHAT_CASSETTE_TIMING", "instant"),
+        ))
+
+    # Timeout de leitura por classe de chamada (classificador curto vs geracao longa)
+    use(TimeoutPolicy())
+
+    # Tokens de prompt reaproveitados pelo cache de prefixo do provedor
+    prompt_cache = use(PromptCacheStats())
+
+    # Limites da conta (RPM/TPM): chamadas esperam na fila em vez de tomar 429.
+    # Fica por dentro do cache, para que hits nao consumam o orcamento.
+    if os.getenv("CHAT_RPM") or os.getenv("CHAT_TPM"):
+        from llm.rate_limit import RateLimiter
+
+        limiter = use(RateLimiter(rpm=int(os.getenv("CHAT_RPM", 500)), tpm=int(os.getenv("CHAT_TPM", 200_000))))
+
+    # Custo por chamada e label; com CHAT_BUDGET_USD, chamadas que poderiam estourar o
+    # orcamento tem max_tokens reduzido ou sao bloqueadas. Fica por dentro do Hedge
+    # para contar tambem as copias hedgeadas.
+    costs = use(CostTracker(
+        budget=float(os.environ["CHAT_BUDGET_USD"]) if os.getenv("CHAT_BUDGET_USD") else None,
+        on_exceed=os.getenv("CHAT_BUDGET_POLICY", "downgrade"),
+    ))
+
+    # Pool de modelos/endpoints (CHAT_ROUTER=router.json): cada chamada vai para o backend
+    # mais rapido (e barato) da classe dela, com failover e circuit breaker. Por fora do
+    # custo (que ve o modelo escolhido), por dentro do Hedge e do Retry (cada copia e roteada).
+    if os.getenv("CHAT_ROUTER"):
+        from llm.router import Router, load_backends
+
+        router = use(Router(load_backends(os.environ["CHAT_ROUTER"])))
+
+    # Classificacoes curtas ganham uma copia apos o p95; erros transitorios sao retentados
+    hedge = use(Hedge())
+    # Metricas por chamada; `attempts` fica por dentro do Retry para contar tentativas reais
+    metrics = Metrics()
+    use(metrics.attempts)
+    retry = use(Retry())
+
+    # Requests deterministicas identicas em voo compartilham uma unica resposta
+    flights = use(SingleFlight())
+
+    # Perguntas parecidas (parafrases) reaproveitam a resposta: CHAT_SEMANTIC_CACHE=.cache/semantic
+    # (ou "memory"). So chamadas com semantic_cache=True (respostas livres, nunca classificacao
+    # ou extracao). Por dentro do cache exato: repeticoes identicas nem geram embedding. Requer NumPy.
+    if os.getenv("CHAT_SEMANTIC_CACHE"):
+        from llm.semantic_cache import HashingEmbedder, OpenAIEmbedder, SemanticCache
+
+        semantic = use(SemanticCache(
+            embedder=HashingEmbedder() if os.getenv("CHAT_EMBEDDINGS") == "hashing" else OpenAIEmbedder(dimensions=256),
+            threshold=float(os.getenv("CHAT_SEMANTIC_THRESHOLD", 0.9)),
+            path=None if os.environ["CHAT_SEMANTIC_CACHE"] == "memory" else os.environ["CHAT_SEMANTIC_CACHE"],
+        ))
+
+    # Respostas deterministicas (temperature=0) sao reaproveitadas entre execucoes
+    cache = use(ResponseCache(path=os.getenv("CHAT_CACHE_PATH", ".cache/completions.sqlite")))
+
+    # Por ultimo: a camada de metricas ve todas as chamadas, inclusive hits de cache
+    use(metrics)
+
+
+def run_demo(demo, *args, **kwargs):
+    """Executa um demo com as chamadas rotuladas pelo nome dele nas metricas."""
+    setup()
+    with metrics.label(demo.__name__):
+        return demo(*args, **kwargs)
 
 # =========================
 # 1. REQUEST BASE
@@ -14,8 +132,8 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 def base_request():
     print("\n=== REQUEST BASE ===")
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    resp = create_completion(
+        model=MODEL,
         messages=[
             {"role": "system", "content": "Você é um engenheiro de software sênior."},
             {"role": "user", "content": "Explique o que é Docker em uma frase."}
@@ -32,35 +150,30 @@ def base_request():
 def classifier():
     print("\n=== CLASSIFICADOR ===")
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": "Você é um classificador determinístico. Responda apenas com: BUGGADO, FEATURE, FINANCEIRO ou OUTRO."
-            },
-            {
-                "role": "user",
-                "content": "O sistema está cobrando imposto errado no boleto."
-            }
-        ],
-        temperature=1,
-        max_tokens=5000,
-        stop=["\n"]
+    # Um token de saida (max_tokens=1) restrito aos prefixos dos labels via
+    # logit_bias; os logprobs viram uma distribuicao de confianca
+    clf = LogprobClassifier(
+        ["BUGGADO", "FEATURE", "FINANCEIRO", "OUTRO"],
+        instructions="Você é um classificador determinístico de tickets de suporte.",
+        model=MODEL,
     )
+    pred = clf.classify("O sistema está cobrando imposto errado no boleto.")
 
-    print("Classificação:", resp.choices[0].message.content)
+    print("Classificação:", pred.label, f"(confianca {pred.confidence:.2f})")
+    print("Distribuicao:", {label: round(p, 3) for label, p in pred.distribution.items()})
+    # "prompt" = sem vocabulario local (python -m llm.tokens bundle), saida sem logit_bias
+    print("Restricao:", clf.stats()["constraint"])
 
 
 # =========================
 # 3. SAÍDA ESTRUTURADA
 # =========================
 
-def structured_output():
+def structured_output(stream: bool = False):
     print("\n=== SAÍDA ESTRUTURADA ===")
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    request = dict(
+        model=MODEL,
         messages=[
             {"role": "system", "content": "Extraia dados do texto."},
             {"role": "user", "content": "João tem 32 anos e mora em Recife e gosta de comer cachorro quente com maionse bebendo coca-cola."}
@@ -85,6 +198,20 @@ def structured_output():
         temperature=1
     )
 
+    if stream:
+        # Cada campo e emitido (e validado) assim que seu valor fecha no stream
+        result = stream_structured(
+            on_field=lambda key, value: print(f"  campo pronto: {key} = {value!r}"),
+            **request
+        )
+        for key, elapsed in result.field_times.items():
+            print(f"  {key}: {elapsed * 1000:.0f}ms apos o envio")
+        if result.errors:
+            print("Erros de schema:", result.errors)
+        print("Objeto estruturado:", result.data)
+        return
+
+    resp = create_completion(**request)
     parsed_data = json.loads(resp.choices[0].message.content)
     print("Objeto estruturado:", parsed_data)
 
@@ -108,21 +235,20 @@ def demo_temperature():
     print("  DEMO: TEMPERATURE")
     print("="*60)
 
-    prompt = "Sugira um nome para uma startup de IA"
-
-    temperatures = [0.0, 0.2, 0.7, 1.2]
+    # 3 amostras por temperature para mostrar variação: UMA request com n=3
+    # por ponto, todos os pontos em paralelo
+    result = Sweep(
+        model=MODEL,
+        prompts={"startup": "Sugira um nome para uma startup de IA"},
+        grid={"temperature": [0.0, 0.2, 0.7, 1.2]},
+        samples=3,
+        params={"max_tokens": 20},
+    ).run()
 
-    for temp in temperatures:
-        print(f"\n--- Temperature: {temp} ---")
-        # Faz 3 chamadas para mostrar variação
-        for i in range(3):
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temp,
-                max_tokens=20
-            )
-            print(f"  [{i+1}] {resp.choices[0].message.content.strip()}")
+    for point in result.points:
+        print(f"\n--- Temperature: {point.params['temperature']} ---")
+        for i, output in enumerate(point.outputs):
+            print(f"  [{i+1}] {output}")
 
 
 def demo_temperature_use_cases():
@@ -133,43 +259,46 @@ def demo_temperature_use_cases():
     print("  TEMPERATURE: CASOS DE USO")
     print("="*60)
 
-    # Caso 1: Código (baixa temperature)
+    code_resp, fiscal_resp, brainstorm_resp = run_concurrently([
+        # Caso 1: Código (baixa temperature)
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Voce e um programador Python expert."},
+                {"role": "user", "content": "Escreva uma funcao para calcular fatorial."}
+            ],
+            temperature=0.0,
+            max_tokens=150
+        ),
+        # Caso 2: Fiscal/Juridico (baixa temperature)
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Voce e um contador fiscal brasileiro."},
+                {"role": "user", "content": "Qual a aliquota do ICMS interestadual para produtos industrializados entre SP e RJ?"}
+            ],
+            temperature=0.2,
+            max_tokens=100
+        ),
+        # Caso 3: Brainstorming (alta temperature)
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "user", "content": "De 3 ideias inovadoras para um app de saude mental."}
+            ],
+            temperature=0.9,
+            max_tokens=200
+        ),
+    ])
+
     print("\n--- CODIGO (temp=0.0) - Deterministico ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Voce e um programador Python expert."},
-            {"role": "user", "content": "Escreva uma funcao para calcular fatorial."}
-        ],
-        temperature=0.0,
-        max_tokens=150
-    )
-    print(resp.choices[0].message.content)
+    print(code_resp.choices[0].message.content)
 
-    # Caso 2: Fiscal/Juridico (baixa temperature)
     print("\n--- FISCAL (temp=0.2) - Consistente ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Voce e um contador fiscal brasileiro."},
-            {"role": "user", "content": "Qual a aliquota do ICMS interestadual para produtos industrializados entre SP e RJ?"}
-        ],
-        temperature=0.2,
-        max_tokens=100
-    )
-    print(resp.choices[0].message.content)
+    print(fiscal_resp.choices[0].message.content)
 
-    # Caso 3: Brainstorming (alta temperature)
     print("\n--- BRAINSTORMING (temp=0.9) - Criativo ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": "De 3 ideias inovadoras para um app de saude mental."}
-        ],
-        temperature=0.9,
-        max_tokens=200
-    )
-    print(resp.choices[0].message.content)
+    print(brainstorm_resp.choices[0].message.content)
 
 
 def demo_top_p():
@@ -186,26 +315,26 @@ def demo_top_p():
     print("  DEMO: TOP_P (Nucleus Sampling)")
     print("="*60)
 
-    prompt = "Complete a frase: O futuro da inteligencia artificial sera"
-
     # Comparacao top_p baixo vs alto (com temperature=1 para ver efeito)
-    configs = [
-        {"top_p": 0.1, "desc": "Muito restritivo - so tokens mais provaveis"},
-        {"top_p": 0.5, "desc": "Moderado"},
-        {"top_p": 0.95, "desc": "Amplo - mais variacao"},
-    ]
+    descriptions = {
+        0.1: "Muito restritivo - so tokens mais provaveis",
+        0.5: "Moderado",
+        0.95: "Amplo - mais variacao",
+    }
 
-    for config in configs:
-        print(f"\n--- top_p={config['top_p']} ({config['desc']}) ---")
-        for i in range(2):
-            resp = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=1.0,  # Alto para ver efeito do top_p
-                top_p=config["top_p"],
-                max_tokens=300
-            )
-            print(f"  [{i+1}] {resp.choices[0].message.content.strip()}")
+    result = Sweep(
+        model=MODEL,
+        prompts={"futuro": "Complete a frase: O futuro da inteligencia artificial sera"},
+        grid={"top_p": list(descriptions)},
+        samples=2,
+        params={"temperature": 1.0, "max_tokens": 300},  # temperature alta para ver efeito do top_p
+    ).run()
+
+    for point in result.points:
+        top_p = point.params["top_p"]
+        print(f"\n--- top_p={top_p} ({descriptions[top_p]}) ---")
+        for i, output in enumerate(point.outputs):
+            print(f"  [{i+1}] {output}")
 
 
 def demo_temperature_vs_top_p():
@@ -216,25 +345,28 @@ def demo_temperature_vs_top_p():
     print("  TEMPERATURE vs TOP_P - Combinacoes")
     print("="*60)
 
-    prompt = "Invente uma palavra nova e defina seu significado."
-
-    configs = [
-        {"temperature": 0.2, "top_p": 1.0, "desc": "RECOMENDADO: temp baixa, top_p padrao"},
-        {"temperature": 1.0, "top_p": 0.9, "desc": "RECOMENDADO: temp alta, top_p limitado"},
-        {"temperature": 1.5, "top_p": 1.0, "desc": "CUIDADO: ambos altos = caotico"},
+    descriptions = [
+        "RECOMENDADO: temp baixa, top_p padrao",
+        "RECOMENDADO: temp alta, top_p limitado",
+        "CUIDADO: ambos altos = caotico",
     ]
 
-    for config in configs:
-        print(f"\n--- {config['desc']} ---")
-        print(f"    temperature={config['temperature']}, top_p={config['top_p']}")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=config["temperature"],
-            top_p=config["top_p"],
-            max_tokens=50
-        )
-        print(f"    Resultado: {resp.choices[0].message.content.strip()}")
+    # Pontos explicitos (nao o produto cartesiano)
+    result = Sweep(
+        model=MODEL,
+        prompts={"palavra": "Invente uma palavra nova e defina seu significado."},
+        grid=[
+            {"temperature": 0.2, "top_p": 1.0},
+            {"temperature": 1.0, "top_p": 0.9},
+            {"temperature": 1.5, "top_p": 1.0},
+        ],
+        params={"max_tokens": 50},
+    ).run()
+
+    for desc, point in zip(descriptions, result.points):
+        print(f"\n--- {desc} ---")
+        print(f"    temperature={point.params['temperature']}, top_p={point.params['top_p']}")
+        print(f"    Resultado: {point.outputs[0]}")
 
 
 def demo_presence_penalty():
@@ -250,20 +382,16 @@ def demo_presence_penalty():
     print("  DEMO: PRESENCE_PENALTY (Penaliza repeticao de ideias)")
     print("="*60)
 
-    prompt = "Liste 10 beneficios de fazer exercicio fisico."
+    result = Sweep(
+        model=MODEL,
+        prompts={"exercicio": "Liste 10 beneficios de fazer exercicio fisico."},
+        grid={"presence_penalty": [0.0, 1.0, 2.0]},
+        params={"temperature": 0.7, "max_tokens": 100},
+    ).run()
 
-    penalties = [0.0, 1.0, 2.0]
-
-    for penalty in penalties:
-        print(f"\n--- presence_penalty={penalty} ---")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            presence_penalty=penalty,
-            max_tokens=100
-        )
-        print(resp.choices[0].message.content)
+    for point in result.points:
+        print(f"\n--- presence_penalty={point.params['presence_penalty']} ---")
+        print(point.outputs[0])
 
 
 def demo_frequency_penalty():
@@ -284,18 +412,16 @@ def demo_frequency_penalty():
     "O sol brilhava intensamente. O sol iluminava as montanhas. O sol..."
     """
 
-    penalties = [0.0, 0.8, 2.0]
+    result = Sweep(
+        model=MODEL,
+        prompts={"sol": prompt},
+        grid={"frequency_penalty": [0.0, 0.8, 2.0]},
+        params={"temperature": 0.5, "max_tokens": 100},
+    ).run()
 
-    for penalty in penalties:
-        print(f"\n--- frequency_penalty={penalty} ---")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5,
-            frequency_penalty=penalty,
-            max_tokens=100
-        )
-        print(resp.choices[0].message.content)
+    for point in result.points:
+        print(f"\n--- frequency_penalty={point.params['frequency_penalty']} ---")
+        print(point.outputs[0])
 
 
 def demo_presence_vs_frequency():
@@ -306,27 +432,24 @@ def demo_presence_vs_frequency():
     print("  PRESENCE vs FREQUENCY PENALTY")
     print("="*60)
 
-    prompt = "Escreva um paragrafo sobre inteligencia artificial repetindo conceitos importantes."
+    configs = {
+        (0.0, 0.0): "Sem penalidades",
+        (1.5, 0.0): "So presence (novos topicos)",
+        (0.0, 1.5): "So frequency (novas palavras)",
+        (0.8, 0.8): "Ambos moderados",
+    }
 
-    configs = [
-        {"presence": 0.0, "frequency": 0.0, "desc": "Sem penalidades"},
-        {"presence": 1.5, "frequency": 0.0, "desc": "So presence (novos topicos)"},
-        {"presence": 0.0, "frequency": 1.5, "desc": "So frequency (novas palavras)"},
-        {"presence": 0.8, "frequency": 0.8, "desc": "Ambos moderados"},
-    ]
+    result = Sweep(
+        model=MODEL,
+        prompts={"ia": "Escreva um paragrafo sobre inteligencia artificial repetindo conceitos importantes."},
+        grid=[{"presence_penalty": p, "frequency_penalty": f} for p, f in configs],
+        params={"temperature": 0.7, "max_tokens": 150},
+    ).run()
 
-    for config in configs:
-        print(f"\n--- {config['desc']} ---")
-        print(f"    presence={config['presence']}, frequency={config['frequency']}")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            presence_penalty=config["presence"],
-            frequency_penalty=config["frequency"],
-            max_tokens=150
-        )
-        print(resp.choices[0].message.content)
+    for desc, point in zip(configs.values(), result.points):
+        print(f"\n--- {desc} ---")
+        print(f"    presence={point.params['presence_penalty']}, frequency={point.params['frequency_penalty']}")
+        print(point.outputs[0])
 
 
 def demo_max_tokens():
@@ -346,21 +469,56 @@ def demo_max_tokens():
 
     limits = [30, 100, 300]
 
-    for limit in limits:
-        print(f"\n--- max_tokens={limit} ---")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+    responses = run_concurrently(
+        dict(
+            model=MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.3,
             max_tokens=limit
         )
+        for limit in limits
+    )
+
+    # Sem o vocabulario local (python -m llm.tokens bundle) a contagem e uma aproximacao
+    counting = "contagem local" if get_encoder(MODEL).exact else "estimativa local aproximada"
+
+    for limit, resp in zip(limits, responses):
+        print(f"\n--- max_tokens={limit} ---")
         content = resp.choices[0].message.content
         finish_reason = resp.choices[0].finish_reason
         print(f"Finish reason: {finish_reason}")
-        print(f"Tokens usados: ~{len(content.split())} palavras")
+        print(f"Tokens usados: {count_tokens(content, MODEL)} ({counting}) / {resp.usage.completion_tokens} (usage)")
         print(f"Resposta: {content}")
 
 
+def demo_streaming():
+    """
+    STREAMING: tokens chegam incrementalmente (stream=True)
+
+    Mede o que o usuario realmente sente:
+    - TTFT (time to first token)
+    - Latencia entre tokens
+    - Tempo total e tokens/segundo
+    """
+    print("\n" + "="*60)
+    print("  DEMO: STREAMING (TTFT e latencia entre tokens)")
+    print("="*60)
+
+    prompt = "Explique o que e machine learning de forma completa."
+
+    for limit in [30, 100, 300]:
+        print(f"\n--- max_tokens={limit} (stream) ---")
+        result = stream_completion(
+            on_token=lambda token: print(token, end="", flush=True),
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=limit
+        )
+        print(f"\nFinish reason: {result.finish_reason}")
+        print(f"Metricas: {result.metrics.summary()}")
+
+
 def demo_stop_sequences():
     """
     STOP: Sequencias que interrompem a geracao
@@ -374,59 +532,84 @@ def demo_stop_sequences():
     print("  DEMO: STOP SEQUENCES")
     print("="*60)
 
-    # Exemplo 1: Parar apos primeira frase
+    sentence_resp, classifier_resp, delimiter_resp = run_concurrently([
+        # Exemplo 1: Parar apos primeira frase
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "user", "content": "Explique recursao em programacao."}
+            ],
+            temperature=0.3,
+            max_tokens=200,
+            stop=["."]  # Para na primeira frase
+        ),
+        # Exemplo 2: Parar em quebra de linha (classificadores)
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Classifique o sentimento: POSITIVO, NEGATIVO ou NEUTRO"},
+                {"role": "user", "content": "Adorei o produto, superou expectativas! Era uma bosta fuck yeah!!!!!!"}
+            ],
+            temperature=0,
+            max_tokens=10,
+            stop=["\n"]
+        ),
+        # Exemplo 4: Stop em delimitador customizado
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Responda no formato: RESPOSTA: <sua resposta> Gabriel FIM"},
+                {"role": "user", "content": "Qual a capital do Brasil?"}
+            ],
+            temperature=0,
+            max_tokens=50,
+            stop=["FIM", "\n\n"]
+        ),
+    ])
+
     print("\n--- Exemplo 1: Parar no ponto final ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": "Explique recursao em programacao."}
-        ],
-        temperature=0.3,
-        max_tokens=200,
-        stop=["."]  # Para na primeira frase
-    )
-    print(f"Resposta: {resp.choices[0].message.content}")
+    print(f"Resposta: {sentence_resp.choices[0].message.content}")
 
-    # Exemplo 2: Parar em quebra de linha (classificadores)
     print("\n--- Exemplo 2: Classificador com stop em newline ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Classifique o sentimento: POSITIVO, NEGATIVO ou NEUTRO"},
-            {"role": "user", "content": "Adorei o produto, superou expectativas! Era uma bosta fuck yeah!!!!!!"}
-        ],
-        temperature=0,
-        max_tokens=10,
-        stop=["\n"]
-    )
-    print(f"Classificacao: {resp.choices[0].message.content}")
-
-    # Exemplo 3: Multiplas stop sequences
-    print("\n--- Exemplo 3: Multiplas stop sequences ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    print(f"Classificacao: {classifier_resp.choices[0].message.content}")
+
+    # Mesmo classificador sem stop: 1 token + logprobs (label + confianca)
+    sentiment = LogprobClassifier(["POSITIVO", "NEGATIVO", "NEUTRO"], instructions="Classifique o sentimento.", model=MODEL)
+    pred = sentiment.classify("Adorei o produto, superou expectativas! Era uma bosta fuck yeah!!!!!!")
+    print(f"Com logprobs: {pred.label} (confianca {pred.confidence:.2f})")
+
+    # Exemplo 3: "pare depois de 3 itens" nao cabe em `stop` (seria o truque
+    # stop=["\n4.", "4."], que falha com "4)" ou "-"). A condicao roda no
+    # cliente sobre o stream e fecha a conexao quando o 4o item comeca.
+    list_result = stream_completion(
+        model=MODEL,
         messages=[
             {"role": "user", "content": "Liste 5 linguagens de programacao populares, uma por linha."}
         ],
         temperature=0.3,
         max_tokens=100,
-        stop=["\n4.", "4."]  # Para antes do 4 item
+        stop_when=[MaxItems(3)],
     )
-    print(f"Resposta (limitada a 3):\n{resp.choices[0].message.content}")
+    print("\n--- Exemplo 3: Parar apos 3 itens (no cliente) ---")
+    print(f"Resposta (limitada a 3):\n{list_result.content}")
+    print(f"Parou por: {list_result.stopped_by} | {list_result.metrics.summary()}")
 
-    # Exemplo 4: Stop em delimitador customizado
     print("\n--- Exemplo 4: Stop em delimitador customizado ---")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
+    print(f"Resposta: {delimiter_resp.choices[0].message.content}")
+
+    # Exemplo 5: o JSON fechou, o resto (explicacoes, ```) nao interessa
+    json_result = stream_completion(
+        model=MODEL,
         messages=[
-            {"role": "system", "content": "Responda no formato: RESPOSTA: <sua resposta> Gabriel FIM"},
-            {"role": "user", "content": "Qual a capital do Brasil?"}
+            {"role": "user", "content": "Gere um JSON com nome e idade de uma pessoa ficticia e explique os campos."}
         ],
         temperature=0,
-        max_tokens=50,
-        stop=["FIM", "\n\n"]
+        max_tokens=200,
+        stop_when=[JsonComplete(), MaxChars(600)],
     )
-    print(f"Resposta: {resp.choices[0].message.content}")
+    print("\n--- Exemplo 5: Parar quando o JSON fecha (no cliente) ---")
+    print(f"Resposta: {json_result.content}")
+    print(f"Parou por: {json_result.stopped_by} | {json_result.metrics.summary()}")
 
 
 def demo_combined_production_configs():
@@ -437,70 +620,122 @@ def demo_combined_production_configs():
     print("  CONFIGS DE PRODUCAO - CENARIOS REAIS")
     print("="*60)
 
-    # Config 1: Chatbot de atendimento
+    # As configs sao independentes: disparamos tudo de uma vez e
+    # imprimimos na ordem original.
+    chatbot_resp, code_resp, copy_resp = run_concurrently([
+        # Config 1: Chatbot de atendimento
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Voce e um atendente de suporte tecnico. Seja direto e util."},
+                {"role": "user", "content": "Meu pedido nao chegou ainda, o que faco?"}
+            ],
+            temperature=0.3,
+            max_tokens=150,
+            presence_penalty=0.3
+        ),
+        # Config 2: Gerador de codigo
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Voce e um programador Python. Retorne apenas codigo, sem explicacoes."},
+                {"role": "user", "content": "Funcao que valida CPF brasileiro."}
+            ],
+            temperature=0,
+            max_tokens=300
+        ),
+        # Config 3: Copywriter criativo
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "user", "content": "Crie 3 headlines criativas para uma campanha de cafe gourmet."}
+            ],
+            temperature=0.9,
+            max_tokens=150,
+            presence_penalty=0.6,
+            frequency_penalty=0.5
+        ),
+    ])
+
     print("\n--- CHATBOT ATENDIMENTO ---")
     print("Config: temp=0.3, max_tokens=150, presence=0.3")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Voce e um atendente de suporte tecnico. Seja direto e util."},
-            {"role": "user", "content": "Meu pedido nao chegou ainda, o que faco?"}
-        ],
-        temperature=0.3,
-        max_tokens=150,
-        presence_penalty=0.3
-    )
-    print(resp.choices[0].message.content)
+    print(chatbot_resp.choices[0].message.content)
 
-    # Config 2: Gerador de codigo
     print("\n--- GERADOR DE CODIGO ---")
     print("Config: temp=0, max_tokens=300")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Voce e um programador Python. Retorne apenas codigo, sem explicacoes."},
-            {"role": "user", "content": "Funcao que valida CPF brasileiro."}
-        ],
-        temperature=0,
-        max_tokens=300
-    )
-    print(resp.choices[0].message.content)
+    print(code_resp.choices[0].message.content)
 
-    # Config 3: Copywriter criativo
     print("\n--- COPYWRITER CRIATIVO ---")
     print("Config: temp=0.9, presence=0.6, frequency=0.5")
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": "Crie 3 headlines criativas para uma campanha de cafe gourmet."}
-        ],
-        temperature=0.9,
-        max_tokens=150,
-        presence_penalty=0.6,
-        frequency_penalty=0.5
-    )
-    print(resp.choices[0].message.content)
+    print(copy_resp.choices[0].message.content)
 
     # Config 4: Classificador deterministico
+    # Todos os textos vao numa unica request (json_schema com um label por
+    # indice); se a saida nao validar, cai para uma request por texto.
     print("\n--- CLASSIFICADOR ---")
-    print("Config: temp=0, max_tokens=5, stop=['\\n']")
+    print("Config: temp=0, json_schema, N textos por request")
     texts = [
         "O sistema travou e perdi meu trabalho",
         "Gostaria de poder exportar em PDF",
         "Voces sao os melhores, parabens!"
     ]
-    for text in texts:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+    clf = PackedClassifier(
+        ["BUG", "FEATURE", "ELOGIO", "OUTRO"],
+        instructions="Classifique cada ticket de suporte.",
+        model=MODEL,
+    )
+    for text, label in zip(texts, clf.classify(texts)):
+        print(f"  '{text[:40]}...' -> {label}")
+    print(f"  ({clf.requests} request(s) para {len(texts)} textos, {clf.fallback_requests} fallback)")
+
+
+def demo_semantic_cache():
+    """
+    Cache semantico: parafrases da mesma pergunta de suporte reaproveitam a resposta
+    """
+    print("\n" + "="*60)
+    print("  CACHE SEMANTICO")
+    print("="*60)
+
+    if semantic is None:
+        print("\nDesativado: defina CHAT_SEMANTIC_CACHE (ex: .cache/semantic ou memory; requer NumPy)")
+        return
+
+    # Mesma config do CHATBOT ATENDIMENTO; so a pergunta muda
+    questions = [
+        "Meu pedido nao chegou ainda, o que faco?",
+        "Meu pedido ainda não chegou. O que eu faço?",
+        "o que faco se meu pedido nao chegou ainda",
+        "Como cancelo minha assinatura?",
+        "Quero cancelar minha assinatura, como faço?",
+    ]
+    for question in questions:
+        hits = semantic.hits
+        start = time.perf_counter()
+        resp = create_completion(
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "Classifique: BUG, FEATURE, ELOGIO ou OUTRO. Responda so a categoria."},
-                {"role": "user", "content": text}
+                {"role": "system", "content": "Voce e um atendente de suporte prestativo e conciso."},
+                {"role": "user", "content": question},
             ],
-            temperature=0,
-            max_tokens=5,
-            stop=["\n"]
+            temperature=0.3,
+            max_tokens=150,
+            presence_penalty=0.3,
+            # Opt-in: resposta livre de atendimento (classificacao/extracao nao usam)
+            semantic_cache=True,
         )
-        print(f"  '{text[:40]}...' -> {resp.choices[0].message.content}")
+        source = "cache" if semantic.hits > hits else "modelo"
+        print(f"\n'{question}' -> {source} ({time.perf_counter() - start:.2f}s)")
+        print(f"  {resp.choices[0].message.content[:80]}")
+    print(f"\nAcumulado: {semantic.stats()}")
+
+
+# Documento fixo que vai no prefixo do prompt (grande o bastante para o cache do provedor)
+SUPPORT_MANUAL = "MANUAL DE ATENDIMENTO\n" + "\n".join(
+    f"{i}. Para casos do tipo {i}, confirme o numero do pedido, verifique o status no sistema "
+    f"e responda em ate tres frases, sem prometer prazos que nao estejam no sistema."
+    for i in range(1, 41)
+)
 
 
 def demo_cost_optimization():
@@ -521,26 +756,230 @@ def demo_cost_optimization():
 
     print("\nMesmo prompt, diferentes limites:\n")
 
-    for config in configs:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+    calls = [
+        dict(
+            model=MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.3,
             max_tokens=config["max_tokens"]
         )
+        for config in configs
+    ]
+    responses = run_concurrently(calls)
+
+    # Precos por 1M tokens (input, input cacheado, output) vem da tabela de llm/cost.py;
+    # modelo fora da tabela (--model gpt-5, fine-tune...) mostra so os tokens
+    price = find_price(MODEL)
+    if price is None:
+        print(f"(sem preco na tabela para {MODEL}: custos omitidos)\n")
+
+    for config, call, resp in zip(configs, calls, responses):
+        # Antes de enviar ja sabemos o prompt (contagem local) e o pior caso de saida
+        estimated_input = count_request_tokens(call)
 
-        # Simula calculo de custo (valores aproximados gpt-4o-mini)
         output_tokens = resp.usage.completion_tokens
         input_tokens = resp.usage.prompt_tokens
-        # gpt-4o-mini: $0.15/1M input, $0.60/1M output
-        cost = (input_tokens * 0.00000015) + (output_tokens * 0.0000006)
 
         print(f"{config['desc']}")
+        if price is not None:
+            max_cost = costs.estimate(call)
+            print(f"  Pre-envio: ~{estimated_input} tokens in, ate {call['max_tokens']} out (custo maximo ${max_cost:.6f})")
+        else:
+            print(f"  Pre-envio: ~{estimated_input} tokens in, ate {call['max_tokens']} out")
         print(f"  Tokens: {input_tokens} in + {output_tokens} out")
-        print(f"  Custo estimado: ${cost:.6f}")
+        if price is not None:
+            print(f"  Custo estimado: ${price.usage_cost(resp.usage):.6f}")
         print(f"  Resposta: {resp.choices[0].message.content[:80]}...")
         print()
 
+    # Cache de prefixo: system prompt + manual fixos no inicio, pergunta no fim.
+    # A partir de ~1024 tokens o provedor reaproveita o prefixo identico.
+    print("Cache de prefixo do prompt:\n")
+    layout = PrefixLayout(
+        system="Voce e um atendente de suporte. Siga estritamente o manual abaixo.",
+        context=[SUPPORT_MANUAL],
+        model=MODEL,
+    )
+    print(f"  Prefixo estatico: ~{layout.prefix_tokens} tokens (cacheavel: {layout.cacheable})")
+
+    questions = [
+        "Meu pedido nao chegou ainda, o que faco?",
+        "Posso trocar um produto usado?",
+        "Como cancelo minha assinatura?",
+    ]
+    # Em sequencia: a primeira request popula o cache, as seguintes reaproveitam
+    for question in questions:
+        resp = create_completion(**layout.request(question, temperature=0.3, max_tokens=60))
+        input_tokens = resp.usage.prompt_tokens
+        cached = cached_tokens(resp.usage)
+        print(f"  '{question}'")
+        if price is None:
+            print(f"    cached={cached}/{input_tokens} tokens")
+            continue
+        uncached_cost = price.cost(input_tokens)
+        cost = price.cost(input_tokens, cached=cached)
+        print(f"    cached={cached}/{input_tokens} tokens | prompt ${cost:.6f} (sem cache ${uncached_cost:.6f})")
+    print(f"  Acumulado: {prompt_cache.stats()}")
+    print(f"\nGasto acumulado: ${costs.spent:.6f} por label: {costs.stats()['by_label']}")
+
+def demo_batch_classification():
+    """
+    Classificacao em massa pela Batch API (metade do preco, resultado em ate 24h)
+    """
+    print("\n" + "="*60)
+    print("  BATCH API: CLASSIFICACAO OFFLINE")
+    print("="*60)
+
+    tickets = [
+        "O sistema está cobrando imposto errado no boleto.",
+        "Seria ótimo exportar os relatórios em PDF.",
+        "O app fecha sozinho quando abro o carrinho.",
+        "Quero o reembolso da minha última fatura.",
+        "Vocês abrem no feriado?",
+        "A busca retorna produtos que não existem mais.",
+    ]
+    instructions = "Classifique o ticket em BUGGADO, FEATURE, FINANCEIRO ou OUTRO. Responda so o label."
+
+    # O diretorio guarda o estado: rodar de novo retoma (ou so relê) o mesmo batch
+    pipeline = BatchPipeline(
+        os.getenv("CHAT_BATCH_DIR", ".batch/demo_batch_classification"),
+        poll_interval=float(os.getenv("CHAT_BATCH_POLL", 30)),
+        defaults={"model": MODEL, "temperature": 0, "max_tokens": 5},
+    )
+    path = pipeline.run(
+        (
+            {
+                "custom_id": f"ticket-{i}",
+                "messages": [
+                    {"role": "system", "content": instructions},
+                    {"role": "user", "content": text},
+                ],
+            }
+            for i, text in enumerate(tickets)
+        ),
+        on_poll=lambda batch: print(f"  {batch.status}", batch.request_counts or ""),
+    )
+
+    print(f"\nResultados ({path}):\n")
+    for row in read_jsonl(path):
+        ticket = row["input"]["messages"][-1]["content"] if row["input"] else "?"
+        print(f"  {row['custom_id']}: {row['output'] or row['error']!s:<12} | {ticket}")
+    print(f"\nCusto com desconto de batch: ${results_cost(path):.6f}")
+
+def demo_model_router():
+    """
+    Roteamento por classe de chamada entre modelos/endpoints, com failover
+    """
+    print("\n" + "="*60)
+    print("  ROTEADOR DE MODELOS")
+    print("="*60)
+
+    if router is None:
+        print("\nDesativado: defina CHAT_ROUTER com o pool de backends, ex:")
+        print('  [{"name": "mini", "model": "gpt-4o-mini"},')
+        print('   {"name": "nano", "model": "gpt-4.1-nano", "classes": ["classification"]}]')
+        return
+
+    tickets = [
+        "O sistema está cobrando imposto errado no boleto.",
+        "Seria ótimo exportar os relatórios em PDF.",
+        "O app fecha sozinho quando abro o carrinho.",
+        "Quero o reembolso da minha última fatura.",
+    ]
+    # Classificacoes curtas e geracoes longas na mesma rodada: cada classe
+    # tem sua propria latencia por backend
+    calls = [
+        dict(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": "Classifique: BUGGADO, FEATURE, FINANCEIRO ou OUTRO."},
+                {"role": "user", "content": ticket},
+            ],
+            temperature=0,
+            max_tokens=5,
+        )
+        for ticket in tickets
+    ] + [
+        dict(
+            model=MODEL,
+            messages=[{"role": "user", "content": f"Escreva uma resposta cordial para o cliente: {ticket}"}],
+            temperature=0.7,
+            max_tokens=150,
+        )
+        for ticket in tickets
+    ]
+    for round_number in range(3):
+        responses = run_concurrently(calls, return_exceptions=True)
+        errors = sum(isinstance(resp, Exception) for resp in responses)
+        models = sorted({resp.model for resp in responses if not isinstance(resp, Exception)})
+        print(f"\nRodada {round_number + 1}: {len(responses) - errors} ok, {errors} erro(s), modelos {models}")
+
+    stats = router.stats()
+    print(f"\nFailovers: {stats['failovers']} | exploracao: {stats['explored']} | sem backend: {stats['unavailable']}")
+    for name, backend in stats["backends"].items():
+        print(f"  {name} ({backend['model']}): {backend['state']}, {backend['calls']} chamadas, "
+              f"erro {backend['error_rate']:.0%}, latencia {backend['latency']}")
+
+
+def demo_preclassifier():
+    """
+    Pre-classificador local: tickets obvios nao chegam a API, o resto e escalado ao LLM
+    """
+    print("\n" + "="*60)
+    print("  PRE-CLASSIFICADOR LOCAL")
+    print("="*60)
+
+    labels = ["BUGGADO", "FEATURE", "FINANCEIRO", "OUTRO"]
+    # Cada match soma 1 ponto ao label: com scale=4 um match sozinho da ~0.95;
+    # matches de labels diferentes empatam e vao para o LLM
+    rules = RuleClassifier([
+        Rule("BUGGADO", r"\b(?:trav\w*|erro\w*|bug\w*|quebr\w*|fecha sozinho|nao funciona|nao abre)"),
+        Rule("FINANCEIRO", r"\b(?:cobr\w*|boleto|fatura|reembolso|pagamento|estorno|imposto)"),
+        Rule("FEATURE", r"\b(?:seria (?:otimo|bom|legal)|gostaria de poder|poderiam adicionar|sugestao)"),
+    ], labels=labels, scale=4.0)
+    # Modelo de n-gramas (NumPy): aprende com os labels do LLM e so opina
+    # depois de `min_examples` exemplos
+    model = NgramModel(labels, min_examples=50) if importlib.util.find_spec("numpy") else None
+    cascade = CascadeClassifier(
+        rules,
+        fallback=LogprobClassifier(
+            labels,
+            instructions="Você é um classificador determinístico de tickets de suporte.",
+            model=MODEL,
+        ),
+        model=model,
+        threshold=0.9,
+        audit_rate=float(os.getenv("CHAT_PRECLASSIFIER_AUDIT", 0.2)),
+        learn=True,
+        log_path=os.getenv("CHAT_PRECLASSIFIER_LOG"),
+        seed=0,
+    )
+
+    tickets = [
+        "O sistema está cobrando imposto errado no boleto.",
+        "O app fecha sozinho quando abro o carrinho.",
+        "Seria ótimo exportar os relatórios em PDF.",
+        "Quero o reembolso da minha última fatura.",
+        "Vocês abrem no feriado?",
+        "A busca retorna produtos que não existem mais.",
+        "Deu erro no pagamento e fui cobrado duas vezes.",
+        "O login não funciona desde ontem.",
+    ]
+    start = time.perf_counter()
+    predictions = cascade.classify_many(tickets)
+    elapsed = time.perf_counter() - start
+
+    for ticket, pred in zip(tickets, predictions):
+        print(f"  {pred.label:<10} ({pred.confidence:.2f}) | {ticket}")
+    stats = cascade.stats()
+    print(f"\n{stats['items']} tickets em {elapsed:.2f}s | decisoes {stats['decisions']} | "
+          f"locais {stats['local_rate']:.0%} ({stats['local_ms_per_item']}ms/ticket)")
+    print(f"Concordancia com o LLM: {stats['agreement']} em {stats['comparisons']} comparacoes "
+          f"({stats['audited']} auditadas) | por confianca: {stats['agreement_by_confidence']}")
+    if model is not None:
+        print(f"Modelo de n-gramas: {int(model.documents.sum())} exemplos aprendidos do LLM")
+
+
 # =========================
 # TOOL: Weather API (mock real)
 # ========================
@@ -564,76 +1003,94 @@ def get_weather(city: str):
     }
 
 
+weather_tools = ToolRegistry()
+weather_tools.register(
+    get_weather,
+    description="Obtém o clima atual de uma cidade",
+    parameters={
+        "type": "object",
+        "properties": {
+            "city": {"type": "string"}
+        },
+        "required": ["city"]
+    }
+)
+
+
 # =========================
 # 4. TOOL CALLING — WEATHER AGENT
 # =========================
 
-def weather_agent(user_message: str):
+def weather_agent(
+    user_message: str = "Como esta o clima em NY hoje considerando que possivelmente é igual de curitiba?",
+    stream: bool = False,
+    max_steps: int = 5,
+    memory: ConversationMemory = None,
+):
+    """
+    Um turno da conversa. Passe o `memory` retornado para continuar a mesma
+    conversa: o historico fica nela e cada chamada envia so a janela que cabe
+    no orcamento (turnos antigos viram resumo).
+    """
     print("\n=== WEATHER AGENT ===")
 
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "get_weather",
-                "description": "Obtém o clima atual de uma cidade",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "city": {"type": "string"}
-                    },
-                    "required": ["city"]
-                }
-            }
-        }
-    ]
-
-    messages = [
-        {
+    if memory is None:
+        memory = ConversationMemory(budget=3000, max_tool_tokens=300, summarize=True)
+        memory.append({
             "role": "system",
             "content": "Você é um assistente que informa o clima usando ferramentas quando necessário."
-        },
-        {
-            "role": "user",
-            "content": user_message
-        }
-    ]
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",
+        })
+    memory.append({"role": "user", "content": user_message})
+
+    # Loop de agente: todas as tool calls de um turno rodam em paralelo e
+    # cada turno faz UMA chamada de follow-up (com stream=True os tool_calls
+    # chegam fatiados em deltas e sao remontados)
+    if stream:
+        print("Resposta: ", end="")
+    result = run_agent(
+        memory,
+        weather_tools,
+        model=MODEL,
+        max_steps=max_steps,
+        stream=stream,
+        on_token=lambda token: print(token, end="", flush=True),
         temperature=0
     )
+    if stream:
+        print()
 
-    msg = response.choices[0].message
-
-    # Se o modelo decidiu chamar uma ferramenta
-    if msg.tool_calls:
-        for tool_call in msg.tool_calls:
-            if tool_call.function.name == "get_weather":
-                args = json.loads(tool_call.function.arguments)
-                result = get_weather(args["city"])
-
-                messages.append(msg)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "name": "get_weather",
-                    "content": json.dumps(result)
-                })
-
-                # Segunda chamada com o resultado da tool
-                final_response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    temperature=0
-                )
-
-                print("Resposta final:", final_response.choices[0].message.content)
-    else:
-        print("Resposta direta:", msg.content)
+    for execution in result.executions:
+        print(f"[tool] {execution.name}({execution.arguments}) -> {execution.content()} ({execution.elapsed * 1000:.1f}ms)")
+
+    if not stream:
+        label = "Resposta final:" if result.executions else "Resposta direta:"
+        print(label, result.content)
+    print(f"({result.steps} chamada(s), finish_reason={result.finish_reason})")
+    print(f"Memoria: {memory.stats()}")
+    return memory
+
+
+def report():
+    """Estatisticas das camadas do pipeline ao fim da execucao."""
+    setup()
+    print("\nCache:", cache.stats())
+    print("Cache de prefixo:", prompt_cache.stats())
+    print("Hedge:", hedge.stats())
+    print("Retry:", retry.stats())
+    print("Single-flight:", flights.stats())
+    if limiter is not None:
+        print("Rate limit:", limiter.stats())
+    if cassette is not None:
+        print("Cassete:", cassette.stats())
+    if semantic is not None:
+        print("Cache semantico:", semantic.stats())
+    if router is not None:
+        print("Roteador:", router.stats())
+    print("Metricas:", metrics.stats())
+    print("Custo:", costs.stats())
+    # Exporta para o Prometheus (textfile collector) ou JSON: CHAT_METRICS_PATH=metrics.prom
+    if os.getenv("CHAT_METRICS_PATH"):
+        metrics.save(os.getenv("CHAT_METRICS_PATH"))
 
 
 # =========================
@@ -641,42 +1098,14 @@ def weather_agent(user_message: str):
 # =========================
 
 if __name__ == "__main__":
-    print("="*60)
-    print("  ANATOMIA DO CHAT COMPLETIONS - PARAMETROS DE GERACAO")
-    print("="*60)
-
-    # Demos basicas originais
-    base_request()
-    # classifier()
-    # structured_output()
-
-    # === NOVOS DEMOS DE PARAMETROS ===
-
-    # 1. Temperature
-    # demo_temperature()
-    # demo_temperature_use_cases()
-
-    # 2. Top_p
-    # demo_top_p()
-    # demo_temperature_vs_top_p()
-
-    # 3. Presence Penalty
-    # demo_presence_penalty()
-
-    # 4. Frequency Penalty
-    # demo_frequency_penalty()
-    # demo_presence_vs_frequency()
-
-    # 5. Max Tokens
-    # demo_max_tokens()
+    # Demos sao escolhidos na linha de comando (python -m cli list / run ...);
+    # sem argumentos roda o request base, como antes
+    import sys
 
-    # 6. Stop Sequences
-    # demo_stop_sequences()
+    from dotenv import load_dotenv
 
-    # 7. Configs de Producao
-    # demo_combined_production_configs()
+    from cli import main as cli_main
 
-    # 8. Otimizacao de Custos
-    # demo_cost_optimization()
+    load_dotenv()
 
-    # weather_agent("Como esta o clima em NY hoje considerando que possivelmente é igual de curitiba?")
+    cli_main(sys.argv[1:] or ["run", "base_request"], module=sys.modules[__name__])
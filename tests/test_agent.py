@@ -0,0 +1,73 @@
+"""Loop de agente chamado de dentro de um event loop."""
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from llm.agent import ToolRegistry, arun_agent, run_agent
+from llm.memory import ConversationMemory
+
+
+class Message(SimpleNamespace):
+    def model_dump(self, exclude_none=False):
+        return {key: value for key, value in vars(self).items() if value is not None or not exclude_none}
+
+
+def scripted(**kwargs):
+    # Primeiro turno pede a tool; depois responde com o resultado dela
+    if kwargs["messages"][-1]["role"] == "tool":
+        message = Message(role="assistant", content=f"Clima: {kwargs['messages'][-1]['content']}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+    call = {"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": '{"city": "Recife"}'}}
+    message = Message(role="assistant", content=None, tool_calls=[call])
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="tool_calls")])
+
+
+def registry():
+    tools = ToolRegistry()
+
+    @tools.tool()
+    async def get_weather(city: str):
+        await asyncio.sleep(0)
+        return f"{city}: 30C"
+
+    return tools
+
+
+def test_run_agent_inside_a_running_loop():
+    async def scenario():
+        return run_agent([{"role": "user", "content": "Clima?"}], registry(), create=scripted)
+
+    result = asyncio.run(scenario())
+    assert result.content == "Clima: Recife: 30C"
+    assert result.steps == 2
+
+
+def test_arun_agent():
+    async def acreate(**kwargs):
+        return scripted(**kwargs)
+
+    result = asyncio.run(arun_agent([{"role": "user", "content": "Clima?"}], registry(), acreate=acreate))
+    assert result.content == "Clima: Recife: 30C"
+    assert [execution.name for execution in result.executions] == ["get_weather"]
+
+
+def test_arun_agent_builds_the_memory_window_off_the_loop():
+    threads = []
+
+    class Memory(ConversationMemory):
+        def window(self):
+            threads.append(threading.get_ident())
+            return super().window()
+
+    async def acreate(**kwargs):
+        return scripted(**kwargs)
+
+    async def scenario():
+        memory = Memory()
+        memory.append({"role": "user", "content": "Clima?"})
+        result = await arun_agent(memory, registry(), acreate=acreate)
+        return result, threading.get_ident()
+
+    result, loop_thread = asyncio.run(scenario())
+    assert result.content == "Clima: Recife: 30C"
+    assert threads and loop_thread not in threads
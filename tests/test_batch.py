@@ -0,0 +1,33 @@
+"""BatchPipeline: join com custom_id desconhecido e reexecucao com outros itens."""
+import json
+
+import pytest
+
+from llm.batch import BatchPipeline, read_jsonl
+
+
+def items(texts):
+    return ({"custom_id": f"t{i}", "prompt": text} for i, text in enumerate(texts))
+
+
+def test_rerun_with_different_items_raises(tmp_path):
+    BatchPipeline(str(tmp_path)).prepare(items(["a", "b"]))
+    pipeline = BatchPipeline(str(tmp_path))
+    assert pipeline.prepare(items(["a", "b"])) == 2
+    assert pipeline.prepare(()) == 2
+    with pytest.raises(ValueError):
+        pipeline.prepare(items(["a", "c"]))
+
+
+def test_join_writes_unknown_custom_id_as_error(tmp_path):
+    pipeline = BatchPipeline(str(tmp_path))
+    pipeline.prepare(items(["a"]))
+    body = {"choices": [{"message": {"content": "OK"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1}}
+    with open(tmp_path / "output.jsonl", "w", encoding="utf-8") as f:
+        for custom_id in ("t0", "intruso"):
+            f.write(json.dumps({"custom_id": custom_id, "response": {"status_code": 200, "body": body}}) + "\n")
+
+    rows = {row["custom_id"]: row for row in read_jsonl(pipeline.join())}
+    assert rows["t0"]["output"] == "OK"
+    assert rows["intruso"]["input"] is None
+    assert "desconhecido" in rows["intruso"]["error"]
@@ -0,0 +1,29 @@
+"""ResponseCache no caminho async, com o nivel em disco."""
+import asyncio
+
+from llm.cache import ResponseCache
+
+
+def test_async_disk_roundtrip(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    calls = []
+
+    async def acreate(**kwargs):
+        from openai.types.chat import ChatCompletion
+
+        calls.append(kwargs)
+        return ChatCompletion.model_validate({
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": kwargs["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+        })
+
+    call = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "oi"}], temperature=0)
+    first = asyncio.run(ResponseCache(path=path).wrap_async(acreate)(**call))
+
+    # Outro processo (cache novo): o hit vem do SQLite, sem chamar a API
+    cache = ResponseCache(path=path)
+    again = asyncio.run(cache.wrap_async(acreate)(**call))
+    assert again.choices[0].message.content == first.choices[0].message.content
+    assert len(calls) == 1
+    assert cache.stats()["disk_hits"] == 1
@@ -0,0 +1,77 @@
+"""LogprobClassifier sem o vocabulario local e fallback do PackedClassifier."""
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from llm import classifier
+from llm.classifier import LogprobClassifier, PackedClassifier
+from llm.tokens import get_encoder
+
+without_vocabulary = pytest.mark.skipif(get_encoder("gpt-4o-mini").exact, reason="vocabulario local presente")
+
+LABELS = ["POSITIVO", "NEGATIVO", "NEUTRO"]
+
+
+@without_vocabulary
+def test_missing_vocabulary_warns_once_and_reports_prompt_only(monkeypatch, recwarn):
+    monkeypatch.setattr(classifier, "_warned_prompt_only", set())
+    with pytest.warns(UserWarning, match="sem logit_bias"):
+        clf = LogprobClassifier(LABELS)
+    LogprobClassifier(LABELS)
+    assert not [w for w in recwarn if "sem logit_bias" in str(w.message)]
+    assert "logit_bias" not in clf.request("Adorei")
+    assert clf.stats()["constraint"] == "prompt"
+
+
+def test_label_tokens_keep_logit_bias():
+    clf = LogprobClassifier(LABELS, label_tokens={"POSITIVO": 11, "NEGATIVO": 12, "NEUTRO": 13})
+    assert clf.request("Adorei")["logit_bias"] == {"11": 100, "12": 100, "13": 100}
+    assert clf.stats()["constraint"] == "logit_bias"
+
+
+def _position(token, logprob, alternatives):
+    top = [SimpleNamespace(token=t, logprob=lp) for t, lp in alternatives.items()]
+    return SimpleNamespace(token=token, logprob=logprob, top_logprobs=top)
+
+
+def _logprob_reply(*positions):
+    content = "".join(position.token for position in positions)
+    choice = SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop",
+                             logprobs=SimpleNamespace(content=list(positions)))
+    return SimpleNamespace(choices=[choice], usage=None)
+
+
+def test_shared_first_token_is_resolved_by_the_continuation():
+    # NEGATIVO = NE+G+ATIVO e NEUTRO = NE+UTRO: dois tokens ate divergirem
+    clf = LogprobClassifier(LABELS, label_tokens={"POSITIVO": [11], "NEGATIVO": [20, 21, 22], "NEUTRO": [20, 23]})
+    request = clf.request("Pessimo")
+    assert request["max_tokens"] == 2
+    assert request["logit_bias"] == {"11": 100, "20": 100, "21": 100, "23": 100}
+
+    response = _logprob_reply(
+        _position("NE", math.log(0.8), {"NE": math.log(0.8), "POS": math.log(0.2)}),
+        _position("G", math.log(0.75), {"G": math.log(0.75), "UTRO": math.log(0.25)}),
+    )
+    pred = clf.predict(response)
+    assert pred.label == "NEGATIVO"
+    assert pred.distribution == pytest.approx({"POSITIVO": 0.2, "NEGATIVO": 0.6, "NEUTRO": 0.2})
+
+
+def test_labels_that_never_diverge_are_rejected():
+    with pytest.raises(ValueError, match="lista completa de ids"):
+        LogprobClassifier(LABELS, label_tokens={"POSITIVO": 11, "NEGATIVO": 20, "NEUTRO": 20})
+
+
+def _reply(content):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+def test_packed_fallback_only_returns_known_labels():
+    replies = iter(["financeiro.", "Nao sei", "FEAT"])
+    clf = PackedClassifier(["BUG", "FEATURE", "FINANCEIRO", "OUTRO"], create=lambda **kwargs: _reply(next(replies)))
+    # Um texto por lote: todos vao para o fallback
+    clf.max_batch_size = 1
+    assert clf.classify(["Boleto errado", "???", "Exportar PDF"]) == ["FINANCEIRO", None, "FEATURE"]
+    assert clf.fallback_requests == 3
@@ -0,0 +1,105 @@
+"""SingleFlight: requests identicas em voo compartilham a resposta (sync, async e stream)."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm.coalesce import SingleFlight
+
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Oi"}], "temperature": 0}
+
+
+def test_sync_followers_share_the_leader_response():
+    calls, release = [], threading.Event()
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        release.wait(timeout=5)
+        return object()
+
+    flights = SingleFlight()
+    coalesced = flights.wrap(create)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(coalesced, **REQUEST) for _ in range(4)]
+        while flights.leaders + flights.coalesced < 4:
+            time.sleep(0.01)
+        release.set()
+        responses = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(response is responses[0] for response in responses)
+    assert flights.stats()["coalesced"] == 3 and flights.stats()["in_flight"] == 0
+
+
+def test_sampled_requests_are_not_coalesced():
+    calls = []
+    coalesced = SingleFlight().wrap(lambda **kwargs: calls.append(kwargs))
+    coalesced(**{**REQUEST, "temperature": 0.7})
+    coalesced(**{**REQUEST, "temperature": 0.7})
+    assert len(calls) == 2
+
+
+def test_async_fan_out_survives_a_cancelled_waiter():
+    calls = []
+
+    async def acreate(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0.05)
+        return "resposta"
+
+    async def scenario():
+        coalesced = SingleFlight().wrap_async(acreate)
+        tasks = [asyncio.create_task(coalesced(**REQUEST)) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks[0].cancel()          # ex: o perdedor de um hedge
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ["resposta", "resposta"]
+
+
+class Upstream:
+    def __init__(self, chunks):
+        self.chunks, self.closed, self.reads = chunks, False, 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.reads += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_is_shared_and_closed_by_the_last_consumer():
+    upstream = Upstream(["a", "b", "c"])
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return upstream
+
+    flights = SingleFlight()
+    coalesced = flights.wrap(create)
+    first = coalesced(**REQUEST, stream=True)
+    assert next(first) == "a"
+    # Quem entra atrasado recebe os chunks ja emitidos e segue junto
+    second = coalesced(**REQUEST, stream=True)
+    assert list(second) == ["a", "b", "c"]
+    assert list(first) == ["b", "c"]
+    assert len(calls) == 1 and upstream.reads == 3
+    assert flights.stats()["shared_streams"] == 1
+
+
+def test_abandoned_stream_closes_upstream():
+    upstream = Upstream(["a", "b", "c"])
+    coalesced = SingleFlight().wrap(lambda **kwargs: upstream)
+    first = coalesced(**REQUEST, stream=True)
+    second = coalesced(**REQUEST, stream=True)
+    next(first)
+    first.close()
+    assert not upstream.closed
+    second.close()
+    assert upstream.closed
@@ -0,0 +1,31 @@
+"""CostTracker com modelos fora da tabela de precos."""
+from types import SimpleNamespace
+
+from llm.cost import CostTracker
+
+
+def chunks(model):
+    delta = SimpleNamespace(content="oi")
+    yield SimpleNamespace(model=model, choices=[SimpleNamespace(delta=delta)], usage=None)
+    yield SimpleNamespace(model=model, choices=[], usage=SimpleNamespace(prompt_tokens=9, completion_tokens=1))
+
+
+def test_stream_on_unpriced_model():
+    costs = CostTracker()
+    create = costs.wrap(lambda **kwargs: chunks(kwargs["model"]))
+
+    stream = create(model="llama-local", messages=[{"role": "user", "content": "oi"}], stream=True)
+    assert len(list(stream)) == 2
+
+    stats = costs.stats()
+    assert stats["spent"] == 0.0
+    assert stats["unpriced"] == {"llama-local": {"calls": 1, "prompt_tokens": 9, "completion_tokens": 1}}
+
+
+def test_stream_closed_early_on_unpriced_model():
+    costs = CostTracker()
+    stream = costs.wrap(lambda **kwargs: chunks(kwargs["model"]))(
+        model="llama-local", messages=[{"role": "user", "content": "oi"}], stream=True)
+    next(stream)
+    stream.close()
+    assert costs.stats()["unpriced"]["llama-local"]["calls"] == 1
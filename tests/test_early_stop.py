@@ -0,0 +1,53 @@
+"""Condicoes de parada avaliadas chunk a chunk, como em stream_completion."""
+import pytest
+
+from llm.early_stop import LOOKBACK, JsonComplete, MaxChars, MaxItems, first_stop
+
+LIST = "Aqui estao:\n1. Alfa\n2) Beta\n- Gama\n* Delta\n5. Epsilon\n"
+
+
+def stream(condition, text, size):
+    """Alimenta `text` em chunks de `size`; devolve o corte (ou None)."""
+    condition.reset()
+    received = ""
+    for start in range(0, len(text), size):
+        received += text[start:start + size]
+        cut = condition.check(received, len(received) - len(text[start:start + size]))
+        if cut is not None:
+            return received[:cut]
+    return None
+
+
+@pytest.mark.parametrize("size", [1, 3, 10, 1000])
+def test_max_items_cuts_before_the_next_item_for_any_chunking(size):
+    assert stream(MaxItems(3), LIST, size) == "Aqui estao:\n1. Alfa\n2) Beta\n- Gama"
+
+
+def test_max_items_lookback_does_not_recount_markers():
+    # Chunks pequenos revarrem os ultimos LOOKBACK caracteres muitas vezes
+    text = "".join(f"{i}. item\n" for i in range(1, 4)) + "x" * (LOOKBACK * 2)
+    assert stream(MaxItems(3), text, 2) is None
+    assert stream(MaxItems(2), text, 2) == "1. item\n2. item"
+
+
+def test_max_items_ignores_markers_mid_line():
+    assert stream(MaxItems(1), "1. custa 2. mil - ou 3) mais\n", 4) is None
+
+
+JSON_TEXT = 'Claro! {"a": "chave } e ] dentro", "b": "aspas \\" {", "c": [1, {"d": 2}]} depois'
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 1000])
+def test_json_complete_stops_when_the_first_object_closes(size):
+    cut = stream(JsonComplete(), JSON_TEXT, size)
+    assert cut == JSON_TEXT[:JSON_TEXT.index(" depois")]
+
+
+def test_json_complete_waits_for_incomplete_json():
+    assert stream(JsonComplete(), '[{"a": 1}, {"b": "]"', 3) is None
+
+
+def test_first_stop_picks_the_earliest_cut():
+    conditions = [MaxChars(15), MaxItems(1)]
+    assert first_stop(conditions, LIST, 0) == (15, "15 caracteres")
+    assert first_stop([MaxChars(100), MaxItems(1)], LIST, 0) == (len("Aqui estao:\n1. Alfa"), "1 itens")
@@ -0,0 +1,59 @@
+"""IncrementalJSONParser alimentado em pedacos arbitrarios."""
+import json
+
+import pytest
+
+from llm.json_stream import IncrementalJSONParser, StreamingJSONError, compile_schema
+
+DOCUMENT = {"nome": "Ana \"Bia\" {Souza}", "idade": 31, "tags": ["a", {"b": [1, 2]}], "ativo": True, "nota": None}
+
+
+def feed_all(text, size):
+    parser = IncrementalJSONParser()
+    fields = []
+    for start in range(0, len(text), size):
+        fields.extend(parser.feed(text[start:start + size]))
+    return parser, fields
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_fields_are_emitted_in_order_for_any_chunking(size):
+    parser, fields = feed_all(json.dumps(DOCUMENT, ensure_ascii=False, indent=1), size)
+    assert fields == list(DOCUMENT.items())
+    assert parser.close() == DOCUMENT
+
+
+def test_field_is_emitted_as_soon_as_its_value_closes():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"nome": "Ana", "ida') == [("nome", "Ana")]
+    # Numeros so fecham no delimitador seguinte
+    assert parser.feed('de": 31') == []
+    assert parser.feed("}") == [("idade", 31)]
+    assert parser.done
+
+
+def test_malformed_json_fails_at_the_first_invalid_character():
+    parser = IncrementalJSONParser()
+    parser.feed('{"nome": "Ana"')
+    with pytest.raises(StreamingJSONError):
+        parser.feed(" x")
+
+
+def test_close_rejects_truncated_object():
+    parser = IncrementalJSONParser()
+    parser.feed('{"nome": "Ana", "idade": 3')
+    with pytest.raises(StreamingJSONError, match="incompleto"):
+        parser.close()
+
+
+def test_compiled_schema_validates_field_by_field():
+    schema = compile_schema("pessoa", {
+        "type": "object",
+        "properties": {"nome": {"type": "string"}, "idade": {"type": "integer"}},
+        "required": ["nome", "idade"],
+        "additionalProperties": False,
+    })
+    assert schema.validate_field("nome", "Ana") == []
+    assert schema.validate_field("idade", "31")
+    assert schema.validate_field("extra", 1)
+    assert schema.missing_required({"nome"}) == ["$.idade: campo obrigatorio ausente"]
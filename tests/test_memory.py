@@ -0,0 +1,71 @@
+"""Janela da ConversationMemory: tool calls entram e saem junto com seus resultados."""
+import pytest
+
+from llm.memory import SUMMARY_PREFIX, ConversationMemory
+from llm.tokens import TokenBudgetExceeded, count_message_tokens
+
+
+def tool_turn(call_ids, content="ok"):
+    calls = [{"id": call_id, "type": "function", "function": {"name": "buscar", "arguments": "{}"}}
+             for call_id in call_ids]
+    return [{"role": "assistant", "content": None, "tool_calls": calls}] + [
+        {"role": "tool", "tool_call_id": call_id, "content": content} for call_id in call_ids
+    ]
+
+
+def conversation():
+    messages = [{"role": "system", "content": "Voce e um assistente."},
+                {"role": "user", "content": "Pesquise tudo sobre o produto " + "detalhes " * 40}]
+    messages += tool_turn(["call_1", "call_2"], content="resultado " * 30)
+    messages += [{"role": "assistant", "content": "Pronto."}, {"role": "user", "content": "E o preco?"}]
+    return messages
+
+
+def assert_no_orphan_tools(window):
+    answered = set()
+    for message in window:
+        if message.get("tool_calls"):
+            answered = {call["id"] for call in message["tool_calls"]}
+        elif message["role"] == "tool":
+            assert message["tool_call_id"] in answered
+        else:
+            answered = set()
+
+
+def test_groups_keep_tool_results_with_their_assistant():
+    memory = ConversationMemory()
+    memory.extend(conversation())
+    assert memory._groups() == [[1], [2, 3, 4], [5], [6]]
+
+
+@pytest.mark.parametrize("budget", [60, 120, 180, 400])
+def test_window_never_splits_a_tool_group(budget):
+    memory = ConversationMemory(budget=budget)
+    memory.extend(conversation())
+    try:
+        window = memory.window()
+    except TokenBudgetExceeded:
+        return
+    assert_no_orphan_tools(window)
+    tool_calls = [m for m in window if m.get("tool_calls")]
+    tools = [m for m in window if m["role"] == "tool"]
+    assert (len(tool_calls), len(tools)) in ((0, 0), (1, 2))
+    assert window[0]["role"] == "system" and window[-1]["content"] == "E o preco?"
+    assert count_message_tokens(window, memory.model) <= budget
+
+
+def test_dropped_tool_group_is_summarized_once():
+    summaries = []
+
+    def summarize(previous, messages):
+        summaries.append([m["role"] for m in messages])
+        return "usuario pediu dados do produto"
+
+    memory = ConversationMemory(budget=120, summarize=summarize, summary_tokens=20)
+    memory.extend(conversation())
+    window = memory.window()
+    memory.window()
+
+    assert summaries == [["user", "assistant", "tool", "tool"]]
+    assert window[1] == {"role": "system", "content": f"{SUMMARY_PREFIX} usuario pediu dados do produto"}
+    assert_no_orphan_tools(window)
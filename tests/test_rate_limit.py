@@ -0,0 +1,79 @@
+"""Fila do RateLimiter com esperas canceladas e headers de outros endpoints."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("openai")
+
+from llm.rate_limit import RateLimiter
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        limiter = RateLimiter(rpm=60, tpm=1_000_000)
+        limiter.requests.level = 0.0          # o proximo request so cabe em ~1s
+        waiter = asyncio.create_task(limiter.aacquire(10))
+        await asyncio.sleep(0.05)
+        assert limiter.stats()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.stats()["queued"] == 0
+        # Quem chega depois nao fica preso atras do ticket cancelado
+        limiter.requests.level = 1.0
+        await asyncio.wait_for(limiter.aacquire(10), timeout=1.0)
+
+    asyncio.run(scenario())
+
+
+def _response(url, limit):
+    return httpx.Response(200, headers={"x-ratelimit-limit-requests": str(limit)},
+                          request=httpx.Request("POST", url))
+
+
+def test_only_chat_completions_headers_adjust_limits():
+    limiter = RateLimiter(rpm=500, base_url="https://api.openai.com/v1")
+    limiter.observe_headers(_response("https://api.openai.com/v1/embeddings", 10))
+    limiter.observe_headers(_response("http://localhost:11434/v1/chat/completions", 10))
+    assert limiter.requests.capacity == 500
+    limiter.observe_headers(_response("https://api.openai.com/v1/chat/completions", 100))
+    assert limiter.requests.capacity == pytest.approx(95)
+
+
+def test_rate_limit_error_is_not_retried_by_the_limiter():
+    openai = pytest.importorskip("openai")
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        response = httpx.Response(429, headers={"x-ratelimit-reset-requests": "1s"},
+                                  request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        raise openai.RateLimitError("rate limited", response=response, body=None)
+
+    limiter = RateLimiter(rpm=500, tpm=1_000_000)
+    with pytest.raises(openai.RateLimitError):
+        limiter.wrap(create)(model="gpt-4o-mini", messages=[], max_tokens=5, priority=0)
+    # Uma tentativa so: quem retenta e o Retry; o limiter so esvazia os buckets
+    assert len(calls) == 1 and "priority" not in calls[0]
+    assert limiter.stats()["rate_limited"] == 1
+    assert limiter.requests.level < 0
+
+
+def test_close_unregisters_the_header_hook():
+    from llm import transport
+
+    limiter = RateLimiter(rpm=500)
+    assert limiter.observe_headers in transport._response_hooks
+    limiter.close()
+    assert limiter.observe_headers not in transport._response_hooks
+
+
+def test_layer_params_never_reach_the_sdk():
+    from llm import client
+
+    received = {}
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: received.update(kw))))
+    client._api_create(client=fake, model="gpt-4o-mini", messages=[], priority=0, semantic_cache=True)
+    assert received == {"model": "gpt-4o-mini", "messages": []}
@@ -0,0 +1,27 @@
+"""Hedge assincrono cancelado antes de disparar a copia."""
+import asyncio
+
+from llm.resilience import Hedge
+
+
+def test_cancel_during_first_wait_cancels_primary():
+    async def scenario():
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def acreate(**kwargs):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        hedged = Hedge(initial_delay=5.0).wrap_async(acreate)
+        caller = asyncio.create_task(hedged(model="gpt-4o-mini", messages=[], hedge=True))
+        await started.wait()
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        # O primario nao fica orfao rodando depois que quem chamou desistiu
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
+
+    asyncio.run(scenario())
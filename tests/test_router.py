@@ -0,0 +1,54 @@
+"""Router com backends fora da tabela de precos de llm.cost."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("openai")
+
+from llm.cost import CostTracker
+from llm.router import Backend, Router
+
+MESSAGES = [{"role": "user", "content": "Explique o que e Docker em uma frase."}]
+
+
+def fake_create(**kwargs):
+    kwargs.pop("client", None)
+    return SimpleNamespace(model=kwargs["model"], usage=SimpleNamespace(prompt_tokens=12, completion_tokens=7))
+
+
+def pipeline(router, costs):
+    # Mesma ordem de main.py: o custo por dentro do Router (ve o modelo escolhido)
+    return router.wrap(costs.wrap(fake_create))
+
+
+def test_routes_to_unpriced_backend():
+    local = Backend("local", "llama3.1", base_url="http://localhost:11434/v1")
+    assert local.price is None
+    router = Router([local], explore=0.0)
+    costs = CostTracker()
+
+    response = pipeline(router, costs)(model="gpt-4o-mini", messages=MESSAGES, max_tokens=50)
+
+    assert response.model == "llama3.1"
+    assert router.stats()["backends"]["local"]["failures"] == 0
+    stats = costs.stats()
+    assert stats["spent"] == 0.0
+    assert stats["unpriced"] == {"llama3.1": {"calls": 1, "prompt_tokens": 12, "completion_tokens": 7}}
+
+
+def test_unpriced_backend_is_skipped_under_budget():
+    router = Router([
+        Backend("local", "llama3.1", base_url="http://localhost:11434/v1"),
+        Backend("mini", "gpt-4o-mini"),
+    ], explore=0.0)
+    costs = CostTracker(budget=1.0)
+
+    response = pipeline(router, costs)(model="gpt-4o-mini", messages=MESSAGES, max_tokens=50)
+
+    assert response.model == "gpt-4o-mini"
+    stats = router.stats()
+    assert stats["failovers"] == 1
+    # Pular por falta de preco nao conta contra a saude do backend
+    assert stats["backends"]["local"]["failures"] == 0
+    assert stats["backends"]["local"]["state"] == "closed"
+    assert costs.stats()["spent"] > 0
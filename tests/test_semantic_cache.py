@@ -0,0 +1,65 @@
+"""SemanticCache: opt-in por chamada e embeddings de dimensao diferente da do indice."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("openai")
+
+from llm.semantic_cache import HashingEmbedder, SemanticCache
+
+
+def response(content):
+    message = SimpleNamespace(content=content, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(finish_reason="stop", message=message)])
+
+
+def test_dimension_mismatch_bypasses_the_cache():
+    semantic = SemanticCache(embedder=HashingEmbedder(dim=64), threshold=0.9)
+    create = semantic.wrap(lambda **kwargs: response("ok"))
+    call = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "Meu pedido nao chegou"}], semantic_cache=True)
+    create(**call)
+
+    semantic.embedder = HashingEmbedder(dim=32)
+    assert create(**call).choices[0].message.content == "ok"
+    stats = semantic.stats()
+    assert stats["index_errors"] == 1
+    assert stats["bypassed"] == 1
+
+
+def test_only_opted_in_calls_use_the_cache():
+    semantic = SemanticCache(embedder=HashingEmbedder(dim=64), threshold=0.5)
+    seen = []
+
+    def create(**kwargs):
+        seen.append(kwargs)
+        return response(kwargs["messages"][-1]["content"])
+
+    wrapped = semantic.wrap(create)
+    messages = [{"role": "user", "content": "Tenho 32 anos"}]
+    wrapped(model="gpt-4o-mini", messages=messages, temperature=0, semantic_cache=True)
+    # Extracao sem opt-in: parafrase proxima nao reaproveita o dado do outro texto
+    out = wrapped(model="gpt-4o-mini", messages=[{"role": "user", "content": "Tenho 33 anos"}], temperature=0)
+    assert out.choices[0].message.content == "Tenho 33 anos"
+    assert "semantic_cache" not in seen[0]
+    assert semantic.stats()["hits"] == 0
+
+
+def test_async_with_persistence(tmp_path):
+    import asyncio
+
+    semantic = SemanticCache(embedder=HashingEmbedder(dim=64), threshold=0.9, path=str(tmp_path / "semantic"))
+
+    async def acreate(**kwargs):
+        from openai.types.chat import ChatCompletion
+
+        return ChatCompletion.model_validate({
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": kwargs["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+        })
+
+    call = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "Meu pedido nao chegou"}], semantic_cache=True)
+    wrapped = semantic.wrap_async(acreate)
+    asyncio.run(wrapped(**call))
+    asyncio.run(wrapped(**call))
+    assert semantic.stats()["hits"] == 1
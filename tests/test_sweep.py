@@ -0,0 +1,31 @@
+"""Sweep com parametros repetidos entre params e grade, e pontos que falham."""
+from types import SimpleNamespace
+
+from llm.sweep import Sweep
+
+
+class FakeEngine:
+    """Responde com a temperature pedida; temperature acima de 1 falha."""
+
+    def map_timed(self, calls, return_exceptions=False):
+        results = []
+        for kwargs in calls:
+            if kwargs["temperature"] > 1:
+                results.append((ValueError("temperature fora do intervalo"), None))
+                continue
+            choice = SimpleNamespace(index=0, message=SimpleNamespace(content=f"t={kwargs['temperature']}"),
+                                     finish_reason="stop")
+            results.append((SimpleNamespace(choices=[choice], usage=None), 0.01))
+        return results
+
+
+def test_grid_overrides_params_and_errors_stay_with_their_point():
+    sweep = Sweep(prompts={"p": "Oi"}, grid={"temperature": [0.0, 1.5]}, params={"temperature": 1.0, "max_tokens": 5})
+    assert [kwargs["temperature"] for *_, kwargs in sweep.calls()] == [0.0, 1.5]
+
+    result = sweep.run(engine=FakeEngine())
+    ok, failed = result.points
+    assert ok.outputs == ["t=0.0"] and ok.error is None
+    assert failed.error == "ValueError: temperature fora do intervalo"
+    assert result.errors == [failed]
+    assert [row["error"] for row in result.rows()] == [None, failed.error]